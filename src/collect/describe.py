@@ -1,8 +1,11 @@
-import glob
 import os
 import sys
+import time
+import sqlite3
 import pandas as pd
 import traceback
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 def read_domain_names(fname):
     if fname == "aggre_all_v3.csv":
@@ -12,48 +15,120 @@ def read_domain_names(fname):
     return input_df["domain"].tolist()
 
 
+# ----------------- #
+#  Snapshot Census  #
+# ----------------- #
+
+def scan_domain(task):
+    """Worker: (domain, folder, mtime of the folder, timestamps of its snapshots, error), the timestamps read from the
+    file names (<timestamp>.snapshot, as glob("*.snapshot") lists them)
+    """
+    domain, domain_path = task
+    try:
+        mtime = os.stat(domain_path).st_mtime_ns
+        with os.scandir(domain_path) as entries:
+            timestamps = [entry.name[:-9] for entry in entries if entry.name.endswith(".snapshot") and not entry.name.startswith(".")]
+        return domain, domain_path, mtime, timestamps, ""
+    except Exception:
+        return domain, domain_path, None, [], traceback.format_exc()
+
+def count_by_date(timestamps):
+    """([(date, # of snapshots)], # of timestamps that are not dates) of timestamps (YYYYMMDD...)"""
+    dates = pd.to_datetime(pd.Series(timestamps, dtype=object).str[:8], format="%Y%m%d", errors="coerce")
+    counts = dates.dropna().dt.strftime("%Y-%m-%d").value_counts().sort_index()
+    return list(counts.items()), int(dates.isna().sum())
+
+class SnapshotCensus:
+    def __init__(self, fpath):
+        """The # of snapshots of every domain folder by day, with the mtime of the folder when it was counted, in a SQLite
+        database; a folder is only counted again when its mtime has changed (snapshots added or removed)
+        """
+        self.conn = sqlite3.connect(fpath)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS folders (domain_path TEXT PRIMARY KEY, domain TEXT, mtime INTEGER)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS counts (
+            domain_path TEXT, domain TEXT, date TEXT, n_snapshots INTEGER, PRIMARY KEY (domain_path, date))""")
+        self.conn.commit()
+
+    def mtimes(self):
+        return dict(self.conn.execute("SELECT domain_path, mtime FROM folders").fetchall())
+
+    def record(self, domain, domain_path, mtime, counts):
+        with self.conn:
+            self.conn.execute("DELETE FROM counts WHERE domain_path = ?", (domain_path,))
+            self.conn.executemany("INSERT INTO counts VALUES (?, ?, ?, ?)", [(domain_path, domain, date, n) for date, n in counts])
+            self.conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)", (domain_path, domain, mtime))
+
+    def forget(self, domain_path):
+        with self.conn:
+            self.conn.execute("DELETE FROM counts WHERE domain_path = ?", (domain_path,))
+            self.conn.execute("DELETE FROM folders WHERE domain_path = ?", (domain_path,))
+
+    def census(self):
+        """The # of snapshots by domain and day (summed over the input folders)"""
+        return pd.read_sql_query(
+            "SELECT domain, date, SUM(n_snapshots) AS n_snapshots FROM counts GROUP BY domain, date ORDER BY domain, date", self.conn)
+
+    def close(self):
+        self.conn.close()
+
+def describe_snapshots(input_folder, output_fpath, domains, n_workers=0):
+    """Count the snapshots of every domain by day, the domain folders being scanned by a pool of threads, and save the
+    counts (domain, date, n_snapshots) to output_fpath. The counts of every folder are kept in output_fpath.sqlite,
+    so a rerun (or a run over another input folder) only scans the folders that are new or have changed.
+    """
+    census = SnapshotCensus(output_fpath + ".sqlite")
+    mtimes = census.mtimes()
+    tasks = []
+    for domain in domains:
+        domain_new = "www." + domain.replace("/", "[slash]")
+        domain_path = os.path.abspath(os.path.join(input_folder, domain_new))
+        tasks.append((domain, domain_path))
+
+    if n_workers == 0:
+        n_workers = max(cpu_count()-2, 1)
+    start = time.time()
+    n_scanned, n_skipped, n_snapshots = 0, 0, 0
+    with ThreadPool(n_workers) as pool:
+        for i,(domain, domain_path, mtime, timestamps, error) in enumerate(pool.imap(scan_domain, tasks, chunksize=64)):
+            if i%1000 == 0:
+                print("progress:", i/len(tasks))
+            if mtime is None:
+                if os.path.exists(domain_path):
+                    print(error)
+                elif domain_path in mtimes:  # removed since the last run
+                    census.forget(domain_path)
+                continue
+            if mtimes.get(domain_path) == mtime:
+                n_skipped += 1
+                continue
+            counts, n_bad = count_by_date(timestamps)
+            if n_bad > 0:
+                print(f"{domain}: {n_bad} snapshots without a date")
+            census.record(domain, domain_path, mtime, counts)
+            n_scanned += 1
+            n_snapshots += len(timestamps)
+    print(f"Scanned {n_scanned} domains ({n_snapshots} snapshots), {n_skipped} unchanged, in {time.time()-start:.1f}s")
+
+    df = census.census()
+    df.to_csv(output_fpath + ".tmp", index=False)
+    os.replace(output_fpath + ".tmp", output_fpath)
+    census.close()
+    return df
+
+
 if __name__ == "__main__":
     INPUT_FOLDER = sys.argv[1]
     DOMAIN_SHEET = "/home/yijingch/index/domain_list_all.csv"
     OUTPUT_FPATH = sys.argv[2]
+    N_WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else 0
     domains = read_domain_names(DOMAIN_SHEET)
 
-    # timels = []
-    domainls = []
-    fullpathls = []
-
-    for i,domain in enumerate(domains):
-        if i%1000 == 0:
-            print("progress:", i/len(domains))
-        try:
-            domain_new = "www." + domain.replace("/", "[slash]")
-            domain_path = os.path.join(INPUT_FOLDER + "/" + domain_new)
-            if not os.path.exists(domain_path):
-                continue
-            snapshots = glob.glob((INPUT_FOLDER + "/{}/*.snapshot").format(domain_new))
-            for ss in snapshots:
-                fullpathls.append(ss)
-                # time = os.path.basename(ss[:-9])
-                # timels.append(time)
-                domainls.append(domain)
-        except Exception:
-            print(traceback.format_exc())
-            continue
-
-    df = pd.DataFrame()
-    df["domain"] = domainls
-    df["fullpath"] = fullpathls
-    # df["timestamp"] = timels
-    # df["date"] = df["timestamp"].map(lambda x: str(x)[:4]+"-"+str(x)[4:6]+"-"+str(x)[6:8])
-    # df["date"] = pd.to_datetime(df["date"])
-    # df = df.drop(columns=["timestamp"])
-    if os.path.exists(OUTPUT_FPATH):
-        df.to_csv(OUTPUT_FPATH, mode="a", header=False, index=False)
-    else:
-        df.to_csv(OUTPUT_FPATH, index=False)
+    describe_snapshots(INPUT_FOLDER, OUTPUT_FPATH, domains, n_workers=N_WORKERS)
 
 
 # python3 describe.py /home/cbudak/website /home/yijingch/output/describe_snapshots_2016.csv -- finished!
 # python3 describe.py /home/cbudak/website20160615_20161130 /home/yijingch/output/describe_snapshots_2016.csv -- finished!
 # python3 describe.py /home/cbudak/website20200615_20201130 /home/yijingch/output/describe_snapshots_2020.csv -- finished!
-# 092422 - finished all
\ No newline at end of file
+# 092422 - finished all
+# (now the # of snapshots by domain and day: domain, date, n_snapshots; rerunning only scans the changed domain folders,
+# an optional third argument sets the # of threads)
@@ -2,10 +2,12 @@ import glob
 import os
 import re
 import subprocess
+import time
 import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
-from multiprocessing import  Pool
+from bs4.dammit import EncodingDetector
+from snapshot_manifest import SnapshotManifest, run_snapshot_tasks, scan_snapshot, scan_anchors_fast, anchor_texts_fast
 import sys
 import traceback
 
@@ -13,6 +15,8 @@ text_count_thresh = 3
 link_count_thresh = 5
 
 ROOTPATH = os.getcwd()
+SNAPSHOT_TIMEOUT = 600  # seconds per snapshot and parser (0: no limit)
+MAX_SNAPSHOT_BYTES = 50 * 1024 * 1024  # larger snapshots go to the fallback parser (0: no limit)
 
 # ------------ #
 # Read Domains #
@@ -22,33 +26,83 @@ def read_domain_names(filename):
     input_df = pd.read_csv(filename)
     return input_df[["domain"]]
 
-# -------------- #
-#  Scraper Class #
-# -------------- #
+# ---------------- #
+#  Link Extraction #
+# ---------------- #
 
-class WayBackMachineScraper:
+def format_link(domain, snapshot, url, textinurl):
+    return domain + "\t" + snapshot + "\t" + url.replace('\t', ' ').replace('\n', ' ').replace('\r', ' ') + "\t" + textinurl + "\n"
 
- def extract_links_from_body(outf, domain, snapshot, snapshot_path, ts):
-    with open(snapshot_path, "rb") as f: 
+def extract_links_from_body(outf, domain, snapshot, snapshot_path, ts):
+    outf.write("".join(format_link(domain, snapshot, url, textinurl) for url, textinurl in scan_links(snapshot_path)))
+
+def scan_links(snapshot_path):
+    """(href, texts) of every anchor with an href"""
+    with open(snapshot_path, "rb") as f:
         snapshot_body = BeautifulSoup(f, 'html.parser')# 'lxml')
+    links = []
     for link in snapshot_body.find_all('a'):
-        try:
-            if link.get('href') != None:
-                url = link.get('href').replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
-                textinurl = str(link.findAll(text=True))
-                outf.write(domain + "\t" + snapshot + "\t" + url + "\t" + textinurl + "\n")
-        except Exception as e:
-            raise e
+        if link.get('href') != None:
+            links.append((link.get('href'), str(link.findAll(text=True))))
+    return links
+
+def scan_links_fast(snapshot_path):
+    """The fallback of scan_links for snapshots that are too large or too slow (regular expressions, approximate)"""
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    encoding = next(iter(EncodingDetector(data, is_html=True).encodings), "utf-8")
+    return [(href, str(anchor_texts_fast(inner))) for href, inner in scan_anchors_fast(data.decode(encoding, errors="replace"))]
+
+def extract_snapshot_links(task):
+    """Worker: the output lines of one snapshot and its manifest record
+    (domain, snapshot, lines, status, parser, # of links, # of bytes, seconds, error)
+    """
+    domain, snapshot, snapshot_path, ts, timeout, max_bytes = task
+    start = time.time()
+    links, status, parser, n_bytes, error = scan_snapshot(scan_links, scan_links_fast, snapshot_path, timeout, max_bytes, parser="html.parser")
+    lines = "".join(format_link(domain, snapshot, url, textinurl) for url, textinurl in links)
+    return domain, snapshot, lines, status, parser, len(links), n_bytes, time.time()-start, error
+
+def extract_all_links(input_folder, output_folder, domains, n_workers=0, timeout=SNAPSHOT_TIMEOUT, max_bytes=MAX_SNAPSHOT_BYTES):
+    """Extract the links of all domains with a pool of workers, recording the status of every snapshot in a manifest
+    (output_folder/manifest.sqlite) to resume an interrupted run at the unfinished snapshots.
+    A snapshot over max_bytes, or not parsed within timeout seconds, goes to the fast fallback parser.
+    """
+    manifest = SnapshotManifest(output_folder + "manifest.sqlite")
+    domain_tasks = []
+    for domain in domains:
+        # new: get the snapshot folder (now that the input folder has restructured a little)
+        domain_new = "www." + domain
+        domain_path = glob.glob(input_folder + "/*/" + domain_new)
+        if len(domain_path) == 0: # no input snapshot
+            continue
+        else:
+            domain_path = domain_path[0]
+
+        newfile = output_folder + domain_new + '_All-Extracted-Links.tsv'
+        if manifest.skip_domain(domain, newfile):
+            print("Skipping file", newfile)
+            continue
+        tasks = []
+        for snapshot_path in glob.glob(domain_path + "/*.snapshot"): # modified
+            timestamp = os.path.basename(snapshot_path[:-9])
+            snapshot = snapshot_path.replace(input_folder + domain_new + "/","")
+            snapshot = snapshot.replace(".snapshot", "")
+            tasks.append((domain, snapshot, snapshot_path, timestamp, timeout, max_bytes))
+        domain_tasks.append((domain, newfile, tasks))
+    run_snapshot_tasks(extract_snapshot_links, domain_tasks, manifest, n_workers=n_workers)
+    manifest.close()
 
 # ------------------------------------------------------- Main ------------------------------------------------------- #
 
- if __name__ == '__main__':
+if __name__ == '__main__':
 
-    INPUT_FOLDER = sys.argv[1]  
+    INPUT_FOLDER = sys.argv[1]
     DOMAIN_SHEET = "/home/yijingch/index/domain_list_all.csv"
     domain_df = read_domain_names(DOMAIN_SHEET)
-    OUTPUT_FOLDER = sys.argv[2] 
-    
+    OUTPUT_FOLDER = sys.argv[2]
+    N_WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
     print(f"INPUT_FOLDER=={INPUT_FOLDER}")
     print(f"DOMAIN_SHEET=={DOMAIN_SHEET}")
     print(f"OUTPUT_FOLDER=={INPUT_FOLDER}")
@@ -56,40 +110,13 @@ class WayBackMachineScraper:
     try: os.mkdir(OUTPUT_FOLDER)
     except: pass
 
-    for domain in domain_df["domain"].tolist():
+    extract_all_links(INPUT_FOLDER, OUTPUT_FOLDER, domain_df["domain"].tolist(), n_workers=N_WORKERS)
     # for domain in ["aim4truth.org"]:  # for test run locally, e.g., "amherst.edu"
-        try:                 
-            # new: get the snapshot folder (now that the input folder has restructured a little)
-            domain_new = "www." + domain
-            domain_path = glob.glob(INPUT_FOLDER + "/*/" + domain_new)
-            if len(domain_path) == 0: # no input snapshot
-                continue
-            else:
-                domain_path = domain_path[0]
-                
-            newfile = OUTPUT_FOLDER + domain_new + '_All-Extracted-Links.tsv'
-            if os.path.exists(newfile):
-                print("Skipping file", newfile)
-                continue
-            print("Processing", domain)
-            snapshot_paths = glob.glob(domain_path + "/*.snapshot") # modified
-            outf = open(newfile, "w")
-            for snapshot_path in snapshot_paths:
-                timestamp = os.path.basename(snapshot_path[:-9])
-                snapshot = snapshot_path.replace(INPUT_FOLDER + domain_new + "/","")
-                snapshot = snapshot.replace(".snapshot", "")
-                extract_links_from_body(outf, domain, snapshot, snapshot_path, timestamp)
-            outf.close()
-        except Exception:
-            print(traceback.format_exc())
-            continue
 
 
 # cd src
-# python3 extractlinksnew-recursive.py /home/cbudak/website20200615_20201130  /home/yijingch/data/extracted_links2020/ 
+# python3 extractlinksnew-recursive.py /home/cbudak/website20200615_20201130  /home/yijingch/data/extracted_links2020/
 # notes:
 # 031024: rummormillnews.com is taking extremely long (more than 2 days), skipped (temporarily)
-# 031424: finished extracting 2020; will start 2016 once the data is ready 
-        
-        
-
+# 031424: finished extracting 2020; will start 2016 once the data is ready
+# (now with a per-snapshot timeout and size limit, and a manifest to resume: an optional third argument sets the # of workers)
@@ -2,10 +2,16 @@ import glob
 import os
 import re
 import subprocess
+import time
+import csv
+from io import BytesIO, StringIO
 import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
-from multiprocessing import  Pool
+from bs4.dammit import EncodingDetector
+from lxml import etree
+from snapshot_manifest import SnapshotManifest, run_snapshot_tasks, scan_snapshot, scan_anchors_fast, anchor_string_fast
+from filterbylinks import CAND_COLUMNS, cand_bits
 import sys
 import traceback
 
@@ -13,6 +19,8 @@ text_count_thresh = 3
 link_count_thresh = 5
 
 ROOTPATH = os.getcwd()
+SNAPSHOT_TIMEOUT = 600  # seconds per snapshot and parser (0: no limit)
+MAX_SNAPSHOT_BYTES = 50 * 1024 * 1024  # larger snapshots go to the fallback parser (0: no limit)
 
 # ------------ #
 # Read Domains #
@@ -22,13 +30,18 @@ def read_domain_names(filename):
     input_df = pd.read_csv(filename)
     return input_df[["domain"]]
 
-# -------------- #
-#  Scraper Class #
-# -------------- #
+# ---------------- #
+#  Link Extraction #
+# ---------------- #
 
-class WayBackMachineScraper:
+def clean_field(x):
+    return x.replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
 
- def extract_links_from_body(outf, domain, snapshot, snapshot_path, ts):
+def format_link(ts, domain, snapshot, text, href):
+    return ts + "\t" + domain + "\t" + snapshot + "\t" + clean_field(text) + "\t" + clean_field(href) + "\t" + str(len(text.split())) + "\n"
+
+def extract_links_from_body(outf, domain, snapshot, snapshot_path, ts):
+    """The original extractor (a full BeautifulSoup tree per snapshot)"""
     with open(snapshot_path, "rb") as f:  # modified
         snapshot_body = BeautifulSoup(f, 'lxml')
     for link in snapshot_body.find_all('a'):
@@ -36,20 +49,180 @@ class WayBackMachineScraper:
             if link.get('href') == None:
                 continue
             if link.string != None:
-                towrite = [link.string.replace('\t', ' ').replace('\n', ' ').replace('\r', ' '), link.get('href').replace('\t', ' ').replace('\n', ' ').replace('\r', ' '), len(link.string.split())]
-                outf.write(ts + "\t" + domain + "\t" + snapshot + "\t" + towrite[0] + "\t" + towrite[1] + "\t" + str(towrite[2]) + "\n")
+                outf.write(format_link(ts, domain, snapshot, link.string, link.get('href')))
         except Exception as e:
             raise e
 
+ASCII_SPACES = " \n\t\x0c\r"
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+
+def collapse_space(text, el):
+    """A string of el as BeautifulSoup stores it: a string of ASCII spaces only becomes "\n" (if it has one) or " ",
+    unless el is in a <pre> or <textarea>
+    """
+    if text.strip(ASCII_SPACES) != "":
+        return text
+    for tag in [el.tag] + [parent.tag for parent in el.iterancestors()]:
+        if isinstance(tag, str) and tag.lower() in PRESERVE_WHITESPACE_TAGS:
+            return text
+    return "\n" if "\n" in text else " "
+
+def anchor_string(el):
+    """The .string of BeautifulSoup for an lxml element: its only child if that is a text (or a comment),
+    the .string of its only child element, otherwise None (strings of spaces collapsed as BeautifulSoup does)
+    """
+    children = [el.text] if el.text else []
+    for child in el:
+        children.append(child)
+        if child.tail:
+            children.append(child.tail)
+    if len(children) != 1:
+        return None
+    child = children[0]
+    if isinstance(child, str):
+        return collapse_space(child, el)
+    if child.tag is etree.Comment:
+        return collapse_space(child.text or "", el)
+    if not isinstance(child.tag, str):  # processing instructions
+        return None
+    return anchor_string(child)
+
+def scan_links(snapshot_path):
+    """(text, href) of every anchor with an href and a .string, streaming over the document with lxml instead of building
+    a BeautifulSoup tree (same parser and encodings tried as BeautifulSoup(f, 'lxml'))
+    """
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    detector = EncodingDetector(data, is_html=True)
+    for encoding in detector.encodings:
+        links = []
+        try:
+            context = etree.iterparse(BytesIO(detector.markup), events=("end",), tag="a", html=True, encoding=encoding, recover=True, huge_tree=True)
+            for _, el in context:
+                href = el.get("href")
+                if href is not None:
+                    text = anchor_string(el)
+                    if text is not None:
+                        links.append((text, href))
+                # free the anchors (and the elements before them) once read
+                el.clear(keep_tail=True)
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+            break
+        except (UnicodeDecodeError, LookupError, etree.ParserError):
+            continue
+    return links
+
+def scan_links_fast(snapshot_path):
+    """The fallback of scan_links for snapshots that are too large or too slow (regular expressions, approximate)"""
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    encoding = next(iter(EncodingDetector(data, is_html=True).encodings), "utf-8")
+    links = []
+    for href, inner in scan_anchors_fast(data.decode(encoding, errors="replace")):
+        text = anchor_string_fast(inner)
+        if text is not None:
+            links.append((text, href))
+    return links
+
+def extract_snapshot_links(task):
+    """Worker: the output lines of one snapshot and its manifest record
+    (domain, snapshot, lines, status, parser, # of links, # of bytes, seconds, error)
+    """
+    domain, snapshot, snapshot_path, ts, timeout, max_bytes = task
+    start = time.time()
+    links, status, parser, n_bytes, error = scan_snapshot(scan_links, scan_links_fast, snapshot_path, timeout, max_bytes)
+    lines = "".join(format_link(ts, domain, snapshot, text, href) for text, href in links)
+    return domain, snapshot, lines, status, parser, len(links), n_bytes, time.time()-start, error
+
+# ------------------------------ #
+#  Fused Extraction & Filtering  #
+# ------------------------------ #
+
+FILTERED_COLUMNS = ["timestamp", "path", "domain", "headline"] + CAND_COLUMNS
+
+def filter_links(ts, domain, snapshot, links):
+    """The rows of filterbylinks.py for the links of a snapshot (the lowercased headlines mentioning a candidate, written as
+    to_csv does), the # of relevant links and the # of links of every candidate
+    """
+    out = StringIO()
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    n_relevant, n_cands = 0, [0] * len(CAND_COLUMNS)
+    for text, href in links:
+        headline = clean_field(text).lower()
+        bits = cand_bits(headline)
+        if bits == 0:
+            continue
+        if_cands = [(bits >> i) & 1 for i in range(len(CAND_COLUMNS))]
+        writer.writerow([ts, snapshot, domain, headline] + if_cands)
+        n_relevant += 1
+        n_cands = [n + x for n, x in zip(n_cands, if_cands)]
+    return out.getvalue(), n_relevant, n_cands
+
+def filter_snapshot_links(task):
+    """Worker: the relevant output lines of one snapshot (filtered as they are extracted), its manifest record
+    and its counts (timestamp, # of links, # of relevant links, # of links mentioning trump, biden and clinton)
+    """
+    domain, snapshot, snapshot_path, ts, timeout, max_bytes = task
+    start = time.time()
+    links, status, parser, n_bytes, error = scan_snapshot(scan_links, scan_links_fast, snapshot_path, timeout, max_bytes)
+    lines, n_relevant, n_cands = filter_links(ts, domain, snapshot, links)
+    counts = (ts, len(links), n_relevant, *n_cands)
+    return domain, snapshot, lines, status, parser, len(links), n_bytes, time.time()-start, error, counts
+
+def list_snapshot_tasks(input_folder, domain_new, domain, timeout, max_bytes):
+    tasks = []
+    for snapshot_path in glob.glob((input_folder + "/{}/*.snapshot").format(domain_new)):  # modified
+        timestamp = os.path.basename(snapshot_path[:-9])
+        snapshot = snapshot_path.replace(input_folder + domain_new + "/","")
+        snapshot = snapshot.replace(".snapshot", "")
+        tasks.append((domain, snapshot, snapshot_path, timestamp, timeout, max_bytes))
+    return tasks
+
+def extract_all_links(input_folder, output_folder, domains, n_workers=0, timeout=SNAPSHOT_TIMEOUT, max_bytes=MAX_SNAPSHOT_BYTES, fused=False):
+    """Extract the links of all domains: the snapshots of all domains are spread over a pool of workers (in domain order,
+    so that a domain's output is written as soon as its snapshots are done), recording their status in a manifest
+    (output_folder/manifest.sqlite) to resume an interrupted run at the unfinished snapshots.
+    A snapshot over max_bytes, or not parsed within timeout seconds, goes to the fast fallback parser.
+
+    If fused, the links are filtered as they are extracted: only the relevant links are written, to the files of
+    filterbylinks.py (*_All-Filtered-Links.tsv), with the counts of every snapshot in output_folder/snapshot_counts.tsv
+    (its manifest is output_folder/manifest-filtered.sqlite)
+    """
+    manifest = SnapshotManifest(output_folder + ("manifest-filtered.sqlite" if fused else "manifest.sqlite"))
+    suffix = '_All-Filtered-Links.tsv' if fused else '_All-Extracted-Links.tsv'
+    domain_tasks = []
+    for domain in domains:
+        domain_new = "www." + domain.replace("/", "[slash]")
+        domain_path = os.path.join(input_folder, domain_new)
+        if not os.path.exists(domain_path):
+            continue
+        newfile = output_folder + domain_new + suffix
+        if manifest.skip_domain(domain, newfile):
+            print("Skipping file", newfile)
+            continue
+        domain_tasks.append((domain, newfile, list_snapshot_tasks(input_folder, domain_new, domain, timeout, max_bytes)))
+    if fused:
+        run_snapshot_tasks(filter_snapshot_links, domain_tasks, manifest, n_workers=n_workers, header="\t".join(FILTERED_COLUMNS) + "\n")
+        counts_df = pd.DataFrame(manifest.snapshot_counts(), columns=[
+            "domain", "snapshot", "timestamp", "n_links", "n_relevant", "n_trump", "n_biden", "n_clinton", "status"])
+        counts_df.to_csv(output_folder + "snapshot_counts.tsv", sep="\t", index=False)
+    else:
+        run_snapshot_tasks(extract_snapshot_links, domain_tasks, manifest, n_workers=n_workers)
+    manifest.close()
+
 # ------------------------------------------------------- Main ------------------------------------------------------- #
 
- if __name__ == '__main__':
+if __name__ == '__main__':
 
-    INPUT_FOLDER = sys.argv[1]  
+    FUSED = "--filter" in sys.argv  # filter the links as they are extracted
+    args = [x for x in sys.argv if x != "--filter"]
+    INPUT_FOLDER = args[1]
     DOMAIN_SHEET = "/home/yijingch/index/domain_list_all.csv"
     domain_df = read_domain_names(DOMAIN_SHEET)
-    OUTPUT_FOLDER = sys.argv[2] 
-    
+    OUTPUT_FOLDER = args[2]
+    N_WORKERS = int(args[3]) if len(args) > 3 else 0
+
     print(f"INPUT_FOLDER=={INPUT_FOLDER}")
     print(f"DOMAIN_SHEET=={DOMAIN_SHEET}")
     print(f"OUTPUT_FOLDER=={INPUT_FOLDER}")
@@ -57,33 +230,12 @@ class WayBackMachineScraper:
     try: os.mkdir(OUTPUT_FOLDER)
     except: pass
 
-    for domain in domain_df["domain"].to_list():
+    extract_all_links(INPUT_FOLDER, OUTPUT_FOLDER, domain_df["domain"].to_list(), n_workers=N_WORKERS, fused=FUSED)
     # for domain in ["aim4truth.org"]:  # for test run locally, e.g., "amherst.edu"
-        try:
-            domain_new = "www." + domain.replace("/", "[slash]")
-            domain_path = os.path.join(INPUT_FOLDER, domain_new)
-            if not os.path.exists(domain_path):
-                continue
-            newfile = OUTPUT_FOLDER + domain_new + '_All-Extracted-Links.tsv'
-            if os.path.exists(newfile):
-                print("Skipping file", newfile)
-                continue
-            print("Processing", domain)
-            snapshot_paths = glob.glob((INPUT_FOLDER + "/{}/*.snapshot").format(domain_new)) # modified
-            outf = open(newfile, "w")
-            for snapshot_path in snapshot_paths:
-                timestamp = os.path.basename(snapshot_path[:-9])
-                snapshot = snapshot_path.replace(INPUT_FOLDER + domain_new + "/","")
-                snapshot = snapshot.replace(".snapshot", "")
-                extract_links_from_body(outf, domain, snapshot, snapshot_path, timestamp)
-            outf.close()
-        except Exception:
-            print(traceback.format_exc())
-            continue
 
 # python3 extractlinksnew.py /home/cbudak/website  /home/yijingch/data/extracted_links2016/ -- finished!
 # python3 extractlinksnew.py /home/cbudak/website20160615_20161130  /home/yijingch/data/extracted_links2016/ -- running!
 # python3 extractlinksnew.py /home/cbudak/website20200615_20201130  /home/yijingch/data/extracted_links2020/ -- finished!
 # 092422 - finished all
-
-
+# python3 extractlinksnew.py /home/cbudak/website20200615_20201130  /home/yijingch/data/extracted_links2020/ 32  (32 workers)
+# python3 extractlinksnew.py /home/cbudak/website20200615_20201130  /home/yijingch/data/filtered_links_ALL2020/ 32 --filter  (relevant links only, no extracted links)
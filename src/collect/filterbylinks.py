@@ -5,6 +5,11 @@ import re
 import pandas as pd
 import numpy as np
 import traceback
+import time
+import csv
+import io
+import itertools
+from multiprocessing import Pool, cpu_count
 
 
 # ------------ #
@@ -23,24 +28,71 @@ def read_domain_names(filename):
 # Filter Links #
 # ------------ #
 
-def read_and_filter(fpath):
+CHUNKSIZE = 200000  # lines read at a time
+# one pattern for all candidates finds the few relevant headlines; the words it matches in those give the candidates
+CAND_PATTERN = re.compile(r"\b(?:trump|donald|joe|biden|hillary|clinton)\b")
+CAND_COLUMNS = ["if_trump", "if_biden", "if_clinton"]
+CAND_BITS = {"trump": 1, "donald": 1, "joe": 2, "biden": 2, "hillary": 4, "clinton": 4}  # the bit of the column of every word
+
+def cand_bits(headline):
+    """The candidates mentioned in a lowercased headline, as a bitmask of CAND_COLUMNS (0: none)"""
+    bits = 0
+    for word in CAND_PATTERN.findall(headline):
+        bits |= CAND_BITS[word]
+    return bits
+
+def cand_indicators(headlines):
+    """(the mask of relevant headlines, {"if_trump": 0/1 of the relevant headlines, ...}) of lowercased headlines"""
+    mentions = headlines.str.contains(CAND_PATTERN).values
+    bits = np.fromiter(map(cand_bits, headlines[mentions]), dtype=int, count=int(mentions.sum()))
+    return mentions, {col: (bits >> i) & 1 for i, col in enumerate(CAND_COLUMNS)}
+
+def read_chunks(fpath, chunksize=CHUNKSIZE):
+    """The links of a file, chunksize lines at a time, read with the C parser as the python parser did with sep="\\t"
+    (stripped lines split at every tab with no quoting, lines with too many fields skipped, strings kept as they are:
+    the timestamps are written back unchanged). The lines with too many fields are dropped before parsing, as the
+    C parser takes them for an index column at the start of a chunk.
+    """
+    with open(fpath, "r") as f:
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if len(lines) == 0:
+                break
+            lines = [line + "\n" for line in map(str.strip, lines) if line.count("\t") < 6]
+            if len(lines) == 0:
+                continue
+            yield pd.read_csv(io.StringIO("".join(lines)), sep="\t", quoting=csv.QUOTE_NONE, engine="c", dtype=str,
+            names=["timestamp", "domain", "path", "headline", "link", "value"],
+            )
+
+def read_and_filter(fpath, chunksize=CHUNKSIZE):
     # print("processing:", fpath)
-    df = pd.read_csv(fpath, sep="\\t", quotechar="'", engine="python",
-    names=["timestamp", "domain", "path", "headline", "link", "value"], 
-    # error_bad_lines=False,  # deprecated in pandas
-    on_bad_lines="skip",
-    )
-    if len(df) > 0:
-            df["headline"] = df["headline"].map(lambda x: str(x).lower())
-            df["if_trump"] = df["headline"].str.contains(r"\btrump\b|\bdonald\b").astype(int)
-            df["if_biden"] = df["headline"].str.contains(r"\bjoe\b|\bbiden\b").astype(int)
-            df["if_clinton"] = df["headline"].str.contains(r"\bhillary\b|\bclinton\b").astype(int)
-            filtered_df = df[(df["if_trump"]==1)|(df["if_biden"]==1)|(df["if_clinton"]==1)]  # only save relevant links
-            output_df = filtered_df[["timestamp", "path", "domain", "headline", "if_trump", "if_biden", "if_clinton"]]
+    output_dfs = []
+    for df in read_chunks(fpath, chunksize):
+        df["headline"] = df["headline"].fillna("nan").map(str.lower)
+        mentions, indicators = cand_indicators(df["headline"])
+        output_df = df[mentions][["timestamp", "path", "domain", "headline"]]  # only save relevant links
+        output_dfs.append(output_df.assign(**indicators))
+    if len(output_dfs) > 0:
+        output_df = pd.concat(output_dfs, ignore_index=True)
     else:
         output_df = pd.DataFrame()
     return output_df
 
+def filter_domain(task):
+    """Worker: filter the links of one domain, (domain, message)"""
+    domain, links_fpath, newfile = task
+    try:
+        start = time.time()
+        output_df = read_and_filter(links_fpath)
+        if len(output_df)>0:
+            # written then renamed, so that an interrupted run does not leave a partial file behind
+            output_df.to_csv(newfile + ".tmp", sep="\t", index=False)
+            os.replace(newfile + ".tmp", newfile)
+        return domain, f"\tSaved {len(output_df)} links: {domain} ({time.time()-start:.1f}s)"
+    except Exception:
+        return domain, traceback.format_exc()
+
 
 # ---- Main ---- #
 
@@ -49,6 +101,7 @@ if __name__ == "__main__":
     # all domains
     INPUT_FOLDER = sys.argv[1]
     OUTPUT_FOLDER = sys.argv[2]
+    N_WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else max(cpu_count()-2, 1)
     DOMAIN_SHEET = "/home/yijingch/index/domain_list_all.csv"
     domain_df = read_domain_names(DOMAIN_SHEET)
     print("input folder:", INPUT_FOLDER)
@@ -60,28 +113,28 @@ if __name__ == "__main__":
 
 
     # keep links containing keywords
+    tasks = []
     for domain in domain_df["domain"].tolist():
-        try:
-            domain_new = "www." + domain
-            links_fpath = os.path.join(INPUT_FOLDER, domain_new + "_All-Extracted-Links.tsv")
-            if not os.path.exists(links_fpath):
-                print("Didn't find:", domain_new)
-                continue
-            newfile = OUTPUT_FOLDER + domain_new + "_All-Filtered-Links.tsv"
-            if os.path.exists(newfile):
-                print("Skipping file", newfile)
-                continue
-            print("Processing:", domain)
-            output_df = read_and_filter(links_fpath)
-            if len(output_df)>0:
-                print("\tSaving output:", domain)
-                output_df.to_csv(newfile, sep="\t", index=False)
-        except Exception:
-            print(traceback.format_exc())
+        domain_new = "www." + domain
+        links_fpath = os.path.join(INPUT_FOLDER, domain_new + "_All-Extracted-Links.tsv")
+        if not os.path.exists(links_fpath):
+            print("Didn't find:", domain_new)
+            continue
+        newfile = OUTPUT_FOLDER + domain_new + "_All-Filtered-Links.tsv"
+        if os.path.exists(newfile):
+            print("Skipping file", newfile)
             continue
+        tasks.append((domain, links_fpath, newfile))
+
+    # domains are filtered concurrently (each one in chunks, so the memory of a worker is bounded)
+    print(f"Processing {len(tasks)} domains with {N_WORKERS} workers")
+    with Pool(N_WORKERS) as pool:
+        for domain, message in pool.imap_unordered(filter_domain, tasks):
+            print(message)
 
 
 # python3 filterbylinks.py /home/yijingch/data/extracted_links2020 /home/yijingch/data/filtered_links_ALL2020/ 
+# python3 filterbylinks.py /home/yijingch/data/extracted_links2020 /home/yijingch/data/filtered_links_ALL2020/ 16  (16 workers)
         
 
 # notes:
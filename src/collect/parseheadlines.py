@@ -5,6 +5,9 @@ import numpy as np
 import glob 
 import traceback
 import os 
+import shutil
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import yaml
 
@@ -14,25 +17,35 @@ with open("../src/configs.yml", "r") as configs:
 YEAR = 2020
 INPUTPATH = configs["DATAPATH"] + f"headlines/filtered_links_ALL{YEAR}/"
 OUTPUTPATH = configs["ROOTPATH"] + "data/"
+OUTPUT_FORMAT = "parquet"  # "parquet": the dataset headline/headlines_{YEAR}/ (partitioned by candidate/day), "tsv": headline/headlines_{YEAR}_all.tsv
 
 
-def parse_headlines(fpath:str) -> pd.DataFrame:
-    """Parse headlines from a given folder into a pd.DataFrame"""
+def read_headline_file(fp:str) -> pd.DataFrame:
+    try:
+        return pd.read_csv(fp, sep="\t")
+    except Exception:
+        print(traceback.format_exc())
+        return None
+
+
+def parse_headlines(fpath:str, n_workers:int = 0) -> pd.DataFrame:
+    """Parse headlines from a given folder into a pd.DataFrame (the files are read by a pool of threads and concatenated once)"""
     files = glob.glob(fpath + "*.tsv") 
     print("loading from:", fpath)
     print("\t# of domains:", len(files))
 
-    df = pd.DataFrame()
-    for i,fp in enumerate(files):
-        if i%500 == 0: print("porgress:", i/len(files))
-        try:
-            this_df = pd.read_csv(fp, sep="\t")
-        except Exception:
-            print(traceback.format_exc())
-            continue 
-        if len(this_df) > 0:
-            df = pd.concat([this_df, df])
-    return df 
+    if n_workers == 0:
+        n_workers = max(cpu_count()-2, 1)
+    dfs = []
+    with ThreadPool(n_workers) as pool:
+        for i,this_df in enumerate(pool.imap(read_headline_file, files, chunksize=16)):
+            if i%500 == 0: print("porgress:", i/len(files))
+            if this_df is not None and len(this_df) > 0:
+                dfs.append(this_df)
+    if len(dfs) == 0:
+        return pd.DataFrame()
+    # the last file first, as the rows were ordered when every file was put before the previous ones
+    return pd.concat(dfs[::-1], ignore_index=True)
 
 
 def basic_clean_and_split(df:pd.DataFrame, year:int) -> pd.DataFrame:
@@ -46,11 +59,10 @@ def basic_clean_and_split(df:pd.DataFrame, year:int) -> pd.DataFrame:
     else:
         print("Please enter a valid year value! (int: 2016 or 2020)")
 
-    df["date"] = df["timestamp"].map(lambda x: str(x)[:4]+"-"+str(x)[4:6]+"-"+str(x)[6:8])
-    df["date"] = pd.to_datetime(df["date"])
+    df["date"] = pd.to_datetime(df["timestamp"].astype(str).str[:8], format="%Y%m%d")
 
     df = df.rename(columns={"headline":"textbody"})
-    df["textbody"] = df["textbody"].map(lambda x: str(x).strip())
+    df["textbody"] = df["textbody"].fillna("nan").astype(str).str.strip()
 
     cols = ["date", "textbody", "domain", "path"]
     df1 = df[df[f"if_{cand1}"]==1].copy()[cols]
@@ -61,10 +73,30 @@ def basic_clean_and_split(df:pd.DataFrame, year:int) -> pd.DataFrame:
     df_out = pd.concat([df1, df2]).reset_index().drop(columns="index")
     return df_out
     
+def save_headline_dataset(df_out:pd.DataFrame, fpath:str) -> None:
+    """Save the headlines as a Parquet dataset partitioned by candidate and day (load with columnar_output.load_headline_dataset,
+    or chunk by chunk with columnar_output.iter_headline_dataset), replacing an earlier dataset.
+    "row" keeps the order of the rows, so that the first of duplicated headlines is the same as in the tsv; every file holds
+    its rows in this order, so that the files can be read in sequence and merged on "row".
+    """
+    import pyarrow as pa  # only needed for OUTPUT_FORMAT = "parquet"
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df_out[["textbody", "domain", "path"]].astype(str), preserve_index=False)
+    table = table.append_column("row", pa.array(np.arange(len(df_out), dtype=np.int64)))
+    days = df_out["date"].dt.strftime("%Y-%m-%d")
+    shutil.rmtree(fpath, ignore_errors=True)
+    for (cand, day), rows in pd.DataFrame({"candidate": df_out["candidate"].astype(str).values, "day": days.values}).groupby(["candidate", "day"]).indices.items():
+        os.makedirs(fpath + f"candidate={cand}/day={day}/", exist_ok=True)
+        pq.write_table(table.take(rows), fpath + f"candidate={cand}/day={day}/part-0.parquet")
+
+
 def main():
     df = parse_headlines(INPUTPATH)
     df_out = basic_clean_and_split(df, year=YEAR)
-    df_out.to_csv(OUTPUTPATH + f"headline/headlines_{YEAR}_all.tsv", sep="\t", index=False)
+    if OUTPUT_FORMAT == "parquet":
+        save_headline_dataset(df_out, OUTPUTPATH + f"headline/headlines_{YEAR}/")
+    else:
+        df_out.to_csv(OUTPUTPATH + f"headline/headlines_{YEAR}_all.tsv", sep="\t", index=False)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,269 @@
+import os
+import re
+import time
+import html
+import signal
+import sqlite3
+import traceback
+from multiprocessing import Pool, cpu_count
+
+WRITE_BUFFER = 1 << 20  # bytes buffered per output file
+COMMIT_EVERY = 64  # snapshots written between two manifest commits
+
+# ---------------------- #
+#  Timeout and Fallback  #
+# ---------------------- #
+
+class SnapshotTimeout(Exception):
+    pass
+
+def raise_timeout(signum, frame):
+    raise SnapshotTimeout()
+
+def call_with_timeout(func, timeout, *args):
+    """func(*args), interrupted with SnapshotTimeout after timeout seconds (no limit if timeout is 0; uses SIGALRM, so it has to
+    run in the main thread of a process, e.g. a pool worker)
+    """
+    if timeout <= 0:
+        return func(*args)
+    handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
+A_OPEN = re.compile(r"<a\b([^>]*)>", re.I)
+A_CLOSE = re.compile(r"</a\s*>", re.I)
+HREF = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+TAG = re.compile(r"<[^>]*>")
+ONLY_TEXT = re.compile(r"^(?:<[a-z][^>]*>)*([^<]*)(?:</[a-z][^>]*>)*$", re.I)
+
+def scan_anchors_fast(text):
+    """A fast fallback to the HTML parsers, for snapshots that are too large or too slow to parse: (href, inner html) of every
+    anchor with an href, found with regular expressions (in one pass; an anchor ends at the next </a> before the next <a).
+    Approximate: no tree is built, so malformed markup, scripts and comments are not handled as a parser would.
+    """
+    anchors = []
+    opens = list(A_OPEN.finditer(text))
+    for i,m in enumerate(opens):
+        end = opens[i+1].start() if i+1 < len(opens) else len(text)
+        close = A_CLOSE.search(text, m.end(), end)
+        href = HREF.search(m.group(1))
+        if close is None or href is None:
+            continue
+        anchors.append((html.unescape(next(x for x in href.groups() if x is not None)), text[m.end():close.start()]))
+    return anchors
+
+def anchor_string_fast(inner):
+    """Approximate .string of an anchor from its inner html: its text if it has no tags or only nested tags around one text"""
+    m = ONLY_TEXT.match(inner)
+    if m is None or len(m.group(1)) == 0:
+        return None
+    return html.unescape(m.group(1))
+
+def anchor_texts_fast(inner):
+    """Approximate findAll(text=True) of an anchor from its inner html: the texts between its tags"""
+    return [html.unescape(x) for x in TAG.split(inner) if len(x) > 0]
+
+def scan_snapshot(scan, scan_fast, snapshot_path, timeout, max_bytes, parser="lxml"):
+    """(links, status, parser, # of bytes, error) of a snapshot scanned with scan (the parser named parser), or with the
+    fallback scan_fast if it is over max_bytes or scan times out
+    """
+    status, error, links = "done", "", []
+    try:
+        n_bytes = os.path.getsize(snapshot_path)
+        if max_bytes > 0 and n_bytes > max_bytes:
+            status, parser = "fallback", "regex"
+            links = call_with_timeout(scan_fast, timeout, snapshot_path)
+        else:
+            try:
+                links = call_with_timeout(scan, timeout, snapshot_path)
+            except SnapshotTimeout:
+                status, parser = "fallback", "regex"
+                links = call_with_timeout(scan_fast, timeout, snapshot_path)
+    except SnapshotTimeout:
+        status, error, links = "timeout", f"over {timeout}s with both parsers", []
+    except Exception:
+        status, error, links = "error", traceback.format_exc(), []
+        n_bytes = 0
+    return links, status, parser, n_bytes, error
+
+# ---------- #
+#  Manifest  #
+# ---------- #
+
+class SnapshotManifest:
+    def __init__(self, fpath):
+        """The processing status of every snapshot (done, fallback, timeout or error; with the parser used, the # of links,
+        bytes and seconds) and of every domain, in a SQLite database. The output of a domain is committed with its snapshots
+        (the size of the output file after each snapshot), so a restart truncates the file to the last commit and resumes at
+        the snapshots that are not recorded.
+        """
+        self.conn = sqlite3.connect(fpath)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS snapshots (
+            domain TEXT, snapshot TEXT, status TEXT, parser TEXT, n_links INTEGER, n_bytes INTEGER, seconds REAL, error TEXT,
+            output_size INTEGER, PRIMARY KEY (domain, snapshot))""")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS domains (domain TEXT PRIMARY KEY, status TEXT, n_snapshots INTEGER)")
+        # the # of links of every snapshot by candidate, when the links are filtered as they are extracted
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS counts (
+            domain TEXT, snapshot TEXT, timestamp TEXT, n_links INTEGER, n_relevant INTEGER, n_trump INTEGER, n_biden INTEGER,
+            n_clinton INTEGER, PRIMARY KEY (domain, snapshot))""")
+        self.conn.commit()
+
+    def domain_status(self, domain):
+        row = self.conn.execute("SELECT status FROM domains WHERE domain = ?", (domain,)).fetchone()
+        return None if row is None else row[0]
+
+    def skip_domain(self, domain, newfile):
+        """Whether a domain is finished: recorded as done, or with an output file written before the manifest"""
+        status = self.domain_status(domain)
+        return status == "done" or (status is None and os.path.exists(newfile))
+
+    def recorded_snapshots(self, domain):
+        """The snapshots of a domain already processed, and the size of its output file at the last commit"""
+        rows = self.conn.execute("SELECT snapshot, output_size FROM snapshots WHERE domain = ?", (domain,)).fetchall()
+        return set(row[0] for row in rows), max([row[1] for row in rows], default=0)
+
+    def record(self, domain, rows, counts=[]):
+        """rows: (snapshot, status, parser, n_links, n_bytes, seconds, error, output_size),
+        counts: (snapshot, timestamp, n_links, n_relevant, n_trump, n_biden, n_clinton), committed with the rows
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(domain,) + tuple(row) for row in rows])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO counts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [(domain,) + tuple(row) for row in counts])
+
+    def finish_domain(self, domain):
+        with self.conn:
+            n_snapshots = self.conn.execute("SELECT COUNT(*) FROM snapshots WHERE domain = ?", (domain,)).fetchone()[0]
+            self.conn.execute("INSERT OR REPLACE INTO domains VALUES (?, ?, ?)", (domain, "done", n_snapshots))
+
+    def start_domain(self, domain):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO domains VALUES (?, ?, ?)", (domain, "started", None))
+
+    def snapshot_counts(self):
+        """The counts of all snapshots with their status: (domain, snapshot, timestamp, n_links, n_relevant, n_trump, n_biden, n_clinton, status)"""
+        return self.conn.execute(
+            "SELECT counts.*, snapshots.status FROM counts JOIN snapshots USING (domain, snapshot) ORDER BY domain, snapshot").fetchall()
+
+    def summary(self):
+        return self.conn.execute("SELECT status, parser, COUNT(*), SUM(n_bytes), SUM(seconds) FROM snapshots GROUP BY status, parser").fetchall()
+
+    def close(self):
+        self.conn.close()
+
+# ---------------- #
+#  Domain Outputs  #
+# ---------------- #
+
+class DomainWriter:
+    def __init__(self, domain, newfile, n_snapshots, manifest, output_size=0, header=""):
+        """Buffered output of one domain, written to a temporary file (resumed from output_size, or started with header) and
+        renamed when all its snapshots are done; the snapshots are recorded in the manifest every COMMIT_EVERY snapshots
+        """
+        self.domain = domain
+        self.newfile = newfile
+        self.manifest = manifest
+        self.output_size = output_size
+        self.header = header
+        self.outf = None  # opened with the first snapshot, so that only the domains in progress have an open file
+        self.pending = []
+        self.pending_counts = []
+        self.n_snapshots = n_snapshots
+        self.n_done = 0
+        self.n_links = 0
+        self.n_bytes = 0
+        self.n_failed = 0
+        self.start = time.time()
+
+    def open(self):
+        if self.outf is None:
+            tmpfile = self.newfile + ".tmp"
+            if self.output_size > 0:
+                # drop what was written after the last commit of an interrupted run
+                assert os.path.exists(tmpfile), f"{tmpfile} is missing ({self.output_size} bytes recorded in the manifest)"
+                with open(tmpfile, "r+") as f:
+                    f.truncate(self.output_size)
+                self.outf = open(tmpfile, "a", buffering=WRITE_BUFFER)
+            else:
+                self.outf = open(tmpfile, "w", buffering=WRITE_BUFFER)
+                self.outf.write(self.header)
+            self.start = time.time()
+            self.manifest.start_domain(self.domain)
+
+    def commit(self):
+        self.outf.flush()
+        os.fsync(self.outf.fileno())
+        size = os.fstat(self.outf.fileno()).st_size
+        self.manifest.record(self.domain, [row + (size,) for row in self.pending], self.pending_counts)
+        self.pending = []
+        self.pending_counts = []
+
+    def add(self, snapshot, lines, status, parser, n_links, n_bytes, seconds, error, counts=None):
+        self.open()
+        self.outf.write(lines)
+        self.pending.append((snapshot, status, parser, n_links, n_bytes, seconds, error))
+        if counts is not None:
+            self.pending_counts.append((snapshot,) + tuple(counts))
+        self.n_done += 1
+        self.n_links += n_links
+        self.n_bytes += n_bytes
+        if status in ["timeout", "error"]:
+            self.n_failed += 1
+            print(f"{status}: {self.domain} {snapshot} {error}")
+        if len(self.pending) >= COMMIT_EVERY:
+            self.commit()
+
+    def renamed(self):
+        """Whether an interrupted run renamed the output of the domain but stopped before recording the domain as done"""
+        return self.output_size > 0 and not os.path.exists(self.newfile + ".tmp") and os.path.exists(self.newfile)
+
+    def close(self):
+        if self.outf is None and self.renamed():
+            self.manifest.finish_domain(self.domain)
+            print(f"Finished {self.domain}: output already renamed")
+            return
+        self.open()
+        self.commit()
+        self.outf.close()
+        os.replace(self.newfile + ".tmp", self.newfile)
+        self.manifest.finish_domain(self.domain)
+        secs = max(time.time() - self.start, 1e-9)
+        print(f"Finished {self.domain}: {self.n_done} snapshots, {self.n_links} links, {self.n_failed} failed in {secs:.1f}s "
+              f"({self.n_done/secs:.1f} snapshots/s, {self.n_bytes/secs/1e6:.2f} MB/s)")
+
+def run_snapshot_tasks(worker, domain_tasks, manifest, n_workers=0, chunksize=16, header=""):
+    """Run worker over the snapshots of all domains with a pool of workers, writing the output of every domain in order
+
+    Args:
+        worker: a function of (domain, snapshot, ...) returning (domain, snapshot, lines, status, parser, n_links, n_bytes, seconds, error),
+            optionally followed by the counts of the snapshot (timestamp, n_links, n_relevant, n_trump, n_biden, n_clinton)
+        domain_tasks: [(domain, newfile, tasks)] for the domains that are not finished (see SnapshotManifest.skip_domain);
+            the snapshots already recorded in the manifest are left out
+        header: the first line of every output file
+    """
+    tasks, writers = [], {}
+    for domain, newfile, snapshot_tasks in domain_tasks:
+        recorded, output_size = manifest.recorded_snapshots(domain)
+        snapshot_tasks = [task for task in snapshot_tasks if task[1] not in recorded]
+        if len(recorded) > 0:
+            print(f"Resuming {domain}: {len(recorded)} snapshots already done, {len(snapshot_tasks)} left")
+        writers[domain] = DomainWriter(domain, newfile, len(snapshot_tasks), manifest, output_size, header)
+        if len(snapshot_tasks) == 0:
+            writers.pop(domain).close()
+        tasks += snapshot_tasks
+
+    if n_workers == 0:
+        n_workers = max(cpu_count()-2, 1)
+    print(f"Processing {len(tasks)} snapshots of {len(writers)} domains with {n_workers} workers")
+    with Pool(n_workers) as pool:
+        for result in pool.imap(worker, tasks, chunksize=chunksize):
+            writer = writers[result[0]]
+            writer.add(*result[1:])
+            if writer.n_done == writer.n_snapshots:
+                writers.pop(result[0]).close()
+    print("Manifest (status, parser, # of snapshots, bytes, seconds):", manifest.summary())
@@ -0,0 +1,91 @@
+"""Micro-benchmark of the text normalization: per-text latency of the previous implementations (patterns compiled on
+every call) and of the current ones (patterns compiled once), on the same texts; also checks that the outputs are equal.
+"""
+
+import re
+import sys
+import time
+import random
+import string
+
+from src.utils.text import contractions, synonyms
+from src.utils.text.contractions import _CONTRACTIONS
+from src.utils.preprocessor import STOPWORDS, clean_texts, get_tokens
+from src.utils.data_loader import headline_pipeline
+
+SYNONYMS = {"barack obama": "obama", "barack": "obama", "donald trump": "trump", "donald j trump": "trump", "joe biden": "biden",
+            "hillary clinton": "clinton", "hillary rodham clinton": "clinton", "potus": "president", "gop": "republican"}
+
+
+# ---- previous implementations ---- #
+
+def expand_before(text, drop_ownership=False):
+    def replace(match):
+        return _CONTRACTIONS[match.group(1)]
+    cre = re.compile(r"\b(" + "|".join(_CONTRACTIONS.keys()) + r")\b")
+    text = cre.sub(replace, text)
+    if drop_ownership:
+        text = text.replace("'s", "")
+    return text
+
+def clean_texts_before(text):
+    text = re.sub(r"[^\x00-\x7f]","", str(text))
+    stopwords_pattern = re.compile(r"\b(" + r"|".join(STOPWORDS) + r")\b\s*")
+    text = stopwords_pattern.sub("", str(text))
+    text = text.translate(str.maketrans("","",string.punctuation))
+    return text
+
+def replace_synonyms_before(text, synonym_dict):
+    synonym_dict = {key: value for key, value in sorted(synonym_dict.items(), key=lambda item: len(item[0]), reverse=True)}
+    def replace(match):
+        return synonym_dict[match.group(0)]
+    c_re = re.compile(r"\b(" + "|".join(synonym_dict.keys()) + r")\b")
+    return c_re.sub(replace, text)
+
+def clean_headline_before(text):
+    text = str(text).lower()
+    text = expand_before(text, drop_ownership=True)
+    text = expand_before(text, drop_ownership=True)
+    text = re.sub(r"http\S+", "", text)
+    return " ".join(get_tokens(text)).replace("president trump", "trump")
+
+
+# ---- benchmark ---- #
+
+def sample_texts(n_texts, seed=0):
+    """Headline-like texts, some with contractions, names, urls and non-english characters"""
+    random.seed(seed)
+    words = ["the", "president", "trump", "joe", "biden", "barack", "obama", "says", "won't", "it's", "election", "vote",
+             "hillary", "clinton", "gop", "potus", "campaign", "news", "of", "in", "a", "http://t.co/x1", "élection", "can't"]
+    return [" ".join(random.choices(words, k=random.randint(5, 15))) for _ in range(n_texts)]
+
+def per_text_us(func, texts, n_repeat=3):
+    """The best per-text latency (microseconds) of func over n_repeat passes over the texts"""
+    best = float("inf")
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1e6
+
+def benchmark(n_texts=20000):
+    texts = sample_texts(n_texts)
+    pipeline = headline_pipeline(lemmatize=False)
+    cases = [
+        ("contractions.expand", lambda x: expand_before(x, drop_ownership=True), lambda x: contractions.expand(x, drop_ownership=True)),
+        ("preprocessor.clean_texts", clean_texts_before, clean_texts),
+        ("synonyms.replace", lambda x: replace_synonyms_before(x, SYNONYMS), lambda x: synonyms.replace(x, SYNONYMS)),
+        ("clean_headline (no lemmas)", clean_headline_before, pipeline),
+    ]
+    print(f"{'':28s}{'before (us/text)':>18s}{'after (us/text)':>18s}{'speedup':>10s}  same output")
+    for name, before, after in cases:
+        same = [before(x) for x in texts] == [after(x) for x in texts]
+        t_before, t_after = per_text_us(before, texts), per_text_us(after, texts)
+        print(f"{name:28s}{t_before:18.2f}{t_after:18.2f}{t_before/t_after:9.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+
+# python -m src.preprocess.benchmark_text_normalization 20000  (from the root of the repository)
@@ -0,0 +1,106 @@
+"""Code for storing bootstrap arrays (runs x dates x topics/words, or runs x topics/words for sums) on disk in chunks, and reading slices of them lazily
+
+A store is a folder with the array split along the last axis (chunks of chunk_size topics/words, memory-mapped when read)
+and the sum of every vector (unit_sum.npy), so that a slice can be normalized without reading the other topics/words.
+"""
+
+import os, json
+import numpy as np
+from typing import Any, List, Tuple
+
+
+def save_bstr_store(arr:np.ndarray, fpath:str, chunk_size:int = 256) -> None:
+    """Save a bootstrap array (e.g. the output of bootstrap_aggregate_wordvec, or np.load(..., mmap_mode="r") of a saved one) as a store"""
+    os.makedirs(fpath, exist_ok=True)
+    n_cols = arr.shape[-1]
+    for start in range(0, n_cols, chunk_size):
+        np.save(f"{fpath}/chunk-{start//chunk_size:05d}.npy", np.ascontiguousarray(arr[..., start:start+chunk_size]))
+    # one run at a time, summing every vector as np.sum does (so normalizing gives the same values as output_loader.normalize)
+    unit_sum = np.zeros(arr.shape[:-1])
+    for run in range(len(arr)):
+        unit_sum[run] = np.asarray(arr[run]).sum(axis=-1)
+    np.save(f"{fpath}/unit_sum.npy", unit_sum)
+    # written last: a store without meta.json is incomplete
+    with open(f"{fpath}/meta.json", "w") as f:
+        json.dump({"shape": list(arr.shape), "chunk_size": chunk_size}, f)
+
+
+def axis_index(key:Any) -> Tuple[Any, bool]:
+    """The index of one axis as a slice or an array of positions (ints become one-element arrays), and whether to drop the axis"""
+    if isinstance(key, (int, np.integer)):
+        return np.array([key]), True
+    if isinstance(key, slice):
+        return key, False
+    return np.asarray(key), False
+
+
+def take(arr:np.ndarray, idxs:List) -> np.ndarray:
+    """Index the leading axes of arr one by one (e.g. arr[run_idx][:, date_idx])"""
+    for axis,idx in enumerate(idxs):
+        arr = arr[(slice(None),)*axis + (idx,)]
+    return arr
+
+
+class BootstrapStore():
+    def __init__(self, fpath:str, normalize_by_unit:bool = False) -> None:
+        """A bootstrap array read lazily: a store folder written by save_bstr_store, or a single .npy file (memory-mapped).
+
+        Indexing reads only the requested slice, e.g. `store[:, 10:40, topic_idx]`; every axis is indexed on its own
+        (a list on two axes selects the cross product, as in zarr, not pairs as in numpy).
+        With normalize_by_unit, the slice is divided by the sum of its vectors over all topics/words (unless the sum is 0),
+        as load_bstr_arrs does for the whole array.
+        """
+        self.fpath = fpath
+        self.normalize_by_unit = normalize_by_unit
+        if fpath.endswith(".npy"):
+            self.chunks = [np.load(fpath, mmap_mode="r")]
+            self.shape = self.chunks[0].shape
+            self.chunk_size = self.shape[-1]
+            self.unit_sum = None  # computed from the full vectors of the slice
+        else:
+            with open(f"{fpath}/meta.json", "r") as f:
+                meta = json.load(f)
+            self.shape = tuple(meta["shape"])
+            self.chunk_size = meta["chunk_size"]
+            n_chunks = -(-self.shape[-1] // self.chunk_size)
+            self.chunks = [np.load(f"{fpath}/chunk-{i:05d}.npy", mmap_mode="r") for i in range(n_chunks)]
+            self.unit_sum = np.load(f"{fpath}/unit_sum.npy", mmap_mode="r")
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
+
+    def __getitem__(self, key:Any) -> np.ndarray:
+        key = key if isinstance(key, tuple) else (key,)
+        key = key + (slice(None),)*(self.ndim-len(key))
+        idxs, drops = zip(*[axis_index(k) for k in key])
+        lead_idxs, col_key = list(idxs[:-1]), idxs[-1]
+        cols = np.arange(self.shape[-1])[col_key].reshape(-1)
+
+        out = None
+        for i,chunk in enumerate(self.chunks):
+            in_chunk = np.flatnonzero((cols >= i*self.chunk_size) & (cols < (i+1)*self.chunk_size))
+            if len(in_chunk) == 0 and out is not None:
+                continue
+            part = take(chunk, lead_idxs)[..., cols[in_chunk]-i*self.chunk_size]
+            if out is None:
+                out = np.zeros(part.shape[:-1] + (len(cols),))
+            out[..., in_chunk] = part
+
+        if self.normalize_by_unit:
+            if self.unit_sum is not None:
+                unit_sum = np.asarray(take(self.unit_sum, lead_idxs))
+            else:
+                unit_sum = np.asarray(take(self.chunks[0], lead_idxs)).sum(axis=-1)
+            unit_sum = unit_sum[..., None]
+            out = np.divide(out, unit_sum, out=out, where=unit_sum!=0)
+
+        drop = tuple(axis for axis,flag in enumerate(drops) if flag)
+        return out.squeeze(axis=drop) if len(drop) > 0 else out
@@ -0,0 +1,188 @@
+"""Code for saving and loading vectors as Parquet datasets (instead of pickled DataFrames of arrays)
+
+Two layouts:
+    - model outputs (one word/topic vector per text): a dataset partitioned by year/candidate/day, vectors stored as sparse rows
+      ("{vec_type}_indices" and "{vec_type}_values" list columns), loaded back as a metadata frame + csr_matrix
+    - aggregated outputs (one vector per date, e.g. *_topvecs.pkl): a single file, vectors stored as a fixed-size list column
+
+Readers only load the requested columns, skip the partitions/row groups outside of [start, end] and memory-map the files.
+"""
+
+import shutil
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from typing import List, Tuple, Iterator
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+
+def csr_to_arrow(mat:sparse.csr_matrix) -> Tuple[pa.ListArray, pa.ListArray]:
+    """The rows of a csr_matrix as (indices, values) list arrays, sharing the csr buffers"""
+    mat = mat.tocsr()
+    offsets = pa.array(mat.indptr.astype(np.int32))
+    indices = pa.ListArray.from_arrays(offsets, pa.array(mat.indices.astype(np.int32)))
+    values = pa.ListArray.from_arrays(offsets, pa.array(mat.data.astype(float)))
+    return indices, values
+
+
+def arrow_to_csr(indices:pa.ChunkedArray, values:pa.ChunkedArray, n_cols:int) -> sparse.csr_matrix:
+    """Inverse of csr_to_arrow"""
+    indices = indices.combine_chunks()
+    values = values.combine_chunks()
+    indptr = np.asarray(indices.offsets) - indices.offsets[0].as_py()
+    mat = sparse.csr_matrix(
+        (np.asarray(values.flatten()), np.asarray(indices.flatten()), indptr),
+        shape=(len(indices), n_cols))
+    return mat
+
+
+def clear_vector_dataset(fpath:str, vec_type:str, label:str) -> None:
+    """Remove the vectors of a label (e.g. "trump2020", all its days) from the dataset {fpath}/{vec_type}/"""
+    shutil.rmtree(f"{fpath}/{vec_type}/year={int(label[-4:])}/candidate={label[:-4]}", ignore_errors=True)
+
+
+def write_vector_dataset(df:pd.DataFrame, mat:sparse.csr_matrix, fpath:str, vec_type:str, label:str, part:int = None) -> None:
+    """Save the vectors of a model output (rows aligned with df) to the dataset {fpath}/{vec_type}/,
+    partitioned by year, candidate (from the label, e.g. "trump2020") and day.
+    Rows of df keep their metadata columns (date, domain, path, textbody, if present).
+    Without part, they replace the earlier output of the label; with part (one chunk of a streamed output), they are added
+    to it, the stream starting from an empty label (see clear_vector_dataset).
+    """
+    meta_cols = [col for col in ["date","domain","path","textbody"] if col in df.columns]
+    table = pa.Table.from_pandas(df[meta_cols].reset_index(drop=True), preserve_index=False)
+    indices, values = csr_to_arrow(mat)
+    table = table.append_column(f"{vec_type}_indices", indices).append_column(f"{vec_type}_values", values)
+    table = table.append_column("year", pa.array([int(label[-4:])]*len(df), pa.int32()))
+    table = table.append_column("candidate", pa.array([label[:-4]]*len(df), pa.string()))
+    table = table.append_column("day", pa.array(pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d").tolist(), pa.string()))
+    table = table.replace_schema_metadata({"n_cols": str(mat.shape[1])})
+    if part is None:
+        clear_vector_dataset(fpath, vec_type, label)
+        pq.write_to_dataset(
+            table, root_path=f"{fpath}/{vec_type}", partition_cols=["year","candidate","day"],
+            basename_template="part-{i}.parquet", existing_data_behavior="delete_matching")
+    else:
+        pq.write_to_dataset(
+            table, root_path=f"{fpath}/{vec_type}", partition_cols=["year","candidate","day"],
+            basename_template=f"part-{part:05d}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore")
+
+
+def load_vector_dataset(
+        fpath:str,
+        vec_type:str,
+        label:str = "",
+        start:str = "",
+        end:str = "",
+        columns:List = ["date","domain","path","textbody"]) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Load (a part of) a dataset written by write_vector_dataset: the metadata frame (only the given columns) and the vectors.
+
+    Args:
+        label (str, optional): e.g. "trump2020"; only this year/candidate is read
+        start, end (str, optional): "YYYY-MM-DD"; only the days in [start, end] are read
+    """
+    dataset = ds.dataset(f"{fpath}/{vec_type}", format="parquet", partitioning="hive", filesystem=fs.LocalFileSystem(use_mmap=True))
+    fragment = next(dataset.get_fragments(), None)
+    if fragment is None:
+        print(f"No {vec_type} found in {fpath}!")
+        return pd.DataFrame(columns=columns), sparse.csr_matrix((0, 0))
+    n_cols = int(pq.read_schema(fragment.path).metadata[b"n_cols"])
+
+    predicate = None
+    if len(label) > 0:
+        predicate = (ds.field("year") == int(label[-4:])) & (ds.field("candidate") == label[:-4])
+    if len(start) > 0 and len(end) > 0:
+        in_window = (ds.field("day") >= str(start)[:10]) & (ds.field("day") <= str(end)[:10])
+        predicate = in_window if predicate is None else predicate & in_window
+    columns = [col for col in columns if col in dataset.schema.names]
+    table = dataset.to_table(columns=columns + [f"{vec_type}_indices", f"{vec_type}_values"], filter=predicate)
+    mat = arrow_to_csr(table[f"{vec_type}_indices"], table[f"{vec_type}_values"], n_cols)
+    df = table.select(columns).to_pandas()
+    return df, mat
+
+
+def write_vector_frame(df:pd.DataFrame, vec_col:str, fpath:str) -> None:
+    """Save a frame with one vector per row (e.g. an aggregated topvec frame with "date" and "majority_topvec") as one Parquet file,
+    the vectors as a fixed-size list column
+    """
+    arr = np.vstack(df[vec_col].values).astype(float)
+    df = df.drop(columns=vec_col).reset_index(drop=True)
+    df["date"] = pd.to_datetime(df["date"])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(vec_col, pa.FixedSizeListArray.from_arrays(pa.array(arr.ravel()), arr.shape[1]))
+    pq.write_table(table, fpath)
+
+
+def read_vector_frame(fpath:str, vec_col:str, columns:List = [], start:str = "", end:str = "") -> pd.DataFrame:
+    """Load a file written by write_vector_frame (memory-mapped), optionally only some columns and the dates in [start, end]"""
+    predicate = None
+    if len(start) > 0 and len(end) > 0:
+        predicate = (ds.field("date") >= pd.Timestamp(start)) & (ds.field("date") <= pd.Timestamp(end))
+    table = pq.read_table(fpath, columns=(columns + [vec_col]) if len(columns) > 0 else None, filters=predicate, memory_map=True)
+    n_cols = table.schema.field(vec_col).type.list_size
+    arr = np.asarray(table[vec_col].combine_chunks().flatten()).reshape(-1, n_cols)
+    df = table.select([col for col in table.column_names if col != vec_col]).to_pandas()
+    df[vec_col] = list(arr)
+    return df
+
+
+def load_headline_dataset(fpath:str, candidate:str = "", start:str = "", end:str = "") -> pa.Table:
+    """Load the headlines written by parseheadlines.save_headline_dataset (as a Table, in the order of the rows of the tsv):
+    "date", "textbody", "domain", "path" and "candidate".
+
+    Args:
+        candidate (str, optional): e.g. "trump"; only this candidate is read
+        start, end (str, optional): "YYYY-MM-DD"; only the days in [start, end] are read
+    """
+    dataset = ds.dataset(fpath, format="parquet", partitioning="hive", filesystem=fs.LocalFileSystem(use_mmap=True))
+    predicate = None
+    if len(candidate) > 0:
+        predicate = ds.field("candidate") == candidate
+    if len(start) > 0 and len(end) > 0:
+        in_window = (ds.field("day") >= str(start)[:10]) & (ds.field("day") <= str(end)[:10])
+        predicate = in_window if predicate is None else predicate & in_window
+    table = dataset.to_table(columns=["day", "textbody", "domain", "path", "candidate", "row"], filter=predicate).sort_by("row")
+    return table.drop(["row"]).rename_columns(["date", "textbody", "domain", "path", "candidate"])
+
+
+def take_rows_before(stream:dict, row:int) -> pa.Table:
+    """The rows of a file stream (see iter_headline_dataset) before the given row, read batch by batch"""
+    while not stream["done"] and (len(stream["buffer"]) == 0 or stream["buffer"]["row"][-1].as_py() < row):
+        batch = next(stream["batches"], None)
+        if batch is None:
+            stream["done"] = True
+        else:
+            stream["buffer"] = pa.concat_tables([stream["buffer"], pa.Table.from_batches([batch])])
+    n = int(np.searchsorted(stream["buffer"]["row"].to_numpy(), row))
+    rows = stream["buffer"].slice(0, n)
+    stream["buffer"] = stream["buffer"].slice(n)
+    return rows
+
+
+def iter_headline_dataset(fpath:str, chunksize:int, batch_size:int = 4096) -> Iterator[pa.Table]:
+    """load_headline_dataset chunk by chunk: Tables of the next chunksize rows of the tsv, in order.
+    Every file of the dataset holds its rows in the order of the tsv (see parseheadlines.save_headline_dataset), so the files
+    are read batch by batch and merged on "row": memory depends on the chunk size and the # of files, not on the corpus size.
+    """
+    dataset = ds.dataset(fpath, format="parquet", partitioning="hive")
+    streams = []
+    for fragment in dataset.get_fragments():
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        batches = pq.ParquetFile(fragment.path, memory_map=True).iter_batches(batch_size=batch_size, columns=["textbody", "domain", "path", "row"])
+        first = next(batches, None)
+        if first is not None:
+            streams.append({"candidate": str(keys["candidate"]), "day": str(keys["day"]), "batches": batches,
+                            "buffer": pa.Table.from_batches([first]), "done": False})
+    while len(streams) > 0:
+        end = min(stream["buffer"]["row"][0].as_py() for stream in streams) + chunksize
+        tables = []
+        for stream in streams:
+            rows = take_rows_before(stream, end)
+            if len(rows) > 0:
+                tables.append(rows.append_column("candidate", pa.array([stream["candidate"]]*len(rows), pa.string()))
+                                  .append_column("day", pa.array([stream["day"]]*len(rows), pa.string())))
+        streams = [stream for stream in streams if len(stream["buffer"]) > 0]
+        table = pa.concat_tables(tables).sort_by("row")
+        yield table.select(["day", "textbody", "domain", "path", "candidate"]).rename_columns(["date", "textbody", "domain", "path", "candidate"])
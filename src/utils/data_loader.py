@@ -1,12 +1,109 @@
 import pandas as pd 
 import numpy as np
 import pickle
+import os
+import functools
 from collections import Counter
-from typing import List, Dict, Any
-from src.utils.preprocessor import clean_at, clean_url, clean_texts, get_tokens, get_lemmas, get_stems
+from typing import List, Dict, Any, Iterator, Tuple
+from src.utils.preprocessor import clean_at, clean_url, clean_texts, get_tokens, get_lemmas, get_stems, TextPipeline
 from src.utils.downstream_process import trim_period
 from src.utils.text import contractions
 
+# (candidate, label) of the headline data of each year, in the order of df_cand1, df_cand2
+HEADLINE_CANDIDATES = {
+    2016: [("trump", "trump2016"), ("clinton", "clinton2016")],
+    2020: [("biden", "biden2020"), ("trump", "trump2020")],
+}
+
+
+def lower_text(text:Any) -> str:
+    return str(text).lower()
+
+
+def expand_contractions_twice(text:str) -> str:
+    text = contractions.expand(text, drop_ownership=True)
+    return contractions.expand(text, drop_ownership=True)
+
+
+def join_tokens(tokens:List[str]) -> str:
+    return " ".join(tokens).replace("president trump", "trump")
+
+
+def join_stems(stems:List[str]) -> str:
+    return " ".join(stems).replace("presid trump", "trump")
+
+
+@functools.lru_cache(maxsize=None)
+def headline_pipeline(lemmatize:bool = True, stemming:bool = False, expand_contractions:bool = True) -> TextPipeline:
+    """The steps of clean_headline, built once per setting"""
+    steps = [lower_text]
+    if expand_contractions:
+        steps.append(expand_contractions_twice)
+    steps += [clean_url, get_tokens]
+    if stemming:
+        steps += [get_stems, join_stems]
+    elif lemmatize:
+        steps += [get_lemmas, join_tokens]
+    else:
+        steps.append(join_tokens)
+    return TextPipeline(steps)
+
+
+def clean_headline(text:str, lemmatize:bool = True, stemming:bool = False, expand_contractions:bool = True) -> str:
+    """Headlines.clean for a single text.
+    Headlines.clean only expands contractions in df_cand1, so use expand_contractions=False to match it for df_cand2.
+    """
+    return headline_pipeline(lemmatize, stemming, expand_contractions)(text)
+
+
+def read_headlines(folderpath:str, year:int) -> pd.DataFrame:
+    """All headlines of a year: the dataset headline/headlines_{year}/ written by parseheadlines.py if it exists,
+    otherwise headline/headlines_{year}_all.tsv
+    """
+    if os.path.isdir(folderpath + f"headline/headlines_{year}/"):
+        from src.utils.columnar_output import load_headline_dataset  # pyarrow is only needed for the Parquet datasets
+        return load_headline_dataset(folderpath + f"headline/headlines_{year}/").to_pandas()
+    return pd.read_csv(folderpath + f"headline/headlines_{year}_all.tsv", sep="\t")
+
+
+def read_headline_chunks(folderpath:str, year:int, chunksize:int) -> Iterator[pd.DataFrame]:
+    """read_headlines chunk by chunk (the files of the dataset are read batch by batch, see columnar_output.iter_headline_dataset)"""
+    if os.path.isdir(folderpath + f"headline/headlines_{year}/"):
+        from src.utils.columnar_output import iter_headline_dataset
+        for table in iter_headline_dataset(folderpath + f"headline/headlines_{year}/", chunksize):
+            yield table.to_pandas()
+    else:
+        yield from pd.read_csv(folderpath + f"headline/headlines_{year}_all.tsv", sep="\t", chunksize=chunksize)
+
+
+def iter_headline_chunks(
+        folderpath:str,
+        year:int,
+        chunksize:int = 100000,
+        drop_duplicates:bool = True,
+        start:str = "",
+        end:str = "") -> Iterator[Tuple[int, str, pd.DataFrame]]:
+    """Read the headlines of a year (see read_headlines) chunk by chunk, yielding (chunk index, candidate label, headlines of the candidate in the chunk).
+
+    Same rows as Headlines(folderpath, year, drop_duplicates=drop_duplicates) followed by trim(start, end) if start and end are given:
+    with drop_duplicates, a text is only kept the first time it appears for a candidate, across chunks
+    (only the hashes of the texts seen so far are kept in memory).
+    """
+    seen = {label: set() for _,label in HEADLINE_CANDIDATES[year]}
+    for i,df in enumerate(read_headline_chunks(folderpath, year, chunksize)):
+        for cand,label in HEADLINE_CANDIDATES[year]:
+            df_cand = df[df["candidate"]==cand]
+            if drop_duplicates:
+                df_cand = df_cand.drop_duplicates(subset="textbody")
+                text_hash = df_cand["textbody"].astype(str).map(hash)
+                new = ~text_hash.isin(seen[label]).values
+                df_cand = df_cand[new]
+                seen[label].update(text_hash[new])
+            df_cand = df_cand.reset_index().drop(columns="index")
+            if len(start) > 0 and len(end) > 0:
+                df_cand = trim_period(df_cand, start=start, end=end)
+            yield i, label, df_cand
+
 
 class Headlines():
     def __init__(
@@ -19,7 +116,7 @@ class Headlines():
             texts_to_excl: List = []) -> None:
         
         if len(folderpath) > 0:
-            df = pd.read_csv(folderpath + f"headline/headlines_{year}_all.tsv", sep="\t")
+            df = read_headlines(folderpath, year)
             self.year = year 
 
             if year == 2016:
@@ -3,52 +3,115 @@ import numpy as np
 from collections import Counter
 from datetime import date
 import traceback
-import os, re, glob
+import os, re, glob, time
 import multiprocess as mp
+from functools import partial
+from scipy import sparse
+from typing import List, Dict, Tuple
 
 import matplotlib.pyplot as plt
 import matplotlib
 
 import nltk
-from src.utils.data_loader import Headlines, Surveys 
+from src.utils.data_loader import Headlines, Surveys, HEADLINE_CANDIDATES, clean_headline, iter_headline_chunks
 from src.utils.dict_loader import TopicDictionary
+from src.utils.keyword_matcher import KeywordMatcher, search_pattern_pos, resolve_overlaps
+from src.utils.text_cache import TextCache
 
 
-def adjust_pos(pos1, pos2):
-    p1_remove = []
-    p2_remove = []
-    for p1 in pos1:
-        len1 = p1[1] - p1[0] 
-        for p2 in pos2:
-            len2 = p2[1] - p2[0] 
-            if bool_overlap(p1, p2):
-                if len1 < len2:
-                    p1_remove.append(p1)
-                else:
-                    p2_remove.append(p2)
-    for p1r in p1_remove:
-        pos1.remove(p1r)
-    for p2r in p2_remove:
-        pos2.remove(p2r)
-    return pos1, pos2
-
-def bool_overlap(intv1, intv2):
-    max_lower = max(intv1[0], intv2[0])
-    min_upper = min(intv1[1], intv2[1])
-    if max_lower < min_upper:
-        return True
-    else:
-        return False
+def stack_sparse_rows(rows:List[Tuple[np.ndarray, np.ndarray]], n_cols:int) -> sparse.csr_matrix:
+    """Stack the (indices, values) of sparse rows into one csr_matrix"""
+    indptr = np.zeros(len(rows)+1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(idx) for idx,_ in rows])
+    indices = np.concatenate([idx for idx,_ in rows] + [np.zeros(0, dtype=np.int32)])
+    data = np.concatenate([vals for _,vals in rows] + [np.zeros(0)])
+    mat = sparse.csr_matrix((data, indices, indptr), shape=(len(rows), n_cols))
+    mat.sort_indices()
+    return mat
 
 def search_all_pos(w, text):
     p = re.compile(r"\b{}\b".format(w))
-    m = p.search(text)
-    pos = []
-    while m:
-        start,end = m.span()
-        pos.append((start, end))
-        m = p.search(text, start+1)
-    return pos
+    return search_pattern_pos(p, text)
+
+def count_keywords_in(text:str, matcher:KeywordMatcher, overlap_words:List) -> Dict[int, int]:
+    """Count keywords in a text, dropping occurrences covered by a longer overlapping keyword; returns {word index: count}"""
+    # one pass over the text finds every keyword occurrence (only words that occur are kept)
+    occur_pos = matcher.find_all(text)
+    if len(occur_pos) > 1:
+        occur_pos = resolve_overlaps(occur_pos, overlap_words)
+    return {i:len(pos) for i,pos in occur_pos.items()}
+
+def counts_to_wordvec(counts:Dict[int, int], n_words:int) -> np.ndarray:
+    wordvec = np.zeros(n_words)
+    for i,count in counts.items():
+        wordvec[i] = count
+    return wordvec
+
+def counts_to_sparse(counts:Dict[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    return np.array(list(counts.keys()), dtype=np.int32), np.array(list(counts.values()), dtype=float)
+
+def sparse_to_wordvec(row:Tuple[np.ndarray, np.ndarray], n_words:int) -> np.ndarray:
+    wordvec = np.zeros(n_words)
+    wordvec[row[0]] = row[1]
+    return wordvec
+
+def normalize_rows(mat:sparse.csr_matrix) -> sparse.csr_matrix:
+    """Divide every row of a csr_matrix by its sum"""
+    row_sums = np.asarray(mat.sum(axis=1)).ravel()
+    mat.data = mat.data/np.repeat(row_sums, np.diff(mat.indptr))
+    return mat
+
+
+# read-only dictionary state of the pool workers: set in the parent before the pool starts, so that forked workers inherit it
+# (other start methods get it once per worker through the pool initializer); tasks then only ship batches of texts
+WORKER_STATE = {}
+
+def init_worker_state(state:Dict) -> None:
+    WORKER_STATE.update(state)
+
+def open_dictionary_pool(dictionary:TopicDictionary, n_workers:int = 0) -> mp.Pool:
+    """Start a pool whose workers hold the keyword matcher, overlap lists and topic word matrix of a dictionary.
+    n_workers=0 uses all but two cores (at least one).
+    """
+    start = time.time()
+    state = {
+        "matcher": dictionary.matcher,
+        "overlap_words": dictionary.overlap_words,
+        "n_words": dictionary.n_words,
+        "topword_matrix": dictionary.topword_matrix,
+    }
+    init_worker_state(state)
+    if n_workers <= 0:
+        n_workers = max(mp.cpu_count()-2, 1)
+    if mp.get_start_method() == "fork":
+        pool = mp.Pool(n_workers)
+    else:
+        pool = mp.Pool(n_workers, initializer=init_worker_state, initargs=(state,))
+    pool.map(time.sleep, [0]*n_workers, chunksize=1)  # wait until the workers are up
+    print(f"Started a pool of {n_workers} workers in {time.time()-start:.2f}s")
+    return pool
+
+def map_batches(pool:mp.Pool, func, items:List, batch_size:int) -> List:
+    """pool.map over batches of items, flattening the results"""
+    batches = [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+    return [x for batch in pool.map(func, batches, chunksize=1) for x in batch]
+
+def worker_wordvec_batch(texts:List[str]) -> List[np.ndarray]:
+    return [counts_to_wordvec(count_keywords_in(text, WORKER_STATE["matcher"], WORKER_STATE["overlap_words"]), WORKER_STATE["n_words"]) for text in texts]
+
+def worker_wordvec_sparse_batch(texts:List[str]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    return [counts_to_sparse(count_keywords_in(text, WORKER_STATE["matcher"], WORKER_STATE["overlap_words"])) for text in texts]
+
+def worker_clean_batch(texts:List[str], lemmatize:bool, stemming:bool, expand_contractions:bool) -> List[str]:
+    """Clean raw headlines (see clean_headline)"""
+    return [clean_headline(text, lemmatize, stemming, expand_contractions) for text in texts]
+
+def worker_clean_wordvec_sparse_batch(texts:List[str], lemmatize:bool, stemming:bool, expand_contractions:bool) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Clean raw headlines (see clean_headline) and count their keywords"""
+    return worker_wordvec_sparse_batch(worker_clean_batch(texts, lemmatize, stemming, expand_contractions))
+
+def worker_topvec_batch(wordvecs:List) -> List[np.ndarray]:
+    return [np.dot(WORKER_STATE["topword_matrix"], np.array(wordvec)) for wordvec in wordvecs]
 
 class DictBasedTopicModel():
     def __init__(self, dictionary:TopicDictionary, text_input, text_type) -> None:
@@ -56,37 +119,58 @@ class DictBasedTopicModel():
         self.text_input = text_input # class object: Headlines or Surveys
         self.text_type = text_type # headline or survey
 
+    def count_keywords(self, text) -> Dict[int, int]:
+        """Count keywords in a text, dropping occurrences covered by a longer overlapping keyword; returns {word index: count}"""
+        return count_keywords_in(text, self.dictionary.matcher, self.dictionary.overlap_words)
+
     def build_wordvec(self, text):
-        wordvec = np.zeros(self.dictionary.n_words)
-        occur_pos = {}
-        occur_words_idx = []
-        for w in self.dictionary.words:
-            pos1 = search_all_pos(w, text)
-            idx_w = self.dictionary.word2index[w]
-            occur_pos[idx_w] = pos1
-            if len(pos1) > 0:
-                occur_words_idx.append(idx_w)
-
-        if len(occur_words_idx) > 0:
-            for idx1 in occur_words_idx:
-                overlap_vec = self.dictionary.overlap_mat[idx1]
-                overlap_words_idx = np.nonzero(overlap_vec)[0]
-                if len(overlap_words_idx) > 0:
-                    for idx2 in overlap_words_idx:
-                        if len(occur_pos[idx2]) > 0:
-                            pos1 = occur_pos[idx1]
-                            pos2 = occur_pos[idx2]
-                            pos1, pos2 = adjust_pos(pos1, pos2)
-        for i,pos in occur_pos.items():
-            wordvec[i] = len(pos)
-        return wordvec
-
-    def build_wordvec_df(self, drop_no_topic:bool=False, normalize_vec:bool=False, save_output:bool=False, output_cache_fpath="") -> None:
-        with mp.Pool(mp.cpu_count()-2) as pool:
-            self.text_input.df_cand1["wordvec"] = pool.map(self.build_wordvec, self.text_input.df_cand1["cleaned_textbody"])
+        return counts_to_wordvec(self.count_keywords(text), self.dictionary.n_words)
+
+    def build_wordvec_sparse(self, text) -> Tuple[np.ndarray, np.ndarray]:
+        """The nonzero entries of build_wordvec as (word indices, counts)"""
+        return counts_to_sparse(self.count_keywords(text))
+
+    def build_wordvec_df(self, drop_no_topic:bool=False, normalize_vec:bool=False, save_output:bool=False, output_cache_fpath="", sparse_output:bool=False, n_workers:int=0, batch_size:int=1000, cache:TextCache=None, output_format:str="pickle") -> None:
+        """Count topic keywords for all texts.
+
+        By default every row of df_cand1/df_cand2 gets a dense "wordvec" array. With sparse_output=True the word vectors are
+        kept as one csr_matrix per candidate instead (self.wordvec_mat1/self.wordvec_mat2, rows aligned with df_cand1/df_cand2),
+        and saved as *_wordvec_cache.npz next to a slim *_wordvec_meta.pkl frame.
+        With output_format="parquet", either output is saved to the Parquet dataset {output_cache_fpath}/{text_type}/wordvec/
+        instead (see columnar_output.write_vector_dataset).
+
+        The workers (n_workers, see open_dictionary_pool) hold the dictionary; texts are sent in batches of batch_size.
+        With a TextCache, only the cleaned texts not counted before with this dictionary are sent to the workers.
+        """
+        if sparse_output:
+            with open_dictionary_pool(self.dictionary, n_workers) as pool:
+                self.wordvec_mat1 = stack_sparse_rows(self.wordvec_rows(pool, self.text_input.df_cand1["cleaned_textbody"].tolist(), batch_size, cache), self.dictionary.n_words)
+                print("Finished counting topic keywords:", self.text_input.df_cand1_label)
+                self.wordvec_mat2 = stack_sparse_rows(self.wordvec_rows(pool, self.text_input.df_cand2["cleaned_textbody"].tolist(), batch_size, cache), self.dictionary.n_words)
+                print("Finished counting topic keywords:", self.text_input.df_cand2_label)
+            if cache is not None:
+                print("Text cache:", cache.stats())
+            if drop_no_topic:
+                self.text_input.df_cand1, self.wordvec_mat1 = self.drop_empty_rows(self.text_input.df_cand1, self.wordvec_mat1, self.text_input.df_cand1_label)
+                self.text_input.df_cand2, self.wordvec_mat2 = self.drop_empty_rows(self.text_input.df_cand2, self.wordvec_mat2, self.text_input.df_cand2_label)
+            if save_output:
+                self.save_sparse_output(self.text_input.df_cand1, self.wordvec_mat1, self.text_input.df_cand1_label, "wordvec", output_cache_fpath, output_format)
+                self.save_sparse_output(self.text_input.df_cand2, self.wordvec_mat2, self.text_input.df_cand2_label, "wordvec", output_cache_fpath, output_format)
+            return
+
+        with open_dictionary_pool(self.dictionary, n_workers) as pool:
+            if cache is None:
+                self.text_input.df_cand1["wordvec"] = map_batches(pool, worker_wordvec_batch, self.text_input.df_cand1["cleaned_textbody"].tolist(), batch_size)
+            else:
+                self.text_input.df_cand1["wordvec"] = [sparse_to_wordvec(row, self.dictionary.n_words) for row in self.wordvec_rows(pool, self.text_input.df_cand1["cleaned_textbody"].tolist(), batch_size, cache)]
             print("Finished counting topic keywords:", self.text_input.df_cand1_label)
-            self.text_input.df_cand2["wordvec"] = pool.map(self.build_wordvec, self.text_input.df_cand2["cleaned_textbody"])
+            if cache is None:
+                self.text_input.df_cand2["wordvec"] = map_batches(pool, worker_wordvec_batch, self.text_input.df_cand2["cleaned_textbody"].tolist(), batch_size)
+            else:
+                self.text_input.df_cand2["wordvec"] = [sparse_to_wordvec(row, self.dictionary.n_words) for row in self.wordvec_rows(pool, self.text_input.df_cand2["cleaned_textbody"].tolist(), batch_size, cache)]
             print("Finished counting topic keywords:", self.text_input.df_cand2_label)
+        if cache is not None:
+            print("Text cache:", cache.stats())
 
         self.text_input.df_cand1["sum"] = self.text_input.df_cand1["wordvec"].map(lambda x: sum(x))
         original_len1 = len(self.text_input.df_cand1)
@@ -102,7 +186,10 @@ class DictBasedTopicModel():
             filtered_len2 = len(self.text_input.df_cand2)
             print(f"Rate of coverage for {self.text_input.df_cand2_label}:", filtered_len2/original_len2)
 
-        if save_output:
+        if save_output and output_format == "parquet":
+            for df,label in [(self.text_input.df_cand1, self.text_input.df_cand1_label), (self.text_input.df_cand2, self.text_input.df_cand2_label)]:
+                self.save_sparse_output(df, sparse.csr_matrix(np.vstack(df["wordvec"].values)), label, "wordvec", output_cache_fpath, output_format)
+        elif save_output:
             date_string = date.today().strftime("%m%d%y")
             if not os.path.exists(f"{output_cache_fpath}/{self.text_type}/"):
                 os.mkdir(f"{output_cache_fpath}/{self.text_type}/")
@@ -120,17 +207,189 @@ class DictBasedTopicModel():
         topvec = np.dot(self.dictionary.topword_matrix, np.array(wordvec))
         return topvec 
 
-    def build_topvec_df(self, normalize_vec:bool=False, save_output:bool=False, output_cache_fpath="") -> None:
-        with mp.Pool(mp.cpu_count()-2) as pool:
-            self.text_input.df_cand1["topvec"] = pool.map(self.build_topvec, self.text_input.df_cand1["wordvec"])
+    def build_topvec_mat(self, wordvec_mat:sparse.csr_matrix, normalize_vec:bool=False) -> sparse.csr_matrix:
+        """build_topvec for all rows at once: a single sparse product of the word vectors with the topic-word matrix"""
+        topvec_mat = (wordvec_mat @ self.dictionary.topword_sparse.T).tocsr()
+        topvec_mat.sort_indices()
+        if normalize_vec:
+            topvec_mat = normalize_rows(topvec_mat)
+        return topvec_mat
+
+    def cached_vector_rows(self, pool:mp.Pool, texts:List[str], batch_size:int, cache:TextCache) -> Tuple[List, List]:
+        """The word and topic vectors of cleaned texts as (indices, values) rows, looked up in the cache;
+        only the texts missing from the cache (for this dictionary) are counted in the pool, then added to the cache.
+
+        Returns:
+            Tuple[List, List]: (word vector rows, topic vector rows), aligned with texts
+        """
+        found = cache.get_vectors(texts, self.dictionary.dict_hash)
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if len(missing) > 0:
+            word_rows = map_batches(pool, worker_wordvec_sparse_batch, missing, batch_size)
+            topvec_mat = self.build_topvec_mat(stack_sparse_rows(word_rows, self.dictionary.n_words))
+            new = {}
+            for i,text in enumerate(missing):
+                start, end = topvec_mat.indptr[i], topvec_mat.indptr[i+1]
+                new[text] = (*word_rows[i], topvec_mat.indices[start:end], topvec_mat.data[start:end])
+            cache.put_vectors(new, self.dictionary.dict_hash)
+            found.update(new)
+        return [found[text][:2] for text in texts], [found[text][2:] for text in texts]
+
+    def wordvec_rows(self, pool:mp.Pool, texts:List[str], batch_size:int, cache:TextCache = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Word vectors of cleaned texts as (indices, counts) rows, through the cache if given"""
+        if cache is None:
+            return map_batches(pool, worker_wordvec_sparse_batch, texts, batch_size)
+        return self.cached_vector_rows(pool, texts, batch_size, cache)[0]
+
+    def cached_clean(self, pool:mp.Pool, texts:List[str], batch_size:int, cache:TextCache, lemmatize:bool, stemming:bool, expand_contractions:bool) -> List[str]:
+        """clean_headline for raw texts, looked up in the cache; only the texts missing from the cache are cleaned in the pool"""
+        options = f"lemmatize={lemmatize},stemming={stemming},expand_contractions={expand_contractions}"
+        cleaned = cache.get_cleaned(texts, options)
+        missing = [text for text in dict.fromkeys(texts) if text not in cleaned]
+        if len(missing) > 0:
+            worker = partial(worker_clean_batch, lemmatize=lemmatize, stemming=stemming, expand_contractions=expand_contractions)
+            new = dict(zip(missing, map_batches(pool, worker, missing, batch_size)))
+            cache.put_cleaned(new, options)
+            cleaned.update(new)
+        return [cleaned[text] for text in texts]
+
+    def drop_empty_rows(self, df:pd.DataFrame, mat:sparse.csr_matrix, label:str) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+        """Drop texts without any topic keyword from the metadata frame and the sparse word vectors"""
+        keep = np.asarray(mat.sum(axis=1)).ravel() > 0
+        print(f"Rate of coverage for {label}:", keep.sum()/len(keep))
+        return df[keep], mat[np.flatnonzero(keep)]
+
+    def save_sparse_output(self, df:pd.DataFrame, mat:sparse.csr_matrix, label:str, vec_type:str, output_cache_fpath:str, output_format:str="pickle") -> None:
+        """Save a sparse output as {date}_{label}_{vec_type}_cache.npz plus the metadata frame {date}_{label}_{vec_type}_meta.pkl,
+        or with output_format="parquet", to the dataset {output_cache_fpath}/{text_type}/{vec_type}/ (partitioned by year/candidate/day)
+        """
+        if output_format == "parquet":
+            from src.utils.columnar_output import write_vector_dataset  # pyarrow is only needed for the Parquet format
+            write_vector_dataset(df, mat, f"{output_cache_fpath}/{self.text_type}", vec_type, label)
+            return
+        date_string = date.today().strftime("%m%d%y")
+        if not os.path.exists(f"{output_cache_fpath}/{self.text_type}/"):
+            os.mkdir(f"{output_cache_fpath}/{self.text_type}/")
+        meta_cols = [col for col in ["date","domain","path","textbody"] if col in df.columns]
+        sparse.save_npz(f"{output_cache_fpath}/{self.text_type}/{date_string}_{label}_{vec_type}_cache.npz", mat)
+        df[meta_cols].to_pickle(f"{output_cache_fpath}/{self.text_type}/{date_string}_{label}_{vec_type}_meta.pkl")
+
+    def save_sparse_part(self, df:pd.DataFrame, mat:sparse.csr_matrix, label:str, vec_type:str, output_fpath:str, part:int, output_format:str="pickle") -> None:
+        """Save one chunk of a streamed output as {label}_parts/part-{part}_{vec_type}_cache.npz plus part-{part}_{vec_type}_meta.pkl,
+        or with output_format="parquet", append it to the dataset {output_fpath}/{text_type}/{vec_type}/
+        """
+        if output_format == "parquet":
+            from src.utils.columnar_output import write_vector_dataset
+            write_vector_dataset(df, mat, f"{output_fpath}/{self.text_type}", vec_type, label, part=part)
+            return
+        part_fpath = f"{output_fpath}/{self.text_type}/{label}_parts/"
+        os.makedirs(part_fpath, exist_ok=True)
+        meta_cols = [col for col in ["date","domain","path","textbody"] if col in df.columns]
+        sparse.save_npz(f"{part_fpath}part-{part:05d}_{vec_type}_cache.npz", mat)
+        df[meta_cols].to_pickle(f"{part_fpath}part-{part:05d}_{vec_type}_meta.pkl")
+
+    def clear_sparse_parts(self, label:str, vec_type:str, output_fpath:str, output_format:str="pickle") -> None:
+        """Remove the parts of an earlier streamed run (see save_sparse_part), so that none of them is loaded with the new parts"""
+        if output_format == "parquet":
+            from src.utils.columnar_output import clear_vector_dataset
+            clear_vector_dataset(f"{output_fpath}/{self.text_type}", vec_type, label)
+            return
+        for fpath in glob.glob(f"{output_fpath}/{self.text_type}/{label}_parts/part-*_{vec_type}_*"):
+            os.remove(fpath)
+
+    def stream_headline_vectors(
+            self,
+            folderpath:str,
+            year:int,
+            wordvec_fpath:str,
+            topvec_fpath:str,
+            chunksize:int = 100000,
+            lemmatize:bool = False,
+            stemming:bool = True,
+            drop_duplicates:bool = True,
+            drop_no_topic:bool = True,
+            normalize_vec:bool = False,
+            start:str = "",
+            end:str = "",
+            n_workers:int = 0,
+            batch_size:int = 1000,
+            cache:TextCache = None,
+            output_format:str = "pickle") -> None:
+        """Headlines -> clean -> build_wordvec_df -> build_topvec_df (with sparse_output=True and save_output=True) in one pass,
+        reading headlines_{year}_all.tsv in chunks of chunksize rows, so that memory depends on the chunk size, not on the corpus size.
+
+        The word and topic vectors of every chunk are appended as a new part to {fpath}/{text_type}/{label}_parts/
+        (see save_sparse_part; load with downstream_aggregate.load_sparse_model_parts), or with output_format="parquet",
+        to the Parquet datasets {fpath}/{text_type}/wordvec/ and .../topvec/ (load with downstream_aggregate.load_model_output_parquet).
+        With a TextCache, texts already cleaned or counted (for this dictionary) in earlier chunks or runs are not processed again.
+        The parts of an earlier run are removed first.
+        """
+        for _,label in HEADLINE_CANDIDATES[year]:
+            self.clear_sparse_parts(label, "wordvec", wordvec_fpath, output_format)
+            self.clear_sparse_parts(label, "topvec", topvec_fpath, output_format)
+        n_texts = {label: 0 for _,label in HEADLINE_CANDIDATES[year]}
+        n_kept = {label: 0 for _,label in HEADLINE_CANDIDATES[year]}
+        with open_dictionary_pool(self.dictionary, n_workers) as pool:
+            for i,label,df in iter_headline_chunks(folderpath, year, chunksize, drop_duplicates, start, end):
+                # Headlines.clean only expands contractions for the first candidate
+                expand_contractions = label == HEADLINE_CANDIDATES[year][0][1]
+                if cache is None:
+                    worker = partial(worker_clean_wordvec_sparse_batch, lemmatize=lemmatize, stemming=stemming, expand_contractions=expand_contractions)
+                    wordvec_mat = stack_sparse_rows(map_batches(pool, worker, df["textbody"].tolist(), batch_size), self.dictionary.n_words)
+                else:
+                    cleaned = self.cached_clean(pool, df["textbody"].tolist(), batch_size, cache, lemmatize, stemming, expand_contractions)
+                    word_rows, top_rows = self.cached_vector_rows(pool, cleaned, batch_size, cache)
+                    wordvec_mat = stack_sparse_rows(word_rows, self.dictionary.n_words)
+                    topvec_mat = stack_sparse_rows(top_rows, self.dictionary.n_topics)
+                n_texts[label] += len(df)
+                if drop_no_topic:
+                    keep = np.asarray(wordvec_mat.sum(axis=1)).ravel() > 0
+                    df, wordvec_mat = df[keep], wordvec_mat[np.flatnonzero(keep)]
+                    if cache is not None:
+                        topvec_mat = topvec_mat[np.flatnonzero(keep)]
+                n_kept[label] += len(df)
+                if len(df) == 0:
+                    continue
+                if cache is None:
+                    topvec_mat = self.build_topvec_mat(wordvec_mat, normalize_vec=normalize_vec)
+                elif normalize_vec:
+                    topvec_mat = normalize_rows(topvec_mat)
+                self.save_sparse_part(df, wordvec_mat, label, "wordvec", wordvec_fpath, i, output_format)
+                self.save_sparse_part(df, topvec_mat, label, "topvec", topvec_fpath, i, output_format)
+                print(f"Finished chunk {i}:", label, len(df), "texts")
+        for label in n_texts:
+            print(f"Rate of coverage for {label}:", n_kept[label]/max(n_texts[label], 1))
+        if cache is not None:
+            print("Text cache:", cache.stats())
+
+    def build_topvec_df(self, normalize_vec:bool=False, save_output:bool=False, output_cache_fpath="", sparse_output:bool=False, n_workers:int=0, batch_size:int=1000, output_format:str="pickle") -> None:
+        """Compute topic vectors from the word vectors; with sparse_output=True, from self.wordvec_mat1/self.wordvec_mat2
+        (see build_wordvec_df) into self.topvec_mat1/self.topvec_mat2, saved as *_topvec_cache.npz + *_topvec_meta.pkl.
+        With output_format="parquet", either output is saved to the Parquet dataset {output_cache_fpath}/{text_type}/topvec/ instead.
+        """
+        if sparse_output:
+            self.topvec_mat1 = self.build_topvec_mat(self.wordvec_mat1, normalize_vec=normalize_vec)
+            print("Finished computing topic vector:", self.text_input.df_cand1_label)
+            self.topvec_mat2 = self.build_topvec_mat(self.wordvec_mat2, normalize_vec=normalize_vec)
+            print("Finished computing topic vector:", self.text_input.df_cand2_label)
+            if save_output:
+                self.save_sparse_output(self.text_input.df_cand1, self.topvec_mat1, self.text_input.df_cand1_label, "topvec", output_cache_fpath, output_format)
+                self.save_sparse_output(self.text_input.df_cand2, self.topvec_mat2, self.text_input.df_cand2_label, "topvec", output_cache_fpath, output_format)
+            return
+
+        with open_dictionary_pool(self.dictionary, n_workers) as pool:
+            self.text_input.df_cand1["topvec"] = map_batches(pool, worker_topvec_batch, self.text_input.df_cand1["wordvec"].tolist(), batch_size)
             print("Finished computing topic vector:", self.text_input.df_cand1_label)
-            self.text_input.df_cand2["topvec"] = pool.map(self.build_topvec, self.text_input.df_cand2["wordvec"])
+            self.text_input.df_cand2["topvec"] = map_batches(pool, worker_topvec_batch, self.text_input.df_cand2["wordvec"].tolist(), batch_size)
             print("Finished computing topic vector:", self.text_input.df_cand2_label)
         if normalize_vec:
             self.text_input.df_cand1["topvec"] = self.text_input.df_cand1["topvec"].map(lambda x: x/np.sum(x))
             self.text_input.df_cand2["topvec"] = self.text_input.df_cand2["topvec"].map(lambda x: x/np.sum(x))
 
-        if save_output:
+        if save_output and output_format == "parquet":
+            for df,label in [(self.text_input.df_cand1, self.text_input.df_cand1_label), (self.text_input.df_cand2, self.text_input.df_cand2_label)]:
+                self.save_sparse_output(df, sparse.csr_matrix(np.vstack(df["topvec"].values)), label, "topvec", output_cache_fpath, output_format)
+        elif save_output:
             date_string = date.today().strftime("%m%d%y")
             if not os.path.exists(f"{output_cache_fpath}/{self.text_type}/"):
                 os.mkdir(f"{output_cache_fpath}/{self.text_type}/")
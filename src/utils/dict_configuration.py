@@ -5,29 +5,43 @@ with open("../../src/configs.yml", "r") as conf:
     configs = yaml.safe_load(conf)
 
 ROOTPATH = configs["ROOTPATH"]
+# compiled dictionaries are reused across runs if a folder is configured (see TopicDictionary.save_compiled)
+COMPILED_DICT_PATH = configs.get("COMPILED_DICT_PATH", "")
 
-dictpath2016 = ROOTPATH + "index/dictionary/gtm_round1_2016_merged_full.tsv"
-dictionary2016 = TopicDictionary(
-    dictpath=dictpath2016,
-    relevance_col="if_reasonable_yijing", 
-    lemmatize=False, 
-    stemming=True, 
-    min_relevance=2,
-    post_mturk_change={"remove":[("election_campaign", "clinton")], "add":[]},
-    topic_idx_ext = [
-        "../../index/dictionary/index2topic_2016.json", 
-        "../../index/dictionary/topic2index_2016.json"]
-)
-
-dictpath2020 = ROOTPATH + "index/dictionary/gtm_round1_2020_merged_full.tsv"
-dictionary2020 = TopicDictionary(
-    dictpath=dictpath2020,
-    relevance_col="if_reasonable_yijing", 
-    lemmatize=False, 
-    stemming=True, 
-    min_relevance=2,
-    post_mturk_change={"remove":[("election_campaign", "clinton")], "add":[]},
-    topic_idx_ext = [
-        "../../index/dictionary/index2topic_2020.json", 
-        "../../index/dictionary/topic2index_2020.json"]
-)
\ No newline at end of file
+# dictionary loading options by variant; dictpath and topic_idx_ext are filled in by year
+DICTIONARY_VARIANTS = {
+    "default": dict(
+        relevance_col="if_reasonable_yijing",
+        lemmatize=False,
+        stemming=True,
+        min_relevance=2,
+        post_mturk_change={"remove":[("election_campaign", "clinton")], "add":[]},
+    ),
+}
+
+# dictionaries built so far in this process, by (year, variant)
+_DICTIONARIES = {}
+
+
+def get_dictionary(year:int, variant:str = "default") -> TopicDictionary:
+    """The dictionary of a given year and variant, built (or loaded from COMPILED_DICT_PATH) on first access
+    and then reused for the rest of the process
+    """
+    key = (int(year), variant)
+    if key not in _DICTIONARIES:
+        _DICTIONARIES[key] = TopicDictionary(
+            dictpath=ROOTPATH + f"index/dictionary/gtm_round1_{key[0]}_merged_full.tsv",
+            topic_idx_ext = [
+                f"../../index/dictionary/index2topic_{key[0]}.json",
+                f"../../index/dictionary/topic2index_{key[0]}.json"],
+            compiled_dir=COMPILED_DICT_PATH,
+            **DICTIONARY_VARIANTS[variant],
+        )
+    return _DICTIONARIES[key]
+
+
+def __getattr__(name:str) -> TopicDictionary:
+    # `from src.utils.dict_configuration import dictionary2016` only builds the 2016 dictionary, when first imported
+    if name in ["dictionary2016", "dictionary2020"]:
+        return get_dictionary(int(name[-4:]))
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,39 @@
 import pandas as pd
 import numpy as np
+from scipy import sparse
 # from nltk.stem import WordNetLemmatizer
 from typing import List
 import json
+import os, hashlib, pickle
 from src.utils.preprocessor import get_lemmas, get_stems
 from src.utils.preprocessor import TOKENIZER
 from src.utils.text import contractions
+from src.utils.keyword_matcher import KeywordMatcher
 # import os, re 
 
+# bump when the way a dictionary is compiled changes (e.g. preprocessing, matcher, artifact layout),
+# so that existing compiled dictionaries are not reused
+COMPILED_VERSION = 1
+
+
+def compiled_dictionary_hash(dictpath:str, options:dict, topic_idx_ext:List = []) -> str:
+    """Content hash of a dictionary: the dictionary file, the index files, the loading options and COMPILED_VERSION"""
+    h = hashlib.sha256()
+    h.update(str(COMPILED_VERSION).encode())
+    with open(dictpath, "rb") as f:
+        h.update(f.read())
+    for fpath in topic_idx_ext:
+        with open(fpath, "rb") as f:
+            h.update(f.read())
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def overlap_adjacency(overlap_mat:sparse.csr_matrix) -> List[List[int]]:
+    """Row i of the overlap matrix as a list of the indices of the words containing word i"""
+    return [row.tolist() for row in np.split(np.asarray(overlap_mat.indices), overlap_mat.indptr[1:-1])]
+
+
 class TopicDictionary():
     def __init__(
         self, 
@@ -20,6 +46,7 @@ class TopicDictionary():
         post_mturk_change: dict = {"remove":[], "add":[]},
         topic_idx_ext: List = [],
         # word_idx_ext: List = [], 
+        compiled_dir: str = "",
     ) -> None:
         """_summary_
 
@@ -31,8 +58,42 @@ class TopicDictionary():
             min_relevance (int, optional): the minimum value of relevance we need in the dictioanry (to filter the dataframe), defalt set to 1
 
             lemmatize: a bool switch to indicate whether we need to lemmatize the dictionary, default set to False
+
+            compiled_dir (str, optional): if given, the compiled dictionary (index maps, topic word matrix, overlap structure and matcher)
+                is saved under this folder, keyed by the content hash of the dictionary and the options above, and loaded
+                from there (memory-mapped) on later runs instead of being rebuilt
         """
 
+        options = {
+            "relevance_col": relevance_col, "min_relevance": min_relevance, "lemmatize": lemmatize, "stemming": stemming,
+            "weight_col": weight_col, "post_mturk_change": post_mturk_change, "topic_idx_ext": len(topic_idx_ext) > 0}
+        # identifies the dictionary content (e.g. to invalidate cached keyword counts when the dictionary changes)
+        self.dict_hash = compiled_dictionary_hash(dictpath, options, topic_idx_ext)
+        if len(compiled_dir) > 0:
+            self.compiled_fpath = os.path.join(compiled_dir, "{}-{}".format(os.path.splitext(os.path.basename(dictpath))[0], self.dict_hash[:16]))
+        if len(compiled_dir) > 0 and os.path.exists(os.path.join(self.compiled_fpath, "meta.json")):
+            self.load_compiled(self.compiled_fpath)
+        else:
+            self.build(dictpath, relevance_col, min_relevance, lemmatize, stemming, weight_col, post_mturk_change, topic_idx_ext)
+            if len(compiled_dir) > 0:
+                self.save_compiled(self.compiled_fpath, self.dict_hash, options)
+
+        print("Successfully loaded dictionary!")
+        print("\t# of unique topics:", len(self.topics))
+        print("\t# of unique words:", len(self.words))
+
+    def build(
+        self,
+        dictpath: str,
+        relevance_col: str,
+        min_relevance: int,
+        lemmatize: bool,
+        stemming: bool,
+        weight_col: str,
+        post_mturk_change: dict,
+        topic_idx_ext: List,
+    ) -> None:
+        """Build the dictionary from the dictionary file (see __init__ for the arguments)"""
         df = pd.read_csv(dictpath, sep="\t")
         df = df[df[relevance_col]>=min_relevance].reset_index().drop(columns=["index"])
 
@@ -44,18 +105,23 @@ class TopicDictionary():
                 new_row = {"topic":t, "word":w, relevance_col:rel}
                 df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
 
-        df["word"] = df["word"].map(lambda x: str(x).lower().strip())
+        df["word"] = df["word"].astype(str).str.lower().str.strip()
         for char in ["_", "-", " & ", "/"]:
-            df["word"] = df["word"].map(lambda x: str(x).replace(char, " "))
-        df["word"] = df["word"].map(lambda x: contractions.expand(x, drop_ownership=True))
-        df["tokens"] =  df["word"].map(lambda x: x.split(" "))
-        df["n_tokens"] = df["tokens"].map(lambda x: len(x))
+            df["word"] = df["word"].str.replace(char, " ", regex=False)
+        # contractions, lemmas and stems are computed once per distinct word
+        words = df["word"].unique()
+        df["word"] = df["word"].map({w: contractions.expand(w, drop_ownership=True) for w in words})
+        df["tokens"] = df["word"].str.split(" ")
+        df["n_tokens"] = df["tokens"].str.len()
         
+        words = df["word"].unique()
+        if lemmatize:
+            df["lemmas"] = df["word"].map({w: get_lemmas(w.split(" ")) for w in words})
+        if stemming:
+            df["stems"] = df["word"].map({w: get_stems(w.split(" ")) for w in words})
         if lemmatize:
-            df["lemmas"] = df["tokens"].map(lambda x: get_lemmas(x))
             df["word"] = df["lemmas"].map(lambda x: " ".join(x))
         if stemming:
-            df["stems"] = df["tokens"].map(lambda x: get_stems(x))
             df["word"] = df["stems"].map(lambda x: " ".join(x))
 
 
@@ -91,6 +157,24 @@ class TopicDictionary():
         # TODO: implement external index source for words too
         self.words = df.word.unique()
         self.n_words = df.word.nunique()
+        self.set_word_index()
+        # all-keyword matcher used when counting keywords (built once per dictionary)
+        self.matcher = KeywordMatcher(self.words)
+
+        # construct topic word matrix
+        indx_t = df["topic"].map(self.topic2index).values.astype(int)
+        indx_w = df["word"].map(self.word2index).values.astype(int)
+        if len(weight_col) > 0:  # apply different weights on topic keywords
+            weights = df[weight_col].values.astype(float)
+        else:
+            weights = np.ones(len(df))
+        self.topword_matrix = np.zeros((self.n_topics, self.n_words))
+        np.add.at(self.topword_matrix, (indx_t, indx_w), weights)
+        self.topword_sparse = sparse.csr_matrix(self.topword_matrix)
+
+        self.construct_overlap_matrix()
+
+    def set_word_index(self) -> None:
         for i,w in enumerate(self.words):
             self.index2word[i] = w
             self.word2index[w] = i
@@ -99,33 +183,83 @@ class TopicDictionary():
             self.nonspace_index2word[i] = w
             self.nonspace_word2index[w] = i
 
-        print("Successfully loaded dictionary!")
-        print("\t# of unique topics:", len(self.topics))
-        print("\t# of unique words:", len(self.words))
+    def construct_overlap_matrix(self) -> None:
+        """Index every word by the longer words containing it as a run of whole tokens
+        (e.g. "wall" -> "border wall", "build the wall"), looking up the shorter n-grams of each word
+        instead of comparing all pairs of words.
 
-        # construct topic word matrix
-        self.topword_matrix = np.zeros((self.n_topics, self.n_words))
-        if len(weight_col) > 0:  # apply different weights on topic keywords
-            for i,row in df.iterrows():
-                indx_t = self.topic2index[row.topic]
-                indx_w = self.word2index[row.word]
-                self.topword_matrix[indx_t, indx_w] += row[weight_col]
-        else:
-            for i,row in df.iterrows():
-                indx_t = self.topic2index[row.topic]
-                indx_w = self.word2index[row.word]
-                self.topword_matrix[indx_t, indx_w] += 1
+        self.overlap_mat[i, j] is True if word j contains word i (sparse boolean, n_words x n_words);
+        self.overlap_words[i] lists these j (used to resolve overlapping matches when counting keywords).
+        """
+        pairs = set()
+        for idx_j,w in enumerate(self.words):
+            tokens = w.split(" ")
+            n_tokens = len(tokens)
+            for n in range(1, n_tokens):
+                for start in range(n_tokens - n + 1):
+                    idx_i = self.word2index.get(" ".join(tokens[start:start+n]))
+                    if idx_i is not None:
+                        pairs.add((idx_i, idx_j))
+        pairs = sorted(pairs)
+        rows = [i for i,_ in pairs]
+        cols = [j for _,j in pairs]
+        self.overlap_mat = sparse.csr_matrix((np.ones(len(pairs), dtype=bool), (rows, cols)), shape=(self.n_words, self.n_words))
+        self.overlap_words = overlap_adjacency(self.overlap_mat)
 
-    def construct_overlap_matrix(self) -> None:
-        self.overlap_mat = np.zeros((self.n_words, self.n_words))
-        for i in self.words:
-            for j in self.words:
-                if (" " + i in j) or (i + " " in j) or (" " + i + " " in j):
-                    idx_i = self.word2index[i]
-                    idx_j = self.word2index[j]
-                    self.overlap_mat[idx_i, idx_j] += 1
-        # self.overlap_mat -= np.identity(self.n_words)
-        # construct overlap matrix --> for later deduction to prevent over-counting
+    def save_compiled(self, fpath:str, dict_hash:str, options:dict) -> None:
+        """Save the compiled dictionary to a folder: arrays as .npy files (memory-mapped when loading),
+        index maps, dictionary frame and matcher in a pickle, and a meta.json with the version, hash and options
+        """
+        os.makedirs(fpath, exist_ok=True)
+        np.save(os.path.join(fpath, "topword_data.npy"), self.topword_sparse.data)
+        np.save(os.path.join(fpath, "topword_indices.npy"), self.topword_sparse.indices)
+        np.save(os.path.join(fpath, "topword_indptr.npy"), self.topword_sparse.indptr)
+        np.save(os.path.join(fpath, "overlap_indices.npy"), self.overlap_mat.indices)
+        np.save(os.path.join(fpath, "overlap_indptr.npy"), self.overlap_mat.indptr)
+        objects = {
+            "df": self.df,
+            "words": self.words,
+            "topic2index": self.topic2index,
+            "index2topic": self.index2topic,
+            "matcher": self.matcher,
+        }
+        with open(os.path.join(fpath, "dictionary.pkl"), "wb") as f:
+            pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # written last: a folder without meta.json is an unfinished compilation and is rebuilt
+        with open(os.path.join(fpath, "meta.json"), "w") as f:
+            json.dump({"version": COMPILED_VERSION, "hash": dict_hash, "options": options,
+                       "n_topics": self.n_topics, "n_words": self.n_words}, f, indent=1, default=str)
+
+    def load_compiled(self, fpath:str) -> None:
+        """Load a dictionary saved by save_compiled"""
+        with open(os.path.join(fpath, "meta.json"), "r") as f:
+            meta = json.load(f)
+        assert meta["version"] == COMPILED_VERSION, "compiled dictionary version {} != {}".format(meta["version"], COMPILED_VERSION)
+        with open(os.path.join(fpath, "dictionary.pkl"), "rb") as f:
+            objects = pickle.load(f)
+
+        self.df = objects["df"]
+        self.words = objects["words"]
+        self.topic2index = objects["topic2index"]
+        self.index2topic = objects["index2topic"]
+        self.topics = self.topic2index.keys() if meta["options"]["topic_idx_ext"] else list(self.topic2index.keys())
+        self.n_topics = meta["n_topics"]
+        self.n_words = meta["n_words"]
+        self.word2index = {}
+        self.index2word = {}
+        self.nonspace_word2index = {}
+        self.nonspace_index2word = {}
+        self.set_word_index()
+        self.matcher = objects["matcher"]
+
+        load = lambda name: np.load(os.path.join(fpath, name + ".npy"), mmap_mode="r")
+        self.topword_sparse = sparse.csr_matrix(
+            (load("topword_data"), load("topword_indices"), load("topword_indptr")), shape=(self.n_topics, self.n_words))
+        self.topword_matrix = self.topword_sparse.toarray()
+        overlap_indices = load("overlap_indices")
+        self.overlap_mat = sparse.csr_matrix(
+            (np.ones(len(overlap_indices), dtype=bool), overlap_indices, load("overlap_indptr")), shape=(self.n_words, self.n_words))
+        self.overlap_words = overlap_adjacency(self.overlap_mat)
 
     def convert_to_json(self, output_fpath) -> None:
         aggr_func = {"word": lambda x: list(x)}
@@ -2,10 +2,14 @@
 
 import pandas as pd 
 import numpy as np 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from datetime import datetime
+from scipy import sparse
+import glob
 
 from src.utils.dict_loader import TopicDictionary
+from src.utils.downstream_matrix import aggregate_headline_mat, aggregate_headline_groups_mat, domain_group_table, aggregate_rows_mat, select_rows, sample_rows, stack_vectors
+from src.utils.downstream_bootstrap import HeadlineBootstrap, BootstrapSummary
 from src.utils.downstream_process import merge_topics_from_arr, collapse_general_controversies, get_majority
 from src.utils.downstream_process import trim_period, assign_popularity_weight, normalize
 
@@ -21,6 +25,54 @@ def load_model_output(fpath:str, start, end, trim:bool=False, strip_time=True) -
         df = trim_period(df, start=start, end=end)
     return df 
 
+def load_sparse_model_output(fpath:str, start, end, trim:bool=False, strip_time=True) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Load a sparse model output: the metadata frame (*_meta.pkl) and the vector matrix (*_cache.npz) with aligned rows.
+    fpath is the path to the *_cache.npz file.
+    """
+    df = pd.read_pickle(fpath.replace("_cache.npz", "_meta.pkl"))
+    mat = sparse.load_npz(fpath).tocsr()
+    if strip_time:
+        df["date"] = df["date"].map(lambda x: str(x)[:10])
+    if not isinstance(df["date"].tolist()[0], datetime):
+        df["date"] = pd.to_datetime(df["date"])
+    if trim:
+        df, mat = select_rows(df, mat, ((df["date"]>=start)&(df["date"]<=end)).values)
+        df = df.reset_index().drop(columns="index")
+    return df, mat
+
+def load_sparse_model_parts(folderpath:str, vec_type:str, start, end, trim:bool=False, strip_time=True) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Load all the parts of a streamed sparse model output (DictBasedTopicModel.stream_headline_vectors),
+    e.g. folderpath = ".../headline/trump2020_parts/", vec_type = "topvec"
+    """
+    dfs, mats = [], []
+    for fpath in sorted(glob.glob(f"{folderpath}/part-*_{vec_type}_cache.npz")):
+        df, mat = load_sparse_model_output(fpath, start, end, trim=trim, strip_time=strip_time)
+        dfs.append(df)
+        mats.append(mat)
+    if len(dfs) == 0:
+        print(f"No {vec_type} parts found in {folderpath}!")
+        return pd.DataFrame(columns=["date","domain","path","textbody"]), sparse.csr_matrix((0, 0))
+    return pd.concat(dfs, ignore_index=True), sparse.vstack(mats).tocsr()
+
+def load_model_output_parquet(fpath:str, vec_type:str, label:str, start, end, trim:bool=False, strip_time=True, columns:List=["date","domain","path","textbody"]) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Load a model output saved with output_format="parquet" (e.g. fpath = ".../cache-topvec-min2/headline", vec_type = "topvec",
+    label = "trump2020"): the metadata frame (only the given columns) and the vector matrix with aligned rows.
+    With trim, only the days in [start, end] are read from disk.
+    """
+    from src.utils.columnar_output import load_vector_dataset  # pyarrow is only needed for the Parquet format
+    if trim:
+        df, mat = load_vector_dataset(fpath, vec_type, label=label, start=str(start)[:10], end=str(end)[:10], columns=columns)
+    else:
+        df, mat = load_vector_dataset(fpath, vec_type, label=label, columns=columns)
+    if strip_time:
+        df["date"] = df["date"].map(lambda x: str(x)[:10])
+    if not isinstance(df["date"].tolist()[0], datetime):
+        df["date"] = pd.to_datetime(df["date"])
+    if trim:
+        df, mat = select_rows(df, mat, ((df["date"]>=start)&(df["date"]<=end)).values)
+        df = df.reset_index().drop(columns="index")
+    return df, mat
+
 def aggregate_headline_topvec(
         output_df:pd.DataFrame, 
         raw_df:pd.DataFrame,
@@ -33,7 +85,8 @@ def aggregate_headline_topvec(
         popularity_dict:Dict = {},
         print_info:bool = False, 
         # normalize_by_day:bool = True,
-        normalize_by_snapshot:bool = True) -> pd.DataFrame:
+        normalize_by_snapshot:bool = True,
+        output_mat:sparse.csr_matrix = None) -> pd.DataFrame:
     """Aggregate headline topic vectors by a given time unit 
 
     Args:
@@ -46,58 +99,53 @@ def aggregate_headline_topvec(
         force_time_window(List, optional): force the output into a specified time window (input should be a list of dates). Defaults to [].
         weight_by_popularity (bool, optional): whether to weight the topic count by the domain popularity. Defaults to False.
         popularity_dict (Dict, optional): if weight_by_popularity is True, provide a dictionary of popularity that will be used as weights to multiply with topic counts. Defaults to {}.
+        output_mat (sparse.csr_matrix, optional): the topic vectors of output_df as a sparse matrix (rows aligned with output_df), for the sparse output format. Defaults to None.
 
     Returns:
         pd.DataFrame: return an aggregated dataframe 
     """
-    # if select a certain number of domains
-    if len(select_domains) > 0:
-        process_df = output_df[output_df["domain"].isin(select_domains)].copy()
-        raw_df_select = raw_df[raw_df["domain"].isin(select_domains)].copy()
-    else:
-        process_df = output_df.copy()
-        raw_df_select = raw_df.copy()
-    # manipulate topic output: merge and collapse topics
-    process_df["topvec"] = process_df["topvec"].map(lambda x:merge_topics_from_arr(x, merge_to="government_ops", to_merge="election_campaign", dictionary=dictionary))
-    process_df["topvec"] = process_df["topvec"].map(lambda x: collapse_general_controversies(x, cand, dictionary))
-    process_df["majority_topvec"] = process_df["topvec"].map(lambda x: get_majority(x))
-
-    if weight_by_popularity:
-        if len(popularity_dict) == 0:
-            print("If hoping to use popularity weight, please feed in a popularity dictionary (currently empty)!")
-        else:
-            process_df["pop_weight"] = process_df["domain"].map(lambda x: assign_popularity_weight(x, popularity_dict=popularity_dict))
-            process_df["majority_topvec"] = process_df.apply(lambda x: x["topvec"]*x["pop_weight"], axis=1)
-
-    # merge topic output with the full headlines parsed from data (now we do not drop anything)
-    aggr_func = {"majority_topvec": lambda x: np.sum(np.array(list(x)), axis=0), "path": lambda x: len(set(x))}
-    full_process_df = raw_df_select.merge(process_df[["textbody","majority_topvec"]], how="left", on="textbody").dropna(subset="majority_topvec")
-    
-    # normalize topic vectors by domain by day 
-    full_aggr_df = full_process_df.groupby(["domain","date"]).agg(aggr_func).reset_index()
-    if normalize_by_snapshot:
-        # full_aggr_df["majority_topvec"] = full_aggr_df["majority_topvec"].map(lambda x: normalize(x))
-        full_aggr_df["majority_topvec"] = full_aggr_df["majority_topvec"]/full_aggr_df["path"]
-    full_aggr_df["date"] = pd.to_datetime(full_aggr_df["date"])
-    if print_info:
-        print("\t# of unique domains:", full_aggr_df["domain"].nunique())
+    # the topic vectors are stacked into one matrix and aggregated column-wise (merging/collapsing topics, majority vote,
+    # summing by domain by day and by time unit), instead of mapping a function over every row
+    if output_mat is None:
+        output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    return aggregate_headline_mat(
+        output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit=aggr_unit, vec_col="majority_topvec",
+        dictionary=dictionary, cand=cand, select_domains=select_domains, force_time_window=force_time_window,
+        weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict, print_info=print_info,
+        normalize_by_snapshot=normalize_by_snapshot)
+
+
+def aggregate_headline_topvec_groups(
+        output_df:pd.DataFrame,
+        raw_df:pd.DataFrame,
+        aggr_unit:str,
+        cand:str,
+        dictionary:TopicDictionary,
+        group_table:pd.DataFrame,
+        force_time_window:List = [],
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {},
+        print_info:bool = False,
+        normalize_by_snapshot:bool = True,
+        output_mat:sparse.csr_matrix = None) -> Dict[str, pd.DataFrame]:
+    """Aggregate headline topic vectors by a given time unit for several groups of domains at once
+    (e.g. the full list and the lowc/trad/left/center/right subsets), in one pass over the data
 
-    # aggregate output by a given time unit
-    aggr_func_by_unit = {"majority_topvec": lambda x: np.sum(list(x), axis=0)}
-    full_aggr_df_by_unit = full_aggr_df.set_index("date").resample(aggr_unit).agg(aggr_func_by_unit).reset_index()
-    full_aggr_df_by_unit["majority_topvec"] = full_aggr_df_by_unit["majority_topvec"].map(lambda x: x if np.sum(x) > 0 else np.zeros(dictionary.n_topics))
-    if print_info:
-        print("\tstart:", full_aggr_df_by_unit["date"].min())
-        print("\tend:", full_aggr_df_by_unit["date"].max())
+    Args:
+        group_table (pd.DataFrame): the domain -> group membership table ("domain" and "group" columns, one row per domain and group),
+            e.g. domain_group_table({"": domains_to_include, "_lowc": lowcs, "_trad": trads}).
+        (the other arguments are the same as aggregate_headline_topvec)
 
-    if len(force_time_window) > 0:
-        full_aggr_df_by_unit_fix = pd.DataFrame()
-        full_aggr_df_by_unit_fix["date"] = force_time_window
-        full_aggr_df_by_unit_fix = full_aggr_df_by_unit_fix.merge(full_aggr_df_by_unit, how="left", on="date").fillna(0)
-        full_aggr_df_by_unit_fix["majority_topvec"] = full_aggr_df_by_unit_fix["majority_topvec"].map(lambda x: x if np.sum(x) > 0 else np.zeros(dictionary.n_topics))
-        return full_aggr_df_by_unit_fix
-    else:
-        return full_aggr_df_by_unit
+    Returns:
+        Dict[str, pd.DataFrame]: {group: the aggregated dataframe of aggregate_headline_topvec with select_domains = the domains of the group}
+    """
+    if output_mat is None:
+        output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    return aggregate_headline_groups_mat(
+        output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit=aggr_unit, vec_col="majority_topvec",
+        dictionary=dictionary, group_table=group_table, cand=cand, force_time_window=force_time_window,
+        weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict, print_info=print_info,
+        normalize_by_snapshot=normalize_by_snapshot)
 
 
 def aggregate_survey_topvec(
@@ -107,7 +155,8 @@ def aggregate_survey_topvec(
         dictionary:TopicDictionary,
         force_time_window:List = [],
         select_leaning:str="", 
-        apply_weights:bool = True) -> pd.DataFrame:
+        apply_weights:bool = True,
+        output_mat:sparse.csr_matrix = None) -> pd.DataFrame:
     """Aggregate survey topic vectors by a given time unit.
 
     Args:
@@ -117,10 +166,19 @@ def aggregate_survey_topvec(
         dictionary (TopicDictionary): the topic dictionary to use.
         select_leaning (str, optional): select a certain group of respondents. Defaults to "".
         force_time_window(List, optional): force the output into a specified time window (input should be a list of dates). Defaults to [].
+        output_mat (sparse.csr_matrix, optional): the topic vectors of output_df as a sparse matrix (rows aligned with output_df). Defaults to None.
 
     Returns:
         pd.DataFrame: return an aggregated dataframe 
     """
+    if output_mat is not None:
+        if len(select_leaning) > 0:
+            output_df, output_mat = select_rows(output_df, output_mat, (output_df["partyln"]==select_leaning).values)
+        return aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=pd.to_datetime(output_df["date"]).tolist(), aggr_unit=aggr_unit,
+            vec_col="majority_topvec", dictionary=dictionary, cand=cand, force_time_window=force_time_window,
+            row_weight_col="weights" if apply_weights else "")
+
     if len(select_leaning) > 0:
         process_df = output_df[output_df["partyln"]==select_leaning].copy()
     else:
@@ -155,7 +213,8 @@ def aggregate_tweet_topvec(
         aggr_unit:str,
         cand:str,
         dictionary:TopicDictionary,
-        force_time_window:List = []) -> pd.DataFrame:
+        force_time_window:List = [],
+        output_mat:sparse.csr_matrix = None) -> pd.DataFrame:
     """Aggregate tweet topic vectors by a given time unit 
 
     Args:
@@ -165,10 +224,16 @@ def aggregate_tweet_topvec(
         dictionary (TopicDictionary): the topic dictionary to use.
         select_leaning (str, optional): select a certain group of respondents. Defaults to "".
         force_time_window(List, optional): force the output into a specified time window (input should be a list of dates). Defaults to [].
+        output_mat (sparse.csr_matrix, optional): the topic vectors of output_df as a sparse matrix (rows aligned with output_df). Defaults to None.
 
     Returns:
         pd.DataFrame: return an aggregated dataframe 
     """
+    if output_mat is not None:
+        return aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=output_df["date"].map(lambda x: pd.to_datetime(str(x)[:10])).tolist(),
+            aggr_unit=aggr_unit, vec_col="majority_topvec", dictionary=dictionary, cand=cand, force_time_window=force_time_window)
+
     process_df = output_df.copy()
     process_df["topvec"] = process_df["topvec"].map(lambda x:merge_topics_from_arr(x, merge_to="government_ops", to_merge="election_campaign", dictionary=dictionary))
     process_df["topvec"] = process_df["topvec"].map(lambda x: collapse_general_controversies(x, cand, dictionary))
@@ -206,7 +271,14 @@ def bootstrap_aggregate_topvec(
         normalize_by_snapshot:bool = True, 
         apply_survey_weights:bool = True,
         bootstrap_runs:int = 200,
-        sample_frac:float = .8,):
+        sample_frac:float = .8,
+        output_mat:sparse.csr_matrix = None,
+        seed:int = None,
+        resample:str = "subsample",
+        block_size:int = 10,
+        n_workers:int = 1,
+        checkpoint_dir:str = "",
+        summary:BootstrapSummary = None):
     """Perform bootstrapping in by-unit aggregation
 
     Args:
@@ -221,31 +293,38 @@ def bootstrap_aggregate_topvec(
         force_time_window (List, optional): force the output into a specified time window (input should be a list of dates). Defaults to [].
         bootstrap_runs (int, optional): the number of rounds for bootstrapping. Defaults to 200.
         sample_frac (float, optional): the fraction of dataframe for sampling. Defaults to .8.
+        output_mat (sparse.csr_matrix, optional): the topic vectors of output_df as a sparse matrix (rows aligned with output_df). Defaults to None.
+        seed (int, optional): the seed of the random samples (the same seed gives the same runs). Defaults to None.
+        resample (str, optional): headlines only, "subsample" (sample_frac of the headlines without replacement) or "multinomial" (with replacement). Defaults to "subsample".
+        block_size (int, optional): headlines only, the number of runs aggregated at once. Defaults to 10.
+        n_workers (int, optional): headlines only, the number of processes running blocks (0 uses all but two cores). Defaults to 1.
+        checkpoint_dir (str, optional): headlines only, a folder where finished blocks are saved, to resume an interrupted job. Defaults to "".
+        summary (BootstrapSummary, optional): if given, only running statistics of the runs are kept and returned (mean, variance, quantiles per cell),
+            instead of the (runs x dates x topics) array. Defaults to None.
 
     Returns:
         _type_: _description_
     """
     bstr_arr = []
+    rng = np.random.default_rng(seed)
     if data_source == "headline":
-        for i in range(bootstrap_runs):
-            if i%20==0: print("progress:", i/bootstrap_runs)    
-            bstr_raw_df = raw_df.sample(frac=sample_frac)
-            bstr_aggr_df = aggregate_headline_topvec(
-                output_df=output_df, 
-                raw_df=bstr_raw_df, 
-                aggr_unit=aggr_unit, 
-                cand=cand, 
-                dictionary=dictionary,
-                select_domains=select_domains,
-                force_time_window=force_time_window,
-                weight_by_popularity=weight_by_popularity,
-                popularity_dict=popularity_dict,
-                normalize_by_snapshot=normalize_by_snapshot)
-            bstr_arr.append(np.array(bstr_aggr_df["majority_topvec"].tolist()))
+        # all runs are aggregated from the same precomputed vectors and groups (see HeadlineBootstrap)
+        if output_mat is None:
+            output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+        bstr_arr = HeadlineBootstrap(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit=aggr_unit, vec_col="majority_topvec",
+            dictionary=dictionary, cand=cand, select_domains=select_domains, force_time_window=force_time_window,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict,
+            normalize_by_snapshot=normalize_by_snapshot,
+        ).run(bootstrap_runs=bootstrap_runs, sample_frac=sample_frac, seed=seed, resample=resample, block_size=block_size,
+            n_workers=n_workers, checkpoint_dir=checkpoint_dir, summary=summary)
     elif data_source == "survey":
         for i in range(bootstrap_runs):
             if i%20==0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_aggr_df = aggregate_survey_topvec(
                 output_df=bstr_output_df,
                 aggr_unit=aggr_unit,
@@ -253,22 +332,32 @@ def bootstrap_aggregate_topvec(
                 dictionary=dictionary,
                 force_time_window=force_time_window,
                 select_leaning=select_leaning, 
-                apply_weights=apply_survey_weights)
+                apply_weights=apply_survey_weights,
+                output_mat=bstr_output_mat)
             bstr_arr.append(np.array(bstr_aggr_df["majority_topvec"].tolist()))
     elif data_source == "tweet":
         for i in range(bootstrap_runs):
             if i%20==0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_aggr_df = aggregate_tweet_topvec(
                 output_df=bstr_output_df,
                 aggr_unit=aggr_unit,
                 cand=cand,
                 dictionary=dictionary,
-                force_time_window=force_time_window)
+                force_time_window=force_time_window,
+                output_mat=bstr_output_mat)
             bstr_arr.append(np.array(bstr_aggr_df["majority_topvec"].tolist()))
     else:
         print("Please enter a valid data source! (headline, survey, tweet)")
 
+    if summary is not None:
+        # headline runs are already in the summary (block by block)
+        if data_source != "headline":
+            summary.update(np.array(bstr_arr))
+        return summary
     bstr_arr = np.array(bstr_arr)
     if len(force_time_window) > 0:
         assert bstr_arr.shape == (bootstrap_runs, len(force_time_window), dictionary.n_topics), "Wrong output array shape!"
@@ -287,8 +376,16 @@ def aggregate_headline_wordvec(
         popularity_dict:Dict={},
         print_info:bool = False,
         # normalize_by_day:bool = True,
-        normalize_by_snapshot:bool = True) -> pd.DataFrame:
-    
+        normalize_by_snapshot:bool = True,
+        output_mat:sparse.csr_matrix = None) -> pd.DataFrame:
+
+    if output_mat is not None:
+        return aggregate_headline_mat(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit=aggr_unit, vec_col="wordvec",
+            dictionary=dictionary, select_domains=select_domains, force_time_window=force_time_window,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict, print_info=print_info,
+            normalize_by_snapshot=normalize_by_snapshot)
+
     if len(select_domains) > 0:
         process_df = output_df[output_df["domain"].isin(select_domains)].copy()
         raw_df_select = raw_df[raw_df["domain"].isin(select_domains)].copy()
@@ -335,14 +432,45 @@ def aggregate_headline_wordvec(
         return full_aggr_df_by_unit 
     
 
+def aggregate_headline_wordvec_groups(
+        output_df:pd.DataFrame,
+        raw_df:pd.DataFrame,
+        aggr_unit:str,
+        dictionary:TopicDictionary,
+        group_table:pd.DataFrame,
+        force_time_window:List = [],
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {},
+        print_info:bool = False,
+        normalize_by_snapshot:bool = True,
+        output_mat:sparse.csr_matrix = None) -> Dict[str, pd.DataFrame]:
+    """aggregate_headline_wordvec for every group of domains in group_table at once (see aggregate_headline_topvec_groups)"""
+    if output_mat is None:
+        output_mat = stack_vectors(output_df, "wordvec", dictionary.n_words)
+    return aggregate_headline_groups_mat(
+        output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit=aggr_unit, vec_col="wordvec",
+        dictionary=dictionary, group_table=group_table, force_time_window=force_time_window,
+        weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict, print_info=print_info,
+        normalize_by_snapshot=normalize_by_snapshot)
+
+
 def aggregate_survey_wordvec(
         output_df:pd.DataFrame,
         aggr_unit:str, 
         dictionary:TopicDictionary,
         force_time_window:List = [],
         select_leaning:str = "",
-        apply_weights:bool = True) -> pd.DataFrame:
-    
+        apply_weights:bool = True,
+        output_mat:sparse.csr_matrix = None) -> pd.DataFrame:
+
+    if output_mat is not None:
+        if len(select_leaning) > 0:
+            output_df, output_mat = select_rows(output_df, output_mat, (output_df["partyln"]==select_leaning).values)
+        return aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=pd.to_datetime(output_df["date"]).tolist(), aggr_unit=aggr_unit,
+            vec_col="wordvec", dictionary=dictionary, force_time_window=force_time_window,
+            row_weight_col="weights" if apply_weights else "")
+
     if len(select_leaning) > 0:
         process_df = output_df[output_df["partyln"]==select_leaning].copy()
     else:
@@ -370,7 +498,13 @@ def aggregate_tweet_wordvec(
         output_df:pd.DataFrame,
         aggr_unit:str, 
         dictionary:TopicDictionary,
-        force_time_window:List = []) -> pd.DataFrame:
+        force_time_window:List = [],
+        output_mat:sparse.csr_matrix = None) -> pd.DataFrame:
+
+    if output_mat is not None:
+        return aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=output_df["date"].map(lambda x: pd.to_datetime(str(x)[:10])).tolist(),
+            aggr_unit=aggr_unit, vec_col="wordvec", dictionary=dictionary, force_time_window=force_time_window)
 
     process_df = output_df.copy()
     
@@ -404,48 +538,65 @@ def bootstrap_aggregate_wordvec(
         normalize_by_snapshot:bool = True, 
         apply_survey_weights:bool = True,
         bootstrap_runs:int = 200,
-        sample_frac:float = .8,):
+        sample_frac:float = .8,
+        output_mat:sparse.csr_matrix = None,
+        seed:int = None,
+        resample:str = "subsample",
+        block_size:int = 10,
+        n_workers:int = 1,
+        checkpoint_dir:str = "",
+        summary:BootstrapSummary = None):
     bstr_arr = []
+    rng = np.random.default_rng(seed)
     if data_source == "headline":
-        for i in range(bootstrap_runs):
-            if i%20 == 0: print("progress:", i/bootstrap_runs)
-            bstr_raw_df = raw_df.sample(frac=sample_frac)
-            bstr_aggr_df = aggregate_headline_wordvec(
-                output_df=output_df, 
-                raw_df=bstr_raw_df,
-                aggr_unit=aggr_unit,
-                dictionary=dictionary,
-                select_domains=select_domains,
-                force_time_window=force_time_window,
-                weight_by_popularity=weight_by_popularity,
-                popularity_dict=popularity_dict,
-                normalize_by_snapshot=normalize_by_snapshot)
-            bstr_arr.append(np.array(bstr_aggr_df["wordvec"].tolist()))
+        # all runs are aggregated from the same precomputed vectors and groups (see HeadlineBootstrap)
+        if output_mat is None:
+            output_mat = stack_vectors(output_df, "wordvec", dictionary.n_words)
+        bstr_arr = HeadlineBootstrap(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit=aggr_unit, vec_col="wordvec",
+            dictionary=dictionary, select_domains=select_domains, force_time_window=force_time_window,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict,
+            normalize_by_snapshot=normalize_by_snapshot,
+        ).run(bootstrap_runs=bootstrap_runs, sample_frac=sample_frac, seed=seed, resample=resample, block_size=block_size,
+            n_workers=n_workers, checkpoint_dir=checkpoint_dir, summary=summary)
     elif data_source == "survey":
         for i in range(bootstrap_runs):
             if i%20 == 0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_aggr_df = aggregate_survey_wordvec(
                 output_df=bstr_output_df,
                 aggr_unit=aggr_unit,
                 dictionary=dictionary,
                 force_time_window=force_time_window,
                 select_leaning=select_leaning,
-                apply_weights=apply_survey_weights)
+                apply_weights=apply_survey_weights,
+                output_mat=bstr_output_mat)
             bstr_arr.append(np.array(bstr_aggr_df["wordvec"].tolist()))
     elif data_source == "tweet":
         for i in range(bootstrap_runs):
             if i%20 == 0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_aggr_df = aggregate_tweet_wordvec(
                 output_df=bstr_output_df,
                 aggr_unit=aggr_unit,
                 dictionary=dictionary,
-                force_time_window=force_time_window)
+                force_time_window=force_time_window,
+                output_mat=bstr_output_mat)
             bstr_arr.append(np.array(bstr_aggr_df["wordvec"].tolist()))
     else:
         print("Please enter a valid data source! (headline, survey, tweet)")
     
+    if summary is not None:
+        # headline runs are already in the summary (block by block)
+        if data_source != "headline":
+            summary.update(np.array(bstr_arr))
+        return summary
     bstr_arr = np.array(bstr_arr)
     if len(force_time_window) > 0:
         assert bstr_arr.shape == (bootstrap_runs, len(force_time_window), dictionary.n_words), "Wrong output array shape!"
@@ -0,0 +1,373 @@
+"""Code for bootstrapping headline aggregations in batches of runs
+
+Instead of re-running the whole aggregation (merge, group-by, resample) on every sample of raw_df, the vectors, domain-day
+groups and time units of all headlines are computed once; every run is then a row of weights over the raw headlines
+(1 for the sampled ones), and a block of runs is aggregated with a few sparse matrix products.
+"""
+
+import pandas as pd
+import numpy as np
+import os, json, hashlib
+import multiprocess as mp
+from scipy import sparse
+from typing import List, Dict, Tuple, Any
+
+from src.utils.dict_loader import TopicDictionary
+from src.utils.downstream_matrix import prepare_headline_mat, select_rows, match_raw_rows, resample_codes
+
+
+def draw_bootstrap_weights(rng:np.random.Generator, n_rows:int, runs:int, sample_frac:float, resample:str = "subsample") -> sparse.csr_matrix:
+    """The (runs x n_rows) weights of the raw rows in every run
+
+    Args:
+        resample (str, optional): "subsample" draws round(sample_frac*n_rows) rows without replacement (as raw_df.sample(frac=sample_frac)),
+            weights are 0/1; "multinomial" draws as many rows with replacement, weights are the number of draws. Defaults to "subsample".
+    """
+    assert resample in ["subsample", "multinomial"], f"Unknown resampling method: {resample} (subsample, multinomial)"
+    n_sample = int(round(sample_frac*n_rows))
+    indices, data = [], []
+    for _ in range(runs):
+        if resample == "subsample":
+            idx = np.sort(rng.choice(n_rows, n_sample, replace=False))
+            indices.append(idx)
+            data.append(np.ones(len(idx)))
+        else:
+            counts = np.bincount(rng.integers(0, n_rows, n_sample), minlength=n_rows)
+            idx = np.flatnonzero(counts)
+            indices.append(idx)
+            data.append(counts[idx].astype(float))
+    indptr = np.concatenate([[0], np.cumsum([len(idx) for idx in indices])])
+    return sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr), shape=(runs, n_rows))
+
+
+class HeadlineBootstrap():
+    def __init__(
+            self,
+            output_df:pd.DataFrame,
+            output_mat:sparse.csr_matrix,
+            raw_df:pd.DataFrame,
+            aggr_unit:str,
+            vec_col:str,
+            dictionary:TopicDictionary,
+            cand:str = "",
+            select_domains:List = [],
+            force_time_window:List = [],
+            weight_by_popularity:bool = False,
+            popularity_dict:Dict = {},
+            normalize_by_snapshot:bool = True,
+            sum_all:bool = False) -> None:
+        """Everything that does not change across bootstrap runs of aggregate_headline_mat (same arguments):
+        the vector of every raw headline, its domain-day group, the (group, snapshot) pairs and the time unit of every group.
+
+        Runs are sampled from all rows of raw_df, as raw_df.sample in the DataFrame path.
+        Without force_time_window, the time units span the dates of the complete data (so that all runs have the same shape).
+        """
+        self.n_raw = len(raw_df)
+        self.force_time_window = force_time_window
+        self.normalize_by_snapshot = normalize_by_snapshot
+        self.sum_all = sum_all
+
+        if len(select_domains) > 0:
+            process_df, process_mat = select_rows(output_df, output_mat, output_df["domain"].isin(select_domains).values)
+            raw_pos = np.flatnonzero(raw_df["domain"].isin(select_domains).values)
+        else:
+            process_df, process_mat = output_df, output_mat
+            raw_pos = np.arange(len(raw_df))
+        process_mat, self.n_cols = prepare_headline_mat(process_df, process_mat, vec_col, dictionary, cand, weight_by_popularity, popularity_dict)
+
+        full_process_df = match_raw_rows(raw_df.iloc[raw_pos], process_df)
+        grouped = full_process_df.groupby(["domain","date"])
+        codes = grouped.ngroup()
+        keep = codes.notna().values
+        full_process_df = full_process_df[keep]
+        self.codes = codes.values[keep].astype(int)
+        self.n_groups = grouped.ngroups
+        # raw headlines -> their vectors, in the order of raw_df
+        self.raw_rows = raw_pos[full_process_df["raw_row"].values]
+        self.mat = process_mat[full_process_df["row"].values]
+
+        # snapshots are counted with (group, path) pairs
+        pairs = full_process_df.groupby(["domain","date","path"], dropna=False).ngroup().values
+        self.pairs = pairs
+        self.n_pairs = pairs.max()+1 if len(pairs) > 0 else 0
+        self.pair_group = np.zeros(self.n_pairs, dtype=int)
+        self.pair_group[pairs] = self.codes
+
+        # time units of the groups; groups are added up in date order within each unit, as in sum_by_unit
+        group_dates = grouped["path"].size().reset_index()["date"].values
+        self.labels, unit_codes = resample_codes(group_dates, aggr_unit) if not sum_all else (pd.DatetimeIndex([]), np.zeros(self.n_groups, dtype=int))
+        self.group_order = np.argsort(pd.to_datetime(group_dates).values, kind="stable")
+        self.unit_incidence = sparse.csr_matrix(
+            (np.ones(self.n_groups), (unit_codes[self.group_order], np.arange(self.n_groups))),
+            shape=(max(len(self.labels), 1), self.n_groups))
+
+        # what the runs are aggregated from, to check that checkpoints were made by the same aggregation
+        input_hash = hashlib.sha1()
+        for arr in [self.raw_rows, self.codes, self.pairs, self.mat.indptr, self.mat.indices, self.mat.data]:
+            input_hash.update(np.ascontiguousarray(arr).tobytes())
+        self.settings = dict(
+            aggr_unit=aggr_unit, vec_col=vec_col, cand=cand, select_domains=sorted(select_domains),
+            weight_by_popularity=weight_by_popularity, normalize_by_snapshot=normalize_by_snapshot, sum_all=sum_all,
+            n_raw=self.n_raw, n_cols=int(self.n_cols), units=[str(label)[:10] for label in self.labels], input_hash=input_hash.hexdigest())
+
+    def block_shape(self, runs:int) -> Tuple:
+        """The shape of the output of aggregate_runs for a block of runs"""
+        if self.sum_all:
+            return (runs, self.n_cols)
+        if len(self.force_time_window) > 0:
+            return (runs, len(self.force_time_window), self.n_cols)
+        return (runs, len(self.labels), self.n_cols)
+
+    def draw_weights(self, rng:np.random.Generator, runs:int, sample_frac:float = .8, resample:str = "subsample") -> sparse.csr_matrix:
+        return draw_bootstrap_weights(rng, self.n_raw, runs, sample_frac, resample)
+
+    def aggregate_runs(self, weights:sparse.csr_matrix) -> np.ndarray:
+        """Aggregate a block of runs given their (runs x raw rows) weights
+
+        Returns:
+            np.ndarray: (runs x time units x n_cols), or (runs x n_cols) if sum_all
+        """
+        n_runs = weights.shape[0]
+        weights = weights.tocsr()[:, self.raw_rows].tocoo()
+        run, row, w = weights.row.astype(np.int64), weights.col, weights.data
+
+        # (runs*groups x rows): every run sums its weighted headlines by domain by day
+        incidence = sparse.csr_matrix((w, (run*self.n_groups + self.codes[row], row)), shape=(n_runs*self.n_groups, len(self.raw_rows)))
+        group_mat = (incidence @ self.mat).tocsr()
+        group_mat.sort_indices()
+        if self.normalize_by_snapshot:
+            # the (run, group, path) triples present in the block
+            run_pairs = np.flatnonzero(np.bincount(run*self.n_pairs + self.pairs[row], minlength=n_runs*self.n_pairs))
+            n_snapshots = np.bincount(
+                (run_pairs//self.n_pairs)*self.n_groups + self.pair_group[run_pairs % self.n_pairs], minlength=n_runs*self.n_groups)
+            group_mat.data = group_mat.data/np.repeat(n_snapshots, np.diff(group_mat.indptr))
+
+        if self.sum_all:
+            run_incidence = sparse.kron(sparse.identity(n_runs), np.ones((1, self.n_groups)), format="csr")
+            return np.asarray((run_incidence @ group_mat).toarray())
+
+        order = (np.arange(n_runs)[:,None]*self.n_groups + self.group_order[None,:]).ravel()
+        unit_mat = sparse.kron(sparse.identity(n_runs), self.unit_incidence, format="csr") @ group_mat[order]
+        unit_arr = np.asarray(unit_mat.toarray()).reshape(n_runs, -1, self.n_cols)[:, :len(self.labels)]
+        if len(self.force_time_window) > 0:
+            fix_arr = np.zeros((n_runs, len(self.force_time_window), self.n_cols))
+            pos = self.labels.get_indexer(pd.to_datetime(self.force_time_window))
+            fix_arr[:, pos>=0] = unit_arr[:, pos[pos>=0]]
+            return fix_arr
+        return unit_arr
+
+    def run(
+            self,
+            bootstrap_runs:int = 200,
+            sample_frac:float = .8,
+            seed:int = None,
+            resample:str = "subsample",
+            block_size:int = 10,
+            n_workers:int = 1,
+            checkpoint_dir:str = "",
+            summary:"BootstrapSummary" = None) -> Any:
+        """All bootstrap runs, aggregated by blocks of block_size runs.
+        Every block draws from its own random stream (spawned from the seed), so the runs only depend on the seed and the block size,
+        not on the number of workers.
+
+        Args:
+            n_workers (int, optional): the number of processes (0 uses all but two cores, 1 runs in this process). Defaults to 1.
+            checkpoint_dir (str, optional): if given, every finished block is saved in this folder, and the blocks already saved
+                (e.g., by a job that was killed) are loaded instead of run again. Defaults to "".
+            summary (BootstrapSummary, optional): if given, the runs are only added to these running statistics (block by block, in order)
+                instead of being kept in one array. Defaults to None.
+
+        Returns:
+            np.ndarray: (bootstrap_runs x time units x n_cols), or (bootstrap_runs x n_cols) if sum_all; the summary if given
+        """
+        block_runs = [min(block_size, bootstrap_runs-i) for i in range(0, bootstrap_runs, block_size)]
+        seed_seq = np.random.SeedSequence(seed)
+        if len(checkpoint_dir) > 0:
+            seed_seq = open_checkpoint_dir(checkpoint_dir, seed, dict(
+                bootstrap_runs=bootstrap_runs, sample_frac=sample_frac, resample=resample, block_size=block_size,
+                force_time_window=[str(date)[:10] for date in self.force_time_window], **self.settings))
+        block_seqs = seed_seq.spawn(len(block_runs))
+
+        done = set()
+        if len(checkpoint_dir) > 0:
+            done = {block for block in range(len(block_runs)) if os.path.exists(block_fpath(checkpoint_dir, block))}
+            if len(done) > 0:
+                print(f"Resuming from {checkpoint_dir}: {len(done)}/{len(block_runs)} blocks done")
+        tasks = [(block, block_seqs[block], runs) for block,runs in enumerate(block_runs) if block not in done]
+
+        state = {"bootstrap": self, "sample_frac": sample_frac, "resample": resample, "checkpoint_dir": checkpoint_dir}
+        init_worker_state(state)
+        if n_workers <= 0:
+            n_workers = max(mp.cpu_count()-2, 1)
+        use_pool = n_workers > 1 and len(tasks) > 1
+        pool = None
+        try:
+            if use_pool:
+                if mp.get_start_method() == "fork":
+                    pool = mp.Pool(min(n_workers, len(tasks)))
+                else:
+                    pool = mp.Pool(min(n_workers, len(tasks)), initializer=init_worker_state, initargs=(state,))
+                results = pool.imap(run_bootstrap_block, tasks)
+            else:
+                results = map(run_bootstrap_block, tasks)
+
+            # blocks are consumed in order (saved blocks from disk, the others as the workers return them)
+            bstr_arr = []
+            for block in range(len(block_runs)):
+                if block in done:
+                    arr = np.load(block_fpath(checkpoint_dir, block))
+                    assert arr.shape == self.block_shape(block_runs[block]), \
+                        f"{block_fpath(checkpoint_dir, block)} has shape {arr.shape}, expected {self.block_shape(block_runs[block])}"
+                else:
+                    _, arr = next(results)
+                if summary is not None:
+                    summary.update(arr)
+                else:
+                    bstr_arr.append(arr)
+                print("progress:", sum(block_runs[:block+1])/bootstrap_runs)
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            # the workers are stopped if a block or the summary fails
+            if pool is not None:
+                pool.terminate()
+        if summary is not None:
+            return summary
+        return np.concatenate(bstr_arr, axis=0)
+
+
+class BootstrapSummary():
+    def __init__(self, quantiles:List = [.025, .5, .975], normalize_by_unit:bool = False) -> None:
+        """Running statistics of bootstrap runs, per cell (e.g. per date and topic), without keeping the runs:
+        mean and variance with Welford's method (merged block by block), and quantiles with the P-square algorithm
+        (Jain & Chlamtac, 1985), an approximation that only keeps five markers per quantile and cell.
+
+        Args:
+            quantiles (List, optional): the quantiles to track (e.g. the bounds of a 95% confidence interval). Defaults to [.025, .5, .975].
+            normalize_by_unit (bool, optional): normalize every vector of a run (divide by its sum, unless it is 0) before adding it,
+                as load_bstr_arrs does. Defaults to False.
+        """
+        self.quantiles = list(quantiles)
+        self.normalize_by_unit = normalize_by_unit
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.first_runs = []  # the P-square markers start from the first five runs
+        self.markers = None  # (quantiles x 5 x cells) marker heights
+        self.positions = None  # (quantiles x 5 x cells) marker positions
+        p = np.array(self.quantiles)[:,None]
+        self.desired = np.hstack([np.ones_like(p), 1+2*p, 1+4*p, 3+2*p, 5*np.ones_like(p)])  # (quantiles x 5)
+        self.increments = np.hstack([np.zeros_like(p), p/2, p, (1+p)/2, np.ones_like(p)])
+
+    def update(self, arr:np.ndarray) -> None:
+        """Add a block of runs (runs x ...)"""
+        arr = np.asarray(arr, dtype=float)
+        if self.normalize_by_unit:
+            unit_sum = arr.sum(axis=-1, keepdims=True)
+            arr = np.divide(arr, unit_sum, out=arr.copy(), where=unit_sum!=0)
+        # Welford/Chan: merge the mean and sum of squared deviations of the block
+        n_block = len(arr)
+        block_mean = arr.mean(axis=0)
+        block_m2 = ((arr-block_mean)**2).sum(axis=0)
+        if self.n == 0:
+            self.mean, self.m2 = block_mean, block_m2
+        else:
+            delta = block_mean-self.mean
+            n = self.n+n_block
+            self.mean = self.mean + delta*n_block/n
+            self.m2 = self.m2 + block_m2 + delta**2*self.n*n_block/n
+        self.n += n_block
+        self.shape = arr.shape[1:]
+        for run in arr.reshape(n_block, -1):
+            self.update_quantiles(run)
+
+    def update_quantiles(self, x:np.ndarray) -> None:
+        """Add one run (flattened cells) to the P-square markers"""
+        if self.markers is None:
+            self.first_runs.append(x)
+            if len(self.first_runs) == 5:
+                heights = np.sort(np.array(self.first_runs), axis=0)
+                self.markers = np.repeat(heights[None], len(self.quantiles), axis=0)
+                # positions are whole numbers (float32 is exact up to 2**24 runs); desired positions are the same for all cells
+                self.positions = np.repeat(np.arange(1, 6, dtype=np.float32)[None,:,None], len(self.quantiles), axis=0) * np.ones(self.markers.shape, dtype=np.float32)
+                self.first_runs = []
+            return
+        q, pos = self.markers, self.positions
+        # extend the extreme markers, then shift the positions of the markers above x
+        q[:,0] = np.minimum(q[:,0], x)
+        q[:,4] = np.maximum(q[:,4], x)
+        pos[:,1:] += (x[None,None,:] < q[:,1:]) | (np.arange(1, 5)[None,:,None] == 4)
+        self.desired += self.increments
+        # move the three middle markers towards their desired positions (parabolic, or linear if not monotone)
+        for i in [1, 2, 3]:
+            d = self.desired[:,i,None] - pos[:,i]
+            move = ((d >= 1) & (pos[:,i+1]-pos[:,i] > 1)) | ((d <= -1) & (pos[:,i-1]-pos[:,i] < -1))
+            d = np.sign(d)*move
+            parabolic = q[:,i] + d/(pos[:,i+1]-pos[:,i-1]) * (
+                (pos[:,i]-pos[:,i-1]+d)*(q[:,i+1]-q[:,i])/(pos[:,i+1]-pos[:,i]) +
+                (pos[:,i+1]-pos[:,i]-d)*(q[:,i]-q[:,i-1])/(pos[:,i]-pos[:,i-1]))
+            neighbor = np.where(d > 0, i+1, i-1)
+            q_neighbor = np.take_along_axis(q, neighbor[:,None,:], axis=1)[:,0]
+            pos_neighbor = np.take_along_axis(pos, neighbor[:,None,:], axis=1)[:,0]
+            linear = q[:,i] + d*(q_neighbor-q[:,i])/(pos_neighbor-pos[:,i])
+            new_q = np.where((q[:,i-1] < parabolic) & (parabolic < q[:,i+1]), parabolic, linear)
+            q[:,i] = np.where(move, new_q, q[:,i])
+            pos[:,i] += d
+
+    def var(self, ddof:int = 1) -> np.ndarray:
+        return self.m2/(self.n-ddof)
+
+    def std(self, ddof:int = 1) -> np.ndarray:
+        return np.sqrt(self.var(ddof))
+
+    def quantile(self, q:float) -> np.ndarray:
+        """The estimated quantile q (one of self.quantiles) of every cell"""
+        i = self.quantiles.index(q)
+        if self.markers is None:  # fewer than five runs: exact
+            return np.quantile(np.array(self.first_runs), q, axis=0).reshape(self.shape)
+        return self.markers[i,2].reshape(self.shape)
+
+    def save(self, fpath:str) -> None:
+        np.savez(
+            fpath, n=self.n, mean=self.mean, var=self.var(), quantiles=np.array(self.quantiles),
+            quantile_values=np.array([self.quantile(q) for q in self.quantiles]), normalize_by_unit=self.normalize_by_unit)
+
+
+WORKER_STATE = {}
+
+def init_worker_state(state:Dict) -> None:
+    WORKER_STATE.update(state)
+
+def block_fpath(checkpoint_dir:str, block:int) -> str:
+    return f"{checkpoint_dir}/block-{block:05d}.npy"
+
+def open_checkpoint_dir(checkpoint_dir:str, seed:int, settings:Dict) -> np.random.SeedSequence:
+    """Create the checkpoint folder of a bootstrap job, or check that the existing one was made with the same settings.
+    The seed entropy is saved with the settings, so an unseeded job also resumes with the same random streams.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    meta_fpath = f"{checkpoint_dir}/meta.json"
+    if os.path.exists(meta_fpath):
+        with open(meta_fpath, "r") as f:
+            meta = json.load(f)
+        assert meta["settings"] == settings, f"The checkpoints in {checkpoint_dir} were made with other settings: {meta['settings']}"
+        assert seed is None or seed == meta["entropy"], f"The checkpoints in {checkpoint_dir} were made with another seed ({meta['entropy']})"
+        return np.random.SeedSequence(meta["entropy"])
+    seed_seq = np.random.SeedSequence(seed)
+    with open(meta_fpath, "w") as f:
+        json.dump({"entropy": seed_seq.entropy, "settings": settings}, f)
+    return seed_seq
+
+def run_bootstrap_block(task:Tuple[int, np.random.SeedSequence, int]) -> Tuple[int, np.ndarray]:
+    """Draw and aggregate the runs of one block (with the HeadlineBootstrap in WORKER_STATE), saving them if checkpointing"""
+    block, seed_seq, runs = task
+    bootstrap = WORKER_STATE["bootstrap"]
+    weights = bootstrap.draw_weights(np.random.default_rng(seed_seq), runs, WORKER_STATE["sample_frac"], WORKER_STATE["resample"])
+    arr = bootstrap.aggregate_runs(weights)
+    if len(WORKER_STATE["checkpoint_dir"]) > 0:
+        # write then rename, so that a killed job never leaves a partial block behind
+        tmp_fpath = block_fpath(WORKER_STATE["checkpoint_dir"], block) + ".tmp.npy"
+        np.save(tmp_fpath, arr)
+        os.replace(tmp_fpath, block_fpath(WORKER_STATE["checkpoint_dir"], block))
+    return block, arr
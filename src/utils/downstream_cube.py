@@ -0,0 +1,137 @@
+"""Code for aggregating headline vectors once by day, and deriving the series of any time unit from the daily sums
+
+The daily base cube (groups of domains x days x topics/words) is computed once; weekly, n-day, monthly or sliding-window sums
+are then differences of its cumulative sums along the days, instead of re-running the aggregation for every time unit.
+"""
+
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from typing import List, Dict, Tuple
+
+from src.utils.dict_loader import TopicDictionary
+from src.utils.downstream_matrix import prepare_headline_mat, select_rows, match_raw_rows, sum_by_group_domain_date, sum_by_group_unit, unit_arr_to_df
+
+
+class DailyCube():
+    def __init__(self, groups:List, days:pd.DatetimeIndex, arr:np.ndarray, day_range:np.ndarray, vec_col:str) -> None:
+        """Daily sums of headline vectors for groups of domains
+
+        Args:
+            groups (List): the groups (e.g. ["", "_lowc", "_trad"]).
+            days (pd.DatetimeIndex): all the days between the first and the last day of the data.
+            arr (np.ndarray): the (groups x days x topics/words) sums.
+            day_range (np.ndarray): the first and last day (positions in days) with headlines of every group.
+            vec_col (str): "majority_topvec" or "wordvec" (the column of the output dataframes).
+        """
+        self.groups = list(groups)
+        self.days = pd.DatetimeIndex(days)
+        self.arr = arr
+        self.day_range = day_range
+        self.vec_col = vec_col
+        self.prefix = None  # (groups x days+1 x topics/words) cumulative sums, computed on first use
+
+    def cumsum(self) -> np.ndarray:
+        if self.prefix is None:
+            self.prefix = np.zeros((self.arr.shape[0], self.arr.shape[1]+1, self.arr.shape[2]))
+            np.cumsum(self.arr, axis=1, out=self.prefix[:, 1:])
+        return self.prefix
+
+    def group_days(self, group:str) -> Tuple[int, int]:
+        i = self.groups.index(group)
+        return self.day_range[i, 0], self.day_range[i, 1]+1
+
+    def resample(self, group:str, aggr_unit:str) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        """The sums of a group by time unit ("W", "3D", "MS", ...), over the days of the group as resample does
+
+        Returns:
+            Tuple[pd.DatetimeIndex, np.ndarray]: (the labels of the units, the (units x topics/words) sums)
+        """
+        first, last = self.group_days(group)
+        if first >= last:
+            return pd.DatetimeIndex([]), np.zeros((0, self.arr.shape[2]))
+        # the first and last day of every unit (the days are consecutive, so every unit is a range of days)
+        bounds = pd.Series(np.arange(first, last), index=self.days[first:last]).resample(aggr_unit).agg(["min", "max"])
+        prefix = self.cumsum()[self.groups.index(group)]
+        unit_arr = np.zeros((len(bounds), self.arr.shape[2]))
+        full = bounds["min"].notna().values
+        start = bounds["min"].values[full].astype(int)
+        end = bounds["max"].values[full].astype(int)+1
+        unit_arr[full] = prefix[end] - prefix[start]
+        return pd.DatetimeIndex(bounds.index), unit_arr
+
+    def rolling(self, group:str, window:int) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        """The sums of a group over sliding windows of window days, labeled by the last day of the window
+
+        Returns:
+            Tuple[pd.DatetimeIndex, np.ndarray]: (the labels of the windows, the (windows x topics/words) sums)
+        """
+        first, last = self.group_days(group)
+        prefix = self.cumsum()[self.groups.index(group), first:last+1]
+        return self.days[first+window-1:last], prefix[window:] - prefix[:-window]
+
+    def aggregate(self, group:str, aggr_unit:str = "D", window:int = 0, force_time_window:List = []) -> pd.DataFrame:
+        """The series of a group in the output format of aggregate_headline_topvec/aggregate_headline_wordvec,
+        by time unit, or over sliding windows of window days if window > 0
+        """
+        if window > 0:
+            labels, unit_arr = self.rolling(group, window)
+        else:
+            labels, unit_arr = self.resample(group, aggr_unit)
+        return unit_arr_to_df(labels, unit_arr, self.vec_col, self.arr.shape[2], force_time_window)
+
+    def save(self, fpath:str) -> None:
+        """Save the cube as a sparse matrix (most topic/word counts of a domain group on a day are 0)"""
+        mat = sparse.csr_matrix(self.arr.reshape(-1, self.arr.shape[2]))
+        np.savez(
+            fpath, groups=np.array(self.groups, dtype=str), days=self.days.values, day_range=self.day_range, vec_col=self.vec_col,
+            shape=np.array(self.arr.shape), data=mat.data, indices=mat.indices, indptr=mat.indptr)
+
+    @staticmethod
+    def load(fpath:str) -> "DailyCube":
+        with np.load(fpath) as f:
+            shape = tuple(f["shape"])
+            mat = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=(shape[0]*shape[1], shape[2]))
+            return DailyCube(f["groups"].tolist(), pd.DatetimeIndex(f["days"]), mat.toarray().reshape(shape), f["day_range"], str(f["vec_col"]))
+
+
+def build_headline_cube(
+        output_df:pd.DataFrame,
+        output_mat:sparse.csr_matrix,
+        raw_df:pd.DataFrame,
+        vec_col:str,
+        dictionary:TopicDictionary,
+        group_table:pd.DataFrame,
+        cand:str = "",
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {},
+        normalize_by_snapshot:bool = True) -> DailyCube:
+    """The daily base cube of headline topic (vec_col="majority_topvec") or word (vec_col="wordvec") vectors for every group
+    of domains in group_table (see downstream_matrix.domain_group_table), computed as aggregate_headline_groups_mat with aggr_unit="D"
+    """
+    groups = group_table["group"].unique().tolist()
+    domains = group_table["domain"].unique()
+    process_df, process_mat = select_rows(output_df, output_mat, output_df["domain"].isin(domains).values)
+    raw_df_select = raw_df[raw_df["domain"].isin(domains)]
+
+    process_mat, n_cols = prepare_headline_mat(process_df, process_mat, vec_col, dictionary, cand, weight_by_popularity, popularity_dict)
+
+    full_process_df = match_raw_rows(raw_df_select, process_df)
+    full_aggr_df, group_mat = sum_by_group_domain_date(
+        full_process_df, process_df["domain"].values[full_process_df["row"].values], process_mat, group_table, groups,
+        normalize_by_snapshot=normalize_by_snapshot)
+    labels, group_arr, offsets = sum_by_group_unit(full_aggr_df, group_mat, len(groups), "D")
+
+    # the consecutive days of every group, placed on the days of all groups (no days at all if no group has headlines)
+    group_labels = [x for x in labels if len(x) > 0]
+    if len(group_labels) > 0:
+        days = pd.date_range(min(x.min() for x in group_labels), max(x.max() for x in group_labels), freq="D")
+    else:
+        days = pd.DatetimeIndex([])
+    arr = np.zeros((len(groups), len(days), n_cols))
+    day_range = np.zeros((len(groups), 2), dtype=int)
+    for i in range(len(groups)):
+        first = days.get_indexer(labels[i][:1])[0] if len(labels[i]) > 0 else 0
+        arr[i, first:first+len(labels[i])] = group_arr[offsets[i]:offsets[i+1]]
+        day_range[i] = first, first+len(labels[i])-1
+    return DailyCube(groups, days, arr, day_range, vec_col)
@@ -0,0 +1,169 @@
+"""Code for aggregating headline vectors incrementally, for a continuously updated collection
+
+The per-snapshot sums of the vectors (before normalize_by_snapshot) are kept on disk, one file per day. Updating only processes
+the snapshots that are not stored yet and merges them into their day; the daily or weekly series are then re-built from the stored days.
+"""
+
+import pandas as pd
+import numpy as np
+import os, json, glob
+from scipy import sparse
+from typing import List, Dict, Any, Tuple
+
+from src.utils.dict_loader import TopicDictionary
+from src.utils.downstream_matrix import prepare_headline_mat, select_rows, match_raw_rows, sum_by_unit, unit_arr_to_df
+
+
+def sum_by_snapshot(full_process_df:pd.DataFrame, mat:sparse.csr_matrix) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Sum the vectors of all headlines by snapshot (as sum_by_domain_date, one level further down)
+
+    Returns:
+        Tuple[pd.DataFrame, sparse.csr_matrix]: (one row per snapshot with its "domain", "date" and "path", the summed vectors)
+    """
+    grouped = full_process_df.groupby(["domain","date","path"])
+    codes = grouped.ngroup()
+    keep = codes.notna().values
+    codes = codes.values[keep].astype(int)
+    snap_df = grouped.size().reset_index()[["domain","date","path"]]
+    incidence = sparse.csr_matrix(
+        (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+        shape=(len(snap_df), len(codes)))
+    snap_mat = (incidence @ mat[full_process_df["row"].values[keep]]).tocsr()
+    snap_mat.sort_indices()
+    return snap_df, snap_mat
+
+
+class IncrementalAggregator():
+    def __init__(
+            self,
+            fpath:str,
+            vec_col:str,
+            dictionary:TopicDictionary,
+            cand:str = "",
+            select_domains:List = [],
+            weight_by_popularity:bool = False,
+            popularity_dict:Dict = {}) -> None:
+        """The daily partial sums of one headline aggregation (vec_col="majority_topvec" or "wordvec"), stored in the folder fpath.
+        A folder is made for one setting (candidate, domains, popularity weights); reopening it with other settings fails.
+        """
+        self.fpath = fpath
+        self.vec_col = vec_col
+        self.dictionary = dictionary
+        self.cand = cand
+        self.select_domains = select_domains
+        self.weight_by_popularity = weight_by_popularity
+        self.popularity_dict = popularity_dict
+        self.n_cols = dictionary.n_topics if vec_col == "majority_topvec" else dictionary.n_words
+
+        settings = {"layout": "snapshot", "vec_col": vec_col, "cand": cand, "n_cols": self.n_cols, "select_domains": sorted(select_domains),
+                    "weight_by_popularity": weight_by_popularity, "popularity_dict": popularity_dict if weight_by_popularity else {}}
+        os.makedirs(fpath, exist_ok=True)
+        meta_fpath = f"{fpath}/meta.json"
+        if os.path.exists(meta_fpath):
+            with open(meta_fpath, "r") as f:
+                meta = json.load(f)
+            assert meta == settings, f"The daily sums in {fpath} were made with other settings: {meta}"
+        else:
+            with open(meta_fpath, "w") as f:
+                json.dump(settings, f)
+
+    def day_fpath(self, day:pd.Timestamp) -> str:
+        return f"{self.fpath}/day-{day.strftime('%Y-%m-%d')}.npz"
+
+    def days(self) -> List[pd.Timestamp]:
+        """The days already stored"""
+        return sorted(pd.to_datetime(os.path.basename(x)[4:14]) for x in glob.glob(f"{self.fpath}/day-*.npz"))
+
+    def load_snapshots(self, day:pd.Timestamp) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+        """The stored snapshots of a day: (a frame with "domain" and "path", the summed vectors); empty if the day is not stored"""
+        if not os.path.exists(self.day_fpath(day)):
+            return pd.DataFrame({"domain": np.array([], dtype=str), "path": np.array([], dtype=str)}), sparse.csr_matrix((0, self.n_cols))
+        with np.load(self.day_fpath(day)) as f:
+            snap_df = pd.DataFrame({"domain": f["domain"], "path": f["path"]})
+            return snap_df, sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=(len(snap_df), self.n_cols))
+
+    def update(self, output_df:pd.DataFrame, output_mat:sparse.csr_matrix, raw_df:pd.DataFrame, overwrite:bool = False) -> List[pd.Timestamp]:
+        """Add the snapshots of raw_df that are not stored yet, merged into the days already stored (with overwrite, the snapshots
+        of raw_df that are stored are replaced, e.g. after re-parsing them). A snapshot ("path") is taken as a whole: its headlines
+        must all be in the same raw_df. output_df/output_mat are the model output for (at least) the texts of these snapshots.
+
+        Returns:
+            List[pd.Timestamp]: the days written
+        """
+        raw_df = raw_df.assign(date=pd.to_datetime(raw_df["date"]).values, path=raw_df["path"].astype(str).values)
+        if len(self.select_domains) > 0:
+            raw_df = raw_df[raw_df["domain"].isin(self.select_domains).values]
+            output_df, output_mat = select_rows(output_df, output_mat, output_df["domain"].isin(self.select_domains).values)
+        stored_days = set(self.days())
+        stored = {day: self.load_snapshots(day)[0] for day in pd.DatetimeIndex(raw_df["date"].dropna().unique()) if day in stored_days}
+        if not overwrite and len(stored) > 0:
+            stored_keys = pd.MultiIndex.from_frame(pd.concat([snap_df.assign(date=day) for day,snap_df in stored.items()])[["domain","date","path"]])
+            raw_df = raw_df[~pd.MultiIndex.from_frame(raw_df[["domain","date","path"]]).isin(stored_keys)]
+
+        # only the texts of the new headlines are prepared (every row is prepared on its own, so the vectors are the same)
+        full_process_df = match_raw_rows(raw_df, output_df)
+        if len(full_process_df) == 0:
+            return []
+        rows = np.unique(full_process_df["row"].values)
+        process_df, process_mat = select_rows(output_df, output_mat, np.isin(np.arange(len(output_df)), rows))
+        process_mat, _ = prepare_headline_mat(
+            process_df, process_mat, self.vec_col, self.dictionary, self.cand, self.weight_by_popularity, self.popularity_dict)
+        full_process_df["row"] = np.searchsorted(rows, full_process_df["row"].values)
+
+        snap_df, snap_mat = sum_by_snapshot(full_process_df, process_mat)
+        day_codes = snap_df.groupby("date").ngroup().values
+        written = []
+        for i,(day, day_df) in enumerate(snap_df.groupby("date")):
+            day_df = day_df[["domain","path"]]
+            day_mat = snap_mat[np.flatnonzero(day_codes == i)]
+            if day in stored:
+                # merge into the stored day: the new snapshots are added, the snapshots processed again replace the stored ones
+                stored_df, stored_mat = self.load_snapshots(day)
+                keep = ~pd.MultiIndex.from_frame(stored_df).isin(pd.MultiIndex.from_frame(day_df))
+                day_df = pd.concat([stored_df[keep], day_df], ignore_index=True)
+                day_mat = sparse.vstack([stored_mat[np.flatnonzero(keep)], day_mat]).tocsr()
+            # write then rename, so that an interrupted update never leaves a partial day behind
+            tmp_fpath = f"{self.fpath}/tmp-{os.path.basename(self.day_fpath(day))}"
+            np.savez(tmp_fpath, domain=np.asarray(day_df["domain"], dtype=str), path=np.asarray(day_df["path"], dtype=str),
+                     data=day_mat.data, indices=day_mat.indices, indptr=day_mat.indptr)
+            os.replace(tmp_fpath, self.day_fpath(day))
+            written.append(day)
+        return written
+
+    def load_days(self, start:Any = None, end:Any = None) -> Any:
+        """The stored domain-days between start and end (included): (a frame with "domain", "date" and the number of snapshots
+        in "path", the summed vectors)
+        """
+        days = [day for day in self.days() if (start is None or day >= pd.to_datetime(start)) and (end is None or day <= pd.to_datetime(end))]
+        dfs, mats = [], []
+        for day in days:
+            snap_df, snap_mat = self.load_snapshots(day)
+            domains, codes = np.unique(snap_df["domain"].values, return_inverse=True)
+            incidence = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))), shape=(len(domains), len(codes)))
+            dfs.append(pd.DataFrame({"domain": domains, "date": day, "path": np.bincount(codes, minlength=len(domains))}))
+            mats.append((incidence @ snap_mat).tocsr())
+        if len(days) == 0:
+            return pd.DataFrame(columns=["domain","date","path"]), sparse.csr_matrix((0, self.n_cols))
+        return pd.concat(dfs, ignore_index=True), sparse.vstack(mats).tocsr()
+
+    def aggregate(
+            self,
+            aggr_unit:str,
+            force_time_window:List = [],
+            normalize_by_snapshot:bool = True,
+            start:Any = None,
+            end:Any = None,
+            print_info:bool = False) -> pd.DataFrame:
+        """The aggregated series of the stored days (between start and end), as aggregate_headline_topvec/aggregate_headline_wordvec
+        on the same headlines
+        """
+        aggr_df, group_mat = self.load_days(start, end)
+        if normalize_by_snapshot:
+            group_mat.data = group_mat.data/np.repeat(aggr_df["path"].values, np.diff(group_mat.indptr))
+        if print_info:
+            print("\t# of unique domains:", aggr_df["domain"].nunique())
+        labels, unit_arr = sum_by_unit(aggr_df["date"].values, group_mat, aggr_unit)
+        if print_info:
+            print("\tstart:", labels.min())
+            print("\tend:", labels.max())
+        return unit_arr_to_df(labels, unit_arr, self.vec_col, self.n_cols, force_time_window)
@@ -0,0 +1,383 @@
+"""Code for aggregating topic or keyword vectors stored as one (sparse) matrix (rows = texts) instead of one array per DataFrame row"""
+
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from typing import List, Dict, Any, Tuple
+
+from src.utils.dict_loader import TopicDictionary
+from src.utils.downstream_process import assign_popularity_weight
+
+
+def topic_transform_matrix(cand:str, dictionary:TopicDictionary) -> sparse.csr_matrix:
+    """The (n_topics x n_topics) linear map equivalent to merge_topics_from_arr (election_campaign -> government_ops)
+    followed by collapse_general_controversies, so that `mat @ transform` applies both to every row at once.
+    """
+    merge = np.identity(dictionary.n_topics)
+    merge_to_idx = dictionary.topic2index["government_ops"]
+    to_merge_idx = dictionary.topic2index["election_campaign"]
+    merge[to_merge_idx, to_merge_idx] = 0
+    merge[to_merge_idx, merge_to_idx] += 1
+
+    collapse = np.identity(dictionary.n_topics)
+    general_contro_idx = dictionary.topic2index["general_controversies"]
+    new_contro_idx = dictionary.topic2index[f"{cand}_controversies"]
+    collapse[general_contro_idx, general_contro_idx] = 0
+    collapse[general_contro_idx, new_contro_idx] += 1
+    return sparse.csr_matrix(merge @ collapse)
+
+
+def get_majority_mat(mat:sparse.csr_matrix, chunksize:int = 100000) -> sparse.csr_matrix:
+    """Row-wise get_majority: a one-hot row at the (first) argmax of every row"""
+    n_rows = mat.shape[0]
+    # argmax of dense chunks (mat has n_topics columns); scipy's sparse argmax loops over the rows in python
+    majority_idx = np.zeros(n_rows, dtype=int)
+    for i in range(0, n_rows, chunksize):
+        majority_idx[i:i+chunksize] = mat[i:i+chunksize].toarray().argmax(axis=1)
+    return sparse.csr_matrix((np.ones(n_rows), (np.arange(n_rows), majority_idx)), shape=mat.shape)
+
+
+def prepare_topic_mat(
+        process_df:pd.DataFrame,
+        process_mat:sparse.csr_matrix,
+        cand:str,
+        dictionary:TopicDictionary,
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {}) -> sparse.csr_matrix:
+    """Merge and collapse topics, then take the majority vote (or the popularity-weighted topics) for every text"""
+    topic_mat = (process_mat @ topic_transform_matrix(cand, dictionary)).tocsr()
+    topic_mat.sort_indices()
+    majority_mat = get_majority_mat(topic_mat)
+    if weight_by_popularity:
+        if len(popularity_dict) == 0:
+            print("If hoping to use popularity weight, please feed in a popularity dictionary (currently empty)!")
+        else:
+            pop_weight = process_df["domain"].map(lambda x: assign_popularity_weight(x, popularity_dict=popularity_dict)).values
+            majority_mat = (sparse.diags(pop_weight) @ topic_mat).tocsr()
+    return majority_mat
+
+
+def prepare_headline_mat(
+        process_df:pd.DataFrame,
+        process_mat:sparse.csr_matrix,
+        vec_col:str,
+        dictionary:TopicDictionary,
+        cand:str = "",
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {}) -> Tuple[sparse.csr_matrix, int]:
+    """The vectors to add up for every text: majority (or popularity-weighted) topics for vec_col="majority_topvec",
+    (popularity-weighted) word counts for vec_col="wordvec"
+
+    Returns:
+        Tuple[sparse.csr_matrix, int]: (the vectors, their number of columns)
+    """
+    if vec_col == "majority_topvec":
+        return prepare_topic_mat(process_df, process_mat, cand, dictionary, weight_by_popularity, popularity_dict), dictionary.n_topics
+    if weight_by_popularity:
+        if len(popularity_dict) == 0:
+            print("If hoping to use popularity weight, please feed in a popularity dictionary (currently empty)!")
+        else:
+            pop_weight = process_df["domain"].map(lambda x: assign_popularity_weight(x, popularity_dict=popularity_dict)).values
+            process_mat = (sparse.diags(pop_weight) @ process_mat).tocsr()
+    return process_mat, dictionary.n_words
+
+
+def stack_vectors(output_df:pd.DataFrame, vec_col:str, n_cols:int) -> sparse.csr_matrix:
+    """The vectors of a DataFrame output (one array per row in vec_col) as a sparse matrix"""
+    if len(output_df) == 0:
+        return sparse.csr_matrix((0, n_cols))
+    return sparse.csr_matrix(np.concatenate(output_df[vec_col].values).reshape(len(output_df), n_cols))
+
+
+def select_rows(output_df:pd.DataFrame, output_mat:sparse.csr_matrix, mask:np.ndarray) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Select the same rows from the metadata frame and the vector matrix"""
+    return output_df[mask].copy(), output_mat[np.flatnonzero(mask)]
+
+
+def match_raw_rows(raw_df:pd.DataFrame, process_df:pd.DataFrame) -> pd.DataFrame:
+    """Attach to every raw headline the row of its text in the model output (the merge on textbody + dropna of the DataFrame path),
+    keeping the order of raw_df ("raw_row" is the position of the headline in raw_df)
+    """
+    # one hash pass over the model texts and the raw texts together: the same integer code for the same text
+    codes, _ = pd.factorize(pd.concat([process_df["textbody"], raw_df["textbody"]], ignore_index=True), use_na_sentinel=False)
+    text_codes = codes[:len(process_df)]
+    if len(np.unique(text_codes)) < len(process_df):
+        rows_df = pd.DataFrame({"textbody": process_df["textbody"].values, "row": np.arange(len(process_df))})
+        full_process_df = raw_df[["domain","date","path","textbody"]].assign(raw_row=np.arange(len(raw_df)))
+        full_process_df = full_process_df.merge(rows_df, how="left", on="textbody").dropna(subset="row")
+        full_process_df["row"] = full_process_df["row"].astype(int)
+        return full_process_df.reset_index(drop=True)
+    # unique texts (the usual case): the row of every raw text from its code instead of a merge
+    row_of_code = np.full(codes.max() + 1 if len(codes) > 0 else 0, -1)
+    row_of_code[text_codes] = np.arange(len(process_df))
+    rows = row_of_code[codes[len(process_df):]]
+    full_process_df = raw_df.loc[rows >= 0, ["domain","date","path","textbody"]].reset_index(drop=True)
+    full_process_df["raw_row"] = np.flatnonzero(rows >= 0)
+    full_process_df["row"] = rows[rows >= 0]
+    return full_process_df
+
+
+def sum_by_domain_date(full_process_df:pd.DataFrame, mat:sparse.csr_matrix, normalize_by_snapshot:bool = True) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Sum the vectors of all headlines by domain by day (optionally divided by the number of snapshots)
+
+    Returns:
+        Tuple[pd.DataFrame, sparse.csr_matrix]: (one row per domain-day with its number of snapshots in "path", the summed vectors)
+    """
+    grouped = full_process_df.groupby(["domain","date"])
+    codes = grouped.ngroup()
+    keep = codes.notna().values
+    codes = codes.values[keep].astype(int)
+    aggr_df = grouped["path"].nunique(dropna=False).reset_index()
+
+    # one column per raw headline (not per text), so that every group adds up its headlines one by one in the order of
+    # full_process_df, as the DataFrame path does
+    incidence = sparse.csr_matrix(
+        (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+        shape=(len(aggr_df), len(codes)))
+    group_mat = (incidence @ mat[full_process_df["row"].values[keep]]).tocsr()
+    group_mat.sort_indices()
+    if normalize_by_snapshot:
+        group_mat.data = group_mat.data/np.repeat(aggr_df["path"].values, np.diff(group_mat.indptr))
+    return aggr_df, group_mat
+
+
+def resample_codes(dates:List, aggr_unit:str) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """Assign every date to its resampling bin.
+
+    Returns:
+        Tuple[pd.DatetimeIndex, np.ndarray]: (the labels of all bins between the first and the last date, the bin index of every date)
+    """
+    s = pd.Series(np.arange(len(dates)), index=pd.DatetimeIndex(pd.to_datetime(dates)))
+    labels = []
+    codes = np.zeros(len(dates), dtype=int)
+    for i,(label, grp) in enumerate(s.resample(aggr_unit)):
+        labels.append(label)
+        codes[grp.values] = i
+    return pd.DatetimeIndex(labels), codes
+
+
+def sum_by_unit(dates:List, mat:sparse.csr_matrix, aggr_unit:str) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """Sum the rows of a matrix by a given time unit (the resample + sum of the DataFrame path); returns a dense (n_units x n_cols) array"""
+    labels, codes = resample_codes(dates, aggr_unit)
+    # add up rows in date order within each unit, as resample does
+    order = np.argsort(pd.to_datetime(dates).values, kind="stable")
+    incidence = sparse.csr_matrix((np.ones(len(codes)), (codes[order], np.arange(len(codes)))), shape=(len(labels), mat.shape[0]))
+    unit_arr = incidence @ mat[order]
+    if sparse.issparse(unit_arr):
+        unit_arr = unit_arr.toarray()
+    return labels, np.asarray(unit_arr)
+
+
+def unit_arr_to_df(labels:pd.DatetimeIndex, unit_arr:np.ndarray, vec_col:str, n_cols:int, force_time_window:List = []) -> pd.DataFrame:
+    """Convert aggregated vectors to the output format of the aggregation functions (a "date" column and one array per row)"""
+    if len(force_time_window) > 0:
+        fix_arr = np.zeros((len(force_time_window), n_cols))
+        pos = labels.get_indexer(pd.to_datetime(force_time_window))
+        fix_arr[pos>=0] = unit_arr[pos[pos>=0]]
+        aggr_df = pd.DataFrame()
+        aggr_df["date"] = force_time_window
+        aggr_df[vec_col] = list(fix_arr)
+    else:
+        aggr_df = pd.DataFrame()
+        aggr_df["date"] = labels
+        aggr_df[vec_col] = list(unit_arr.reshape(len(labels), n_cols))
+    return aggr_df
+
+
+def aggregate_headline_mat(
+        output_df:pd.DataFrame,
+        output_mat:sparse.csr_matrix,
+        raw_df:pd.DataFrame,
+        aggr_unit:str,
+        vec_col:str,
+        dictionary:TopicDictionary,
+        cand:str = "",
+        select_domains:List = [],
+        force_time_window:List = [],
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {},
+        print_info:bool = False,
+        normalize_by_snapshot:bool = True,
+        sum_all:bool = False) -> Any:
+    """Aggregate headline topic (vec_col="majority_topvec") or word (vec_col="wordvec") vectors stored as a sparse matrix.
+    Same output as aggregate_headline_topvec/aggregate_headline_wordvec (or sum_headline_* if sum_all=True).
+    """
+    if len(select_domains) > 0:
+        process_df, process_mat = select_rows(output_df, output_mat, output_df["domain"].isin(select_domains).values)
+        raw_df_select = raw_df[raw_df["domain"].isin(select_domains)]
+    else:
+        process_df, process_mat = output_df, output_mat
+        raw_df_select = raw_df
+
+    process_mat, n_cols = prepare_headline_mat(process_df, process_mat, vec_col, dictionary, cand, weight_by_popularity, popularity_dict)
+
+    full_process_df = match_raw_rows(raw_df_select, process_df)
+    full_aggr_df, group_mat = sum_by_domain_date(full_process_df, process_mat, normalize_by_snapshot=normalize_by_snapshot)
+    if print_info:
+        print("\t# of unique domains:", full_aggr_df["domain"].nunique())
+    if sum_all:
+        return np.asarray(group_mat.sum(axis=0)).ravel()
+
+    labels, unit_arr = sum_by_unit(full_aggr_df["date"].values, group_mat, aggr_unit)
+    if print_info:
+        print("\tstart:", labels.min())
+        print("\tend:", labels.max())
+    return unit_arr_to_df(labels, unit_arr, vec_col, n_cols, force_time_window)
+
+
+def domain_group_table(domain_groups:Dict[str, List]) -> pd.DataFrame:
+    """The domain -> group membership table (one row per domain and group, a domain can be in several groups)
+    from lists of domains, e.g. {"": domains_to_include, "_lowc": lowcs, "_left": lefts}
+    """
+    return pd.DataFrame(
+        [(domain, group) for group,domains in domain_groups.items() for domain in domains],
+        columns=["domain", "group"]).drop_duplicates(ignore_index=True)
+
+
+def sum_by_group_domain_date(
+        full_process_df:pd.DataFrame,
+        text_domains:np.ndarray,
+        mat:sparse.csr_matrix,
+        group_table:pd.DataFrame,
+        groups:List,
+        normalize_by_snapshot:bool = True) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """sum_by_domain_date for every group of domains at once. A headline counts in a group if both its domain and the domain
+    of its text in the model output (text_domains, one per row of full_process_df) are in the group, as with select_domains.
+
+    Returns:
+        Tuple[pd.DataFrame, sparse.csr_matrix]: (one row per group-domain-day, with the position of the group in groups in "group"
+            and its number of snapshots in "path", the summed vectors)
+    """
+    domain_index = pd.Index(group_table["domain"]).unique()
+    member = np.zeros((len(domain_index)+1, len(groups)), dtype=bool)  # the last row is for domains in no group
+    member[domain_index.get_indexer(group_table["domain"].values), pd.Index(groups).get_indexer(group_table["group"].values)] = True
+    in_group = member[domain_index.get_indexer(full_process_df["domain"].values)] & member[domain_index.get_indexer(text_domains)]
+    # (group, headline) pairs, with the headlines of every group in the order of full_process_df
+    group, pos = np.nonzero(in_group.T)
+
+    pair_df = full_process_df[["domain","date","path"]].iloc[pos].assign(group=group)
+    grouped = pair_df.groupby(["group","domain","date"])
+    codes = grouped.ngroup()
+    keep = codes.notna().values
+    codes = codes.values[keep].astype(int)
+    aggr_df = grouped["path"].nunique(dropna=False).reset_index()
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+        shape=(len(aggr_df), len(codes)))
+    group_mat = (incidence @ mat[full_process_df["row"].values[pos[keep]]]).tocsr()
+    group_mat.sort_indices()
+    if normalize_by_snapshot:
+        group_mat.data = group_mat.data/np.repeat(aggr_df["path"].values, np.diff(group_mat.indptr))
+    return aggr_df, group_mat
+
+
+def sum_by_group_unit(aggr_df:pd.DataFrame, mat:sparse.csr_matrix, n_groups:int, aggr_unit:str) -> Tuple[List[pd.DatetimeIndex], np.ndarray, np.ndarray]:
+    """sum_by_unit for every group at once: the group-domain-day rows are scattered into the units of their group with one
+    sparse product (adding up the rows of every group in the same order as sum_by_unit on the group alone).
+    The units of every group are binned from its own days (as resample on the group alone, e.g. for "3D").
+
+    Returns:
+        Tuple[List[pd.DatetimeIndex], np.ndarray, np.ndarray]: (the labels of the units of every group, the (all units x n_cols) array
+            with the units of every group one after the other, the position of the first unit of every group (and the total))
+    """
+    group = aggr_df["group"].values
+    dates = aggr_df["date"].values
+    labels = []
+    codes = np.zeros(len(aggr_df), dtype=int)
+    offsets = np.zeros(n_groups+1, dtype=int)
+    for i in range(n_groups):
+        rows = np.flatnonzero(group == i)
+        group_labels, group_codes = resample_codes(dates[rows], aggr_unit) if len(rows) > 0 else (pd.DatetimeIndex([]), [])
+        labels.append(group_labels)
+        codes[rows] = offsets[i] + np.asarray(group_codes, dtype=int)
+        offsets[i+1] = offsets[i] + len(group_labels)
+
+    order = np.lexsort((pd.to_datetime(dates).values, group))
+    incidence = sparse.csr_matrix((np.ones(len(order)), (codes[order], np.arange(len(order)))), shape=(offsets[-1], mat.shape[0]))
+    group_arr = incidence @ mat[order]
+    if sparse.issparse(group_arr):
+        group_arr = group_arr.toarray()
+    return labels, np.asarray(group_arr), offsets
+
+
+def aggregate_headline_groups_mat(
+        output_df:pd.DataFrame,
+        output_mat:sparse.csr_matrix,
+        raw_df:pd.DataFrame,
+        aggr_unit:str,
+        vec_col:str,
+        dictionary:TopicDictionary,
+        group_table:pd.DataFrame,
+        cand:str = "",
+        force_time_window:List = [],
+        weight_by_popularity:bool = False,
+        popularity_dict:Dict = {},
+        print_info:bool = False,
+        normalize_by_snapshot:bool = True) -> Dict[str, pd.DataFrame]:
+    """aggregate_headline_mat for several (possibly overlapping) groups of domains in one pass: the headlines of all the domains
+    in group_table (see domain_group_table) are matched with the model output once, and every headline is scattered into
+    the (group x domain-day) sums and then the (group x time unit) array of all its groups.
+    Same output, for every group, as aggregate_headline_mat with select_domains = the domains of the group.
+
+    Returns:
+        Dict[str, pd.DataFrame]: {group: the aggregated dataframe}
+    """
+    groups = group_table["group"].unique().tolist()
+    domains = group_table["domain"].unique()
+    process_df, process_mat = select_rows(output_df, output_mat, output_df["domain"].isin(domains).values)
+    raw_df_select = raw_df[raw_df["domain"].isin(domains)]
+
+    process_mat, n_cols = prepare_headline_mat(process_df, process_mat, vec_col, dictionary, cand, weight_by_popularity, popularity_dict)
+
+    full_process_df = match_raw_rows(raw_df_select, process_df)
+    full_aggr_df, group_mat = sum_by_group_domain_date(
+        full_process_df, process_df["domain"].values[full_process_df["row"].values], process_mat, group_table, groups,
+        normalize_by_snapshot=normalize_by_snapshot)
+    labels, group_arr, offsets = sum_by_group_unit(full_aggr_df, group_mat, len(groups), aggr_unit)
+
+    aggr_dfs = {}
+    for i,group in enumerate(groups):
+        if print_info:
+            print("Aggregated:", group)
+            print("\t# of unique domains:", full_aggr_df[full_aggr_df["group"]==i]["domain"].nunique())
+            if len(labels[i]) > 0:
+                print("\tstart:", labels[i].min())
+                print("\tend:", labels[i].max())
+        aggr_dfs[group] = unit_arr_to_df(labels[i], group_arr[offsets[i]:offsets[i+1]], vec_col, n_cols, force_time_window)
+    return aggr_dfs
+
+
+def aggregate_rows_mat(
+        output_df:pd.DataFrame,
+        output_mat:sparse.csr_matrix,
+        dates:List,
+        aggr_unit:str,
+        vec_col:str,
+        dictionary:TopicDictionary,
+        cand:str = "",
+        force_time_window:List = [],
+        row_weight_col:str = "",
+        sum_all:bool = False) -> Any:
+    """Aggregate survey or tweet vectors stored as a sparse matrix, one text per date (no merge with raw data).
+    Same output as aggregate_survey_*/aggregate_tweet_* (or sum_survey_*/sum_tweet_* if sum_all=True).
+    """
+    if vec_col == "majority_topvec":
+        mat = prepare_topic_mat(output_df, output_mat, cand, dictionary)
+        n_cols = dictionary.n_topics
+    else:
+        mat = output_mat
+        n_cols = dictionary.n_words
+    if len(row_weight_col) > 0:
+        mat = (sparse.diags(output_df[row_weight_col].values) @ mat).tocsr()
+    if sum_all:
+        return np.asarray(mat.sum(axis=0)).ravel()
+
+    labels, unit_arr = sum_by_unit(dates, mat, aggr_unit)
+    return unit_arr_to_df(labels, unit_arr, vec_col, n_cols, force_time_window)
+
+
+def sample_rows(output_df:pd.DataFrame, output_mat:sparse.csr_matrix, sample_frac:float, random_state:Any = None) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """output_df.sample(frac=sample_frac, random_state=random_state), keeping the matrix rows aligned"""
+    bstr_pos = output_df.reset_index(drop=True).sample(frac=sample_frac, random_state=random_state).index.values
+    return output_df.iloc[bstr_pos], output_mat[bstr_pos]
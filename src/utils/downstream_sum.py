@@ -4,8 +4,11 @@ import pandas as pd
 import numpy as np 
 from typing import List, Dict, Any
 from datetime import datetime
+from scipy import sparse
 
 from src.utils.dict_loader import TopicDictionary
+from src.utils.downstream_matrix import aggregate_headline_mat, aggregate_rows_mat, select_rows, sample_rows, stack_vectors
+from src.utils.downstream_bootstrap import HeadlineBootstrap, BootstrapSummary
 from src.utils.downstream_process import merge_topics_from_arr, collapse_general_controversies, get_majority
 from src.utils.downstream_process import assign_popularity_weight
 
@@ -20,7 +23,17 @@ def sum_headline_topvec(
         popularity_dict:Dict = {},
         print_info:bool = False, 
         # normalize_by_day:bool = True,
-        normalize_by_snapshot:bool = True) -> np.array:
+        normalize_by_snapshot:bool = True,
+        output_mat:sparse.csr_matrix = None) -> np.array:
+    if output_mat is not None:
+        sum_arr = aggregate_headline_mat(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit="", vec_col="majority_topvec",
+            dictionary=dictionary, cand=cand, select_domains=select_domains,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict, print_info=print_info,
+            normalize_by_snapshot=normalize_by_snapshot, sum_all=True)
+        assert len(sum_arr) == dictionary.n_topics, "Wrong output shape! Please check if there's a bug."
+        return sum_arr
+
     if len(select_domains) > 0:
         process_df = output_df[output_df["domain"].isin(select_domains)].copy()
         raw_df_select = raw_df[raw_df["domain"].isin(select_domains)].copy()
@@ -62,7 +75,17 @@ def sum_survey_topvec(
         cand:str, 
         dictionary:TopicDictionary,
         select_leaning:str="", 
-        apply_weights:bool = True) -> np.array:
+        apply_weights:bool = True,
+        output_mat:sparse.csr_matrix = None) -> np.array:
+
+    if output_mat is not None:
+        if len(select_leaning) > 0:
+            output_df, output_mat = select_rows(output_df, output_mat, (output_df["partyln"]==select_leaning).values)
+        sum_arr = aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=[], aggr_unit="", vec_col="majority_topvec",
+            dictionary=dictionary, cand=cand, row_weight_col="weights" if apply_weights else "", sum_all=True)
+        assert len(sum_arr) == dictionary.n_topics, "Wrong output shape! Please check if there's a bug."
+        return sum_arr
     
     if len(select_leaning) > 0:
         process_df = output_df[output_df["partyln"]==select_leaning].copy()
@@ -85,7 +108,15 @@ def sum_survey_topvec(
 def sum_tweet_topvec(
         output_df:pd.DataFrame,
         cand:str,
-        dictionary:TopicDictionary) -> np.array:
+        dictionary:TopicDictionary,
+        output_mat:sparse.csr_matrix = None) -> np.array:
+
+    if output_mat is not None:
+        sum_arr = aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=[], aggr_unit="", vec_col="majority_topvec",
+            dictionary=dictionary, cand=cand, sum_all=True)
+        assert len(sum_arr) == dictionary.n_topics, "Wrong output shape! Please check if there's a bug."
+        return sum_arr
     
     process_df = output_df.copy()
     process_df["topvec"] = process_df["topvec"].map(lambda x:merge_topics_from_arr(x, merge_to="government_ops", to_merge="election_campaign", dictionary=dictionary))
@@ -111,46 +142,64 @@ def bootstrap_sum_topvec(
         normalize_by_snapshot:bool = True, 
         apply_survey_weights:bool = True,
         bootstrap_runs:int = 200,
-        sample_frac:float = .8,) -> np.array:
+        sample_frac:float = .8,
+        output_mat:sparse.csr_matrix = None,
+        seed:int = None,
+        resample:str = "subsample",
+        block_size:int = 10,
+        n_workers:int = 1,
+        checkpoint_dir:str = "",
+        summary:BootstrapSummary = None) -> np.array:
     
     bstr_arr = []
+    rng = np.random.default_rng(seed)
     if data_source == "headline":
-        for i in range(bootstrap_runs):
-            if i%20==0: print("progress:", i/bootstrap_runs)    
-            bstr_raw_df = raw_df.sample(frac=sample_frac)
-            bstr_sum_arr = sum_headline_topvec(
-                output_df=output_df, 
-                raw_df=bstr_raw_df, 
-                cand=cand, 
-                dictionary=dictionary,
-                select_domains=select_domains,
-                weight_by_popularity=weight_by_popularity,
-                popularity_dict=popularity_dict,
-                normalize_by_snapshot=normalize_by_snapshot)
-            bstr_arr.append(bstr_sum_arr)
+        # all runs are aggregated from the same precomputed vectors and groups (see HeadlineBootstrap)
+        if output_mat is None:
+            output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+        bstr_arr = HeadlineBootstrap(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit="", vec_col="majority_topvec",
+            dictionary=dictionary, cand=cand, select_domains=select_domains,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict,
+            normalize_by_snapshot=normalize_by_snapshot, sum_all=True,
+        ).run(bootstrap_runs=bootstrap_runs, sample_frac=sample_frac, seed=seed, resample=resample, block_size=block_size,
+            n_workers=n_workers, checkpoint_dir=checkpoint_dir, summary=summary)
     elif data_source == "survey":
         for i in range(bootstrap_runs):
             if i%20==0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_sum_arr = sum_survey_topvec(
                 output_df=bstr_output_df,
                 cand=cand,
                 dictionary=dictionary,
                 select_leaning=select_leaning, 
-                apply_weights=apply_survey_weights)
+                apply_weights=apply_survey_weights,
+                output_mat=bstr_output_mat)
             bstr_arr.append(bstr_sum_arr)
     elif data_source == "tweet":
         for i in range(bootstrap_runs):
             if i%20==0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_sum_arr = sum_tweet_topvec(
                 output_df=bstr_output_df,
                 cand=cand,
-                dictionary=dictionary)
+                dictionary=dictionary,
+                output_mat=bstr_output_mat)
             bstr_arr.append(bstr_sum_arr)
     else:
         print("Please enter a valid data source! (headline, survey, tweet)")
 
+    if summary is not None:
+        # headline runs are already in the summary (block by block)
+        if data_source != "headline":
+            summary.update(np.array(bstr_arr))
+        return summary
     bstr_arr = np.array(bstr_arr)
     assert bstr_arr.shape == (bootstrap_runs, dictionary.n_topics), "Wrong output array shape!"
     print(bstr_arr.shape)
@@ -166,7 +215,17 @@ def sum_headline_wordvec(
         print_info:bool = False, 
         # normalize_by_day:bool = True
         normalize_by_snapshot:bool = True,
+        output_mat:sparse.csr_matrix = None,
         ) -> np.array:
+
+    if output_mat is not None:
+        sum_arr = aggregate_headline_mat(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit="", vec_col="wordvec",
+            dictionary=dictionary, select_domains=select_domains,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict, print_info=print_info,
+            normalize_by_snapshot=normalize_by_snapshot, sum_all=True)
+        assert len(sum_arr) == dictionary.n_words, "Wrong output shape! Please check if there's a bug."
+        return sum_arr
     
     if len(select_domains) > 0:
         process_df = output_df[output_df["domain"].isin(select_domains)].copy()
@@ -206,7 +265,17 @@ def sum_survey_wordvec(
         output_df:pd.DataFrame,
         dictionary:TopicDictionary,
         select_leaning:str = "", 
-        apply_weights:bool = True) -> np.array:
+        apply_weights:bool = True,
+        output_mat:sparse.csr_matrix = None) -> np.array:
+
+    if output_mat is not None:
+        if len(select_leaning) > 0:
+            output_df, output_mat = select_rows(output_df, output_mat, (output_df["partyln"]==select_leaning).values)
+        sum_arr = aggregate_rows_mat(
+            output_df=output_df, output_mat=output_mat, dates=[], aggr_unit="", vec_col="wordvec",
+            dictionary=dictionary, row_weight_col="weights" if apply_weights else "", sum_all=True)
+        assert len(sum_arr) == dictionary.n_words, "Wrong output shape! Please check if there's a bug."
+        return sum_arr
     
     if len(select_leaning) > 0:
         process_df = output_df[output_df["partyln"]==select_leaning].copy()
@@ -223,8 +292,12 @@ def sum_survey_wordvec(
 
 def sum_tweet_wordvec(
         output_df:pd.DataFrame,
-        dictionary:TopicDictionary) -> np.array:
-    sum_arr = np.sum(output_df["wordvec"].tolist(), axis=0)
+        dictionary:TopicDictionary,
+        output_mat:sparse.csr_matrix = None) -> np.array:
+    if output_mat is not None:
+        sum_arr = np.asarray(output_mat.sum(axis=0)).ravel()
+    else:
+        sum_arr = np.sum(output_df["wordvec"].tolist(), axis=0)
     assert len(sum_arr) == dictionary.n_words, "Wrong output shape! Please check if there's a bug."
     return sum_arr
 
@@ -242,39 +315,60 @@ def bootstrap_sum_wordvec(
         normalize_by_snapshot:bool = True,
         apply_survey_weights:bool = True,
         bootstrap_runs:int = 200,
-        sample_frac:float = .8) -> np.array:
+        sample_frac:float = .8,
+        output_mat:sparse.csr_matrix = None,
+        seed:int = None,
+        resample:str = "subsample",
+        block_size:int = 10,
+        n_workers:int = 1,
+        checkpoint_dir:str = "",
+        summary:BootstrapSummary = None) -> np.array:
     bstr_arrs = []
+    rng = np.random.default_rng(seed)
     if data_source == "headline":
-        for i in range(bootstrap_runs):
-            if i%20 == 0: print("progress:", i/bootstrap_runs)
-            bstr_raw_df = raw_df.sample(frac=sample_frac)
-            bstr_sum_arr = sum_headline_wordvec(
-                output_df=output_df, 
-                raw_df=bstr_raw_df,
-                dictionary=dictionary,
-                select_domains=select_domains,
-                weight_by_popularity=weight_by_popularity,
-                popularity_dict=popularity_dict, 
-                normalize_by_snapshot=normalize_by_snapshot)
-            bstr_arrs.append(bstr_sum_arr)
+        # all runs are aggregated from the same precomputed vectors and groups (see HeadlineBootstrap)
+        if output_mat is None:
+            output_mat = stack_vectors(output_df, "wordvec", dictionary.n_words)
+        bstr_arrs = HeadlineBootstrap(
+            output_df=output_df, output_mat=output_mat, raw_df=raw_df, aggr_unit="", vec_col="wordvec",
+            dictionary=dictionary, select_domains=select_domains,
+            weight_by_popularity=weight_by_popularity, popularity_dict=popularity_dict,
+            normalize_by_snapshot=normalize_by_snapshot, sum_all=True,
+        ).run(bootstrap_runs=bootstrap_runs, sample_frac=sample_frac, seed=seed, resample=resample, block_size=block_size,
+            n_workers=n_workers, checkpoint_dir=checkpoint_dir, summary=summary)
+        if summary is None:
+            bstr_arrs = list(bstr_arrs)  # a list of runs, as for the other data sources
     elif data_source == "survey":
         for i in range(bootstrap_runs):
             if i%20 == 0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_sum_arr = sum_survey_wordvec(
                 output_df=bstr_output_df,
                 dictionary=dictionary,
                 select_leaning=select_leaning, 
-                apply_weights=apply_survey_weights)
+                apply_weights=apply_survey_weights,
+                output_mat=bstr_output_mat)
             bstr_arrs.append(bstr_sum_arr)
     elif data_source == "tweet":
         for i in range(bootstrap_runs):
             if i%20 == 0: print("progress:", i/bootstrap_runs)
-            bstr_output_df = output_df.sample(frac=sample_frac)
+            if output_mat is not None:
+                bstr_output_df, bstr_output_mat = sample_rows(output_df, output_mat, sample_frac, rng)
+            else:
+                bstr_output_df, bstr_output_mat = output_df.sample(frac=sample_frac, random_state=rng), None
             bstr_sum_arr = sum_tweet_wordvec(
                 output_df=bstr_output_df,
-                dictionary=dictionary)
+                dictionary=dictionary,
+                output_mat=bstr_output_mat)
             bstr_arrs.append(bstr_sum_arr)
     else:
         print("Please enter a valid data source! (headline, survey, tweet)")   
+    if summary is not None:
+        # headline runs are already in the summary (block by block)
+        if data_source != "headline":
+            summary.update(np.array(bstr_arrs))
+        return summary
     return bstr_arrs
@@ -0,0 +1,103 @@
+"""Code for matching all dictionary keywords in a text with a single pass"""
+
+import re
+from typing import List, Dict, Tuple
+
+# dictionary words made of plain word tokens separated by single spaces
+# (the vast majority after stemming) can be matched token by token
+PLAIN_WORD_PATTERN = re.compile(r"\w+(?: \w+)*")
+TOKEN_PATTERN = re.compile(r"\w+")
+_END = None  # trie key marking the end of a keyword
+
+
+def search_pattern_pos(p:re.Pattern, text:str) -> List[Tuple[int, int]]:
+    """Find the (start, end) spans of all (possibly overlapping) matches of a compiled pattern"""
+    m = p.search(text)
+    pos = []
+    while m:
+        start,end = m.span()
+        pos.append((start, end))
+        m = p.search(text, start+1)
+    return pos
+
+
+class KeywordMatcher():
+    def __init__(self, words:List[str]) -> None:
+        """A token trie over the dictionary words, built once per dictionary.
+
+        Matching a text walks the trie from every token of the text, so all keyword occurrences
+        are found in one pass instead of compiling and running one `\\b{w}\\b` regex per word.
+        The spans are identical to the ones found by the per-word regex: a plain keyword matches
+        a run of whole word tokens separated by exactly one space. The few words with other characters
+        (e.g. "dr. oz", "3.5 million", where "." acts as a regex wildcard) keep a precompiled regex.
+
+        Args:
+            words (List[str]): the dictionary words, in index order (i.e., `TopicDictionary.words`)
+        """
+        self.trie = {}
+        self.patterns = []  # [(word index, compiled regex)] for words that are not plain tokens
+        for idx,w in enumerate(words):
+            if PLAIN_WORD_PATTERN.fullmatch(w):
+                tokens = w.split(" ")
+                node = self.trie
+                for tok in tokens:
+                    node = node.setdefault(tok, {})
+                node[_END] = idx
+            else:
+                self.patterns.append((idx, re.compile(r"\b{}\b".format(w))))
+
+    def find_all(self, text:str) -> Dict[int, List[Tuple[int, int]]]:
+        """Find all keyword occurrences in a text.
+
+        Returns:
+            Dict[int, List[Tuple[int, int]]]: {word index: [(start, end), ...]} for every word that occurs, spans sorted by start
+        """
+        occur_pos = {}
+        spans = [m.span() for m in TOKEN_PATTERN.finditer(text)]
+        n_spans = len(spans)
+        for i in range(n_spans):
+            start = spans[i][0]
+            node = self.trie
+            j = i
+            while j < n_spans:
+                s,e = spans[j]
+                if j > i and (s - spans[j-1][1] != 1 or text[s-1] != " "):
+                    break
+                node = node.get(text[s:e])
+                if node is None:
+                    break
+                idx = node.get(_END)
+                if idx is not None:
+                    occur_pos.setdefault(idx, []).append((start, e))
+                j += 1
+        for idx,p in self.patterns:
+            pos = search_pattern_pos(p, text)
+            if len(pos) > 0:
+                occur_pos[idx] = pos
+        return occur_pos
+
+
+def resolve_overlaps(occur_pos:Dict[int, List[Tuple[int, int]]], overlap_words:List) -> Dict[int, List[Tuple[int, int]]]:
+    """Resolve the overlapping keyword matches of a text all at once ("longest wins").
+
+    A match is dropped if it overlaps a kept match of a longer keyword containing it (overlap_words[idx] lists the
+    words containing word idx, see TopicDictionary.construct_overlap_matrix). Matches are swept from the longest to
+    the shortest, so every match is only compared with the kept (longer) matches of its containing words.
+
+    Returns:
+        Dict[int, List[Tuple[int, int]]]: {word index: [(start, end), ...]} of the kept matches, spans sorted by start
+    """
+    matches = sorted((start-end, start, end, idx) for idx,pos in occur_pos.items() for start,end in pos)
+    kept = {}
+    for _,start,end,idx in matches:
+        overlapped = False
+        for idx2 in overlap_words[idx]:
+            for start2,end2 in kept.get(idx2, []):
+                if start < end2 and start2 < end:
+                    overlapped = True
+                    break
+            if overlapped:
+                break
+        if not overlapped:
+            kept.setdefault(idx, []).append((start, end))
+    return kept
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 from src.utils.downstream_process import trim_period
+from src.utils.bootstrap_store import BootstrapStore
 from typing import List, Dict, Any
 
 # HEADLINE_FOLDER = "headline-filter0.5-nopopw-normsnap-wormn"
@@ -15,14 +16,20 @@ def normalize(arr, smooth=0):
     else:
         return (np.array(arr)+smooth)/np.sum(np.array(arr)+smooth)
 
-def load_topvecs(year, data_source, topvec_fpath, data_type="", normalize_by_unit=True, trim:List=[]):
+def load_topvecs(year, data_source, topvec_fpath, data_type="", normalize_by_unit=True, trim:List=[], data_format="pickle"):
     if year == 2016:
         cand1 = "trump"
         cand2 = "clinton"
     else:
         cand1 = "biden"
         cand2 = "trump"
-    if len(data_type) > 0:
+    if data_format == "parquet":  # saved with columnar_output.write_vector_frame; trim is applied when reading
+        from src.utils.columnar_output import read_vector_frame  # pyarrow is only needed for the Parquet format
+        suffix = f"_{data_type}" if len(data_type) > 0 else ""
+        window = [str(x) for x in trim] if len(trim) > 0 else ["", ""]
+        topvec1 = read_vector_frame(f"{topvec_fpath}{data_source}/{cand1}{year}_topvecs{suffix}.parquet", "majority_topvec", start=window[0], end=window[1])
+        topvec2 = read_vector_frame(f"{topvec_fpath}{data_source}/{cand2}{year}_topvecs{suffix}.parquet", "majority_topvec", start=window[0], end=window[1])
+    elif len(data_type) > 0:
         topvec1 = pd.read_pickle(f"{topvec_fpath}{data_source}/{cand1}{year}_topvecs_{data_type}.pkl")
         topvec2 = pd.read_pickle(f"{topvec_fpath}{data_source}/{cand2}{year}_topvecs_{data_type}.pkl")
     else:
@@ -40,7 +47,7 @@ def load_topvecs(year, data_source, topvec_fpath, data_type="", normalize_by_uni
     return topvec1, topvec2 
 
 
-def load_wordvecs(year, data_source, wordvec_fpath, data_type="", normalize_by_unit=False):
+def load_wordvecs(year, data_source, wordvec_fpath, data_type="", normalize_by_unit=False, data_format="pickle"):
     if year == 2016:
         cand1 = "trump"
         cand2 = "clinton"
@@ -51,7 +58,12 @@ def load_wordvecs(year, data_source, wordvec_fpath, data_type="", normalize_by_u
         cand2 = "trump"
         # start = START2020
         # end = END2020
-    if len(data_type) > 0:
+    if data_format == "parquet":  # saved with columnar_output.write_vector_frame
+        from src.utils.columnar_output import read_vector_frame
+        suffix = f"_{data_type}" if len(data_type) > 0 else ""
+        wordvec1 = read_vector_frame(f"{wordvec_fpath}{data_source}/{cand1}{year}_wordvecs{suffix}.parquet", "wordvec")
+        wordvec2 = read_vector_frame(f"{wordvec_fpath}{data_source}/{cand2}{year}_wordvecs{suffix}.parquet", "wordvec")
+    elif len(data_type) > 0:
         wordvec1 = pd.read_pickle(f"{wordvec_fpath}{data_source}/{cand1}{year}_wordvecs_{data_type}.pkl")
         wordvec2 = pd.read_pickle(f"{wordvec_fpath}{data_source}/{cand2}{year}_wordvecs_{data_type}.pkl")
     else:
@@ -68,7 +80,16 @@ def load_wordvecs(year, data_source, wordvec_fpath, data_type="", normalize_by_u
     return wordvec1, wordvec2 
 
 
-def load_bstr_arrs(year, data_source, topvec_fpath, data_type="", normalize_by_unit=True, vec_type="topvecs"):
+def normalize_arr(arr):
+    """normalize every vector along the last axis at once"""
+    arr_sum = arr.sum(axis=-1, keepdims=True)
+    return np.divide(arr, arr_sum, out=np.array(arr, dtype=float), where=arr_sum!=0)
+
+def load_bstr_arrs(year, data_source, topvec_fpath, data_type="", normalize_by_unit=True, vec_type="topvecs", data_format="npy"):
+    """data_format: "npy" loads the arrays in memory; "mmap" memory-maps the .npy files and "store" opens the chunked stores
+    (saved with bootstrap_store.save_bstr_store, in a folder named as the .npy file without the extension): both return
+    BootstrapStore objects, which only read (and normalize) the slices that are indexed
+    """
     if year == 2016:
         cand1 = "trump"
         cand2 = "clinton"
@@ -76,17 +97,41 @@ def load_bstr_arrs(year, data_source, topvec_fpath, data_type="", normalize_by_u
         cand1 = "biden"
         cand2 = "trump"
     if len(data_type) > 0:
-        vec_arr1 = np.load(f"{topvec_fpath}{data_source}/bootstrap/{cand1}{year}_bstr_{vec_type}_{data_type}.npy")
-        vec_arr2 = np.load(f"{topvec_fpath}{data_source}/bootstrap/{cand2}{year}_bstr_{vec_type}_{data_type}.npy")
+        fpath1 = f"{topvec_fpath}{data_source}/bootstrap/{cand1}{year}_bstr_{vec_type}_{data_type}"
+        fpath2 = f"{topvec_fpath}{data_source}/bootstrap/{cand2}{year}_bstr_{vec_type}_{data_type}"
     else:
-        vec_arr1 = np.load(f"{topvec_fpath}{data_source}/bootstrap/{cand1}{year}_bstr_{vec_type}.npy")
-        vec_arr2 = np.load(f"{topvec_fpath}{data_source}/bootstrap/{cand2}{year}_bstr_{vec_type}.npy")
+        fpath1 = f"{topvec_fpath}{data_source}/bootstrap/{cand1}{year}_bstr_{vec_type}"
+        fpath2 = f"{topvec_fpath}{data_source}/bootstrap/{cand2}{year}_bstr_{vec_type}"
+    if data_format == "mmap":
+        return BootstrapStore(fpath1 + ".npy", normalize_by_unit), BootstrapStore(fpath2 + ".npy", normalize_by_unit)
+    if data_format == "store":
+        return BootstrapStore(fpath1, normalize_by_unit), BootstrapStore(fpath2, normalize_by_unit)
+    vec_arr1 = np.load(fpath1 + ".npy")
+    vec_arr2 = np.load(fpath2 + ".npy")
     if normalize_by_unit:
-        vec_arr1 = np.apply_along_axis(func1d=normalize, axis=2, arr=vec_arr1)
-        vec_arr2 = np.apply_along_axis(func1d=normalize, axis=2, arr=vec_arr2)
+        vec_arr1 = normalize_arr(vec_arr1)
+        vec_arr2 = normalize_arr(vec_arr2)
     return vec_arr1, vec_arr2
 
 
+def load_bstr_summaries(year, data_source, topvec_fpath, data_type="", vec_type="topvecs"):
+    """Load the bootstrap summaries saved with BootstrapSummary.save ({cand}{year}_bstr_{vec_type}[_{data_type}]_summary.npz)
+    instead of the full bootstrap arrays: {"n", "mean", "var", "quantiles", "quantile_values"} (per date and topic/word) for both candidates
+    """
+    if year == 2016:
+        cand1 = "trump"
+        cand2 = "clinton"
+    else:
+        cand1 = "biden"
+        cand2 = "trump"
+    suffix = f"_{data_type}" if len(data_type) > 0 else ""
+    summaries = []
+    for cand in [cand1, cand2]:
+        with np.load(f"{topvec_fpath}{data_source}/bootstrap/{cand}{year}_bstr_{vec_type}{suffix}_summary.npz") as f:
+            summaries.append({key: f[key] for key in f.files})
+    return summaries[0], summaries[1]
+
+
 def load_all_topvecs(year:int, topvec_fpath:str, normalize_by_unit:bool=False, trim:List=[]):
 
     headline_topvec1, headline_topvec2 = load_topvecs(year=year, topvec_fpath=topvec_fpath, data_source=HEADLINE_FOLDER, normalize_by_unit=normalize_by_unit, trim=trim)
@@ -161,23 +206,23 @@ def load_all_wordvecs(year:int, wordvec_fpath:str):
     return wordvec_dfs
 
 
-def load_all_bstr_arrs(year:int, vec_fpath:str, vec_type="topvecs", normalize_by_unit:bool=True):
-    headline_bstr_arr1, headline_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, vec_type=vec_type)
-    lowc_bstr_arr1, lowc_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="lowc", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    trad_bstr_arr1, trad_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="trad", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    left_bstr_arr1, left_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="left", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    right_bstr_arr1, right_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="right", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    center_bstr_arr1, center_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="center", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
+def load_all_bstr_arrs(year:int, vec_fpath:str, vec_type="topvecs", normalize_by_unit:bool=True, data_format:str="npy"):
+    headline_bstr_arr1, headline_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, vec_type=vec_type, data_format=data_format)
+    lowc_bstr_arr1, lowc_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="lowc", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    trad_bstr_arr1, trad_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="trad", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    left_bstr_arr1, left_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="left", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    right_bstr_arr1, right_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="right", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    center_bstr_arr1, center_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=HEADLINE_FOLDER, data_type="center", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
 
-    # survey_bstr_arr1, survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, vec_type=vec_type, normalize_by_unit=normalize_by_unit)
+    # survey_bstr_arr1, survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
 
-    # tweet_cand_bstr_arr1, tweet_cand_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source="tweet-cand", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    # tweet_pub_bstr_arr1, tweet_pub_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source="tweet-pub-sample", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
+    # tweet_cand_bstr_arr1, tweet_cand_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source="tweet-cand", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    # tweet_pub_bstr_arr1, tweet_pub_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source="tweet-pub-sample", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
     # tweet_pub_bstr_arr1 = None 
     # tweet_pub_bstr_arr2 = None
-    # dem_survey_bstr_arr1, dem_survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, data_type="dem", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    # rep_survey_bstr_arr1, rep_survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, data_type="rep", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
-    # nei_survey_bstr_arr1, nei_survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, data_type="neither", vec_type=vec_type, normalize_by_unit=normalize_by_unit)
+    # dem_survey_bstr_arr1, dem_survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, data_type="dem", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    # rep_survey_bstr_arr1, rep_survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, data_type="rep", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
+    # nei_survey_bstr_arr1, nei_survey_bstr_arr2 = load_bstr_arrs(year=year, topvec_fpath=vec_fpath, data_source=SURVEY_FOLDER, data_type="neither", vec_type=vec_type, normalize_by_unit=normalize_by_unit, data_format=data_format)
 
     bstr_arrs = {
         "headline":[
@@ -1,7 +1,8 @@
 from datetime import datetime, timedelta, timezone
-from typing import Any, List, Set, Type, Tuple
+from typing import Any, Callable, List, Set, Type, Tuple
 from nltk.corpus import stopwords
 import re
+import string
 # import pickle
 # import numpy as np
 
@@ -22,18 +23,24 @@ LEMMATIZER = WordNetLemmatizer()
 EN_ST = SnowballStemmer(language="english")
 STOPWORDS = list(set(stopwords.words("english")))
 
+# patterns compiled once, not for every text
+NON_ENGLISH_PATTERN = re.compile(r"[^\x00-\x7f]")
+STOPWORDS_PATTERN = re.compile(r"\b(" + r"|".join(STOPWORDS) + r")\b\s*")
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+AT_PATTERN = re.compile(r"r?t?\s?@\S+")
+URL_PATTERN = re.compile(r"http\S+")
+
 def clean_texts(text: str) -> str:
-    text = re.sub(r"[^\x00-\x7f]","", str(text)) # clean non-english
-    stopwords_pattern = re.compile(r"\b(" + r"|".join(STOPWORDS) + r")\b\s*")
-    text = stopwords_pattern.sub("", str(text))
-    text = text.translate(str.maketrans("","",string.punctuation))
+    text = NON_ENGLISH_PATTERN.sub("", str(text)) # clean non-english
+    text = STOPWORDS_PATTERN.sub("", text)
+    text = text.translate(PUNCTUATION_TABLE)
     return text
 
 def clean_at(text: str) -> str:
-    return re.sub(r"r?t?\s?@\S+", "", text)
+    return AT_PATTERN.sub("", text)
 
 def clean_url(text: str) -> str:
-    return re.sub(r"http\S+", "", text)
+    return URL_PATTERN.sub("", text)
 
 def utc2datetime(timestamp):
 #     dt = datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
@@ -85,8 +92,7 @@ def get_inflections_stem(tokens: list):
         stems = []
     return stems
 
-def remove_emojis(data):
-    emoj = re.compile("["
+EMOJI_PATTERN = re.compile("["
         u"\U0001F600-\U0001F64F"  # emoticons
         u"\U0001F300-\U0001F5FF"  # symbols & pictographs
         u"\U0001F680-\U0001F6FF"  # transport & map symbols
@@ -106,11 +112,27 @@ def remove_emojis(data):
         u"\ufe0f"  # dingbats
         u"\u3030"
                       "]+", re.UNICODE)
-    return re.sub(emoj, "", data)
+
+def remove_emojis(data):
+    return EMOJI_PATTERN.sub("", data)
     
 
 def remove_urls(data):
-    return re.sub(r"http\S+", "", data)
+    return URL_PATTERN.sub("", data)
 
 def remove_linebreaks(data):
-    return re.sub("\n", "", data)
+    return data.replace("\n", "")
+
+
+class TextPipeline():
+    def __init__(self, steps: List[Callable]) -> None:
+        """A text normalization: steps (e.g. clean_url, contractions.expand, get_tokens) applied in order to every text"""
+        self.steps = list(steps)
+
+    def __call__(self, text: Any) -> Any:
+        for step in self.steps:
+            text = step(text)
+        return text
+
+    def map(self, texts: List) -> List:
+        return [self(text) for text in texts]
@@ -122,6 +122,14 @@ _CONTRACTIONS = {
 }
 
 
+# built once (https://regex101.com/r/4y1LrG/2); every contraction has an apostrophe, so texts without one are left as they are
+_CONTRACTIONS_RE = re.compile(r"\b(" + "|".join(_CONTRACTIONS.keys()) + r")\b")
+
+
+def _replace(match):
+    return _CONTRACTIONS[match.group(1)]
+
+
 def expand(text, drop_ownership=False):
     """Expand contractions
 
@@ -132,13 +140,10 @@ def expand(text, drop_ownership=False):
     :return: text with contractions expanded
     """
 
-    def replace(match):
-        return _CONTRACTIONS[match.group(1)]
-
-    # https://regex101.com/r/4y1LrG/2
-    cre = re.compile(r"\b(" + "|".join(_CONTRACTIONS.keys()) + r")\b")
+    if "'" not in text:
+        return text
 
-    text = cre.sub(replace, text)
+    text = _CONTRACTIONS_RE.sub(_replace, text)
 
     if drop_ownership:
         text = text.replace("'s", "")
@@ -1,13 +1,12 @@
-
 import re
 
+# id of a synonym dictionary -> (dictionary, pattern, lookup); the dictionary is kept so that its id is not reused
+_COMPILED = {}
+_MAX_COMPILED = 32
 
-def replace(text, synonym_dict):
-    """ Replace synonyms with their counterparts
-    :param text: input text
-    :param synonym_dict: key of word, value of synonym
-    :return: text with synonyms replaced
-    """
+
+def _compile(synonym_items):
+    """The pattern and lookup of a synonym dictionary (as an iterable of items)"""
 
     # CRITICAL: it's important to sort the dictionary by key length before
     # forming the regular expression. This is to accomodate for scenarios where
@@ -16,17 +15,31 @@ def replace(text, synonym_dict):
     # For example, "barack" is contained within "barack obama". Therefore, if a
     # replacement ocurred in the wrong order for the sentence, "the president,
     # barack obama", the result would be "the president, obama obama".
-    #
-    # TODO: it is very inefficient to be sorting this within ever function
-    # call, it should be moved elsewhere...
     synonym_dict = {
         key: value
         for key, value
-        in sorted(synonym_dict.items(), key=lambda item: len(item[0]), reverse=True)
+        in sorted(synonym_items, key=lambda item: len(item[0]), reverse=True)
     }
+    c_re = re.compile(r"\b(" + "|".join(synonym_dict.keys()) + r")\b")
+    return c_re, synonym_dict
+
+
+def replace(text, synonym_dict):
+    """ Replace synonyms with their counterparts
+    :param text: input text
+    :param synonym_dict: key of word, value of synonym (compiled once per dictionary: do not modify it between calls)
+    :return: text with synonyms replaced
+    """
+
+    compiled = _COMPILED.get(id(synonym_dict))
+    if compiled is None or compiled[0] is not synonym_dict:
+        if len(_COMPILED) >= _MAX_COMPILED:  # dictionaries built on the fly are not kept forever
+            _COMPILED.clear()
+        compiled = (synonym_dict,) + _compile(synonym_dict.items())
+        _COMPILED[id(synonym_dict)] = compiled
+    _, c_re, synonym_dict = compiled
 
     def replace(match):
         return synonym_dict[match.group(0)]
 
-    c_re = re.compile(r"\b(" + "|".join(synonym_dict.keys()) + r")\b")
     return c_re.sub(replace, text)
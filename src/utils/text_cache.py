@@ -0,0 +1,91 @@
+"""Persistent cache of text-level processing results, keyed by the hash of the (normalized) text
+
+The same headline shows up in many snapshots, domains, candidates and years; with the cache, every distinct text
+is cleaned once, and its keyword counts are computed once per dictionary (TopicDictionary.dict_hash).
+"""
+
+import sqlite3
+import hashlib
+import numpy as np
+from typing import List, Dict, Tuple
+
+# max number of keys per "IN (...)" query (SQLite's default limit of host parameters is 999)
+QUERY_SIZE = 900
+
+
+def normalize_text(text:str) -> str:
+    """Texts that only differ by case or whitespace are cleaned the same way"""
+    return " ".join(str(text).lower().split())
+
+
+def text_hash(text:str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TextCache():
+    def __init__(self, fpath:str) -> None:
+        """A SQLite file with two tables:
+            - cleaned: hash of the normalized raw text + cleaning options -> cleaned text (the joined stems/lemmas/tokens)
+            - vectors: hash of the cleaned text + dictionary hash -> sparse word vector and topic vector
+
+        Hits and misses of both tables are counted in self.hits / self.misses.
+        """
+        self.fpath = fpath
+        self.conn = sqlite3.connect(fpath)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cleaned (key TEXT, options TEXT, cleaned TEXT, PRIMARY KEY (key, options))")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key TEXT, dict_hash TEXT, word_idx BLOB, word_val BLOB, top_idx BLOB, top_val BLOB, "
+            "PRIMARY KEY (key, dict_hash))")
+        self.conn.commit()
+        self.hits = {"cleaned": 0, "vectors": 0}
+        self.misses = {"cleaned": 0, "vectors": 0}
+
+    def query(self, sql:str, keys:List[str], params:Tuple) -> List[Tuple]:
+        rows = []
+        for i in range(0, len(keys), QUERY_SIZE):
+            batch = keys[i:i+QUERY_SIZE]
+            rows += self.conn.execute(sql.format(",".join("?"*len(batch))), (*params, *batch)).fetchall()
+        return rows
+
+    def get_cleaned(self, texts:List[str], options:str) -> Dict[str, str]:
+        """{raw text: cleaned text} of the texts already in the cache (texts that normalize the same way share an entry)"""
+        keys = [text_hash(normalize_text(text)) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found = dict(self.query("SELECT key, cleaned FROM cleaned WHERE options = ? AND key IN ({})", unique_keys, (options,)))
+        self.hits["cleaned"] += len(found)
+        self.misses["cleaned"] += len(unique_keys) - len(found)
+        return {text: found[key] for text,key in zip(texts, keys) if key in found}
+
+    def put_cleaned(self, cleaned:Dict[str, str], options:str) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO cleaned VALUES (?, ?, ?)",
+            [(text_hash(normalize_text(text)), options, c) for text,c in cleaned.items()])
+        self.conn.commit()
+
+    def get_vectors(self, texts:List[str], dict_hash:str) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """{cleaned text: (word indices, word counts, topic indices, topic values)} of the texts already in the cache for a given dictionary"""
+        key2text = {text_hash(text): text for text in texts}
+        rows = self.query("SELECT key, word_idx, word_val, top_idx, top_val FROM vectors WHERE dict_hash = ? AND key IN ({})", list(key2text), (dict_hash,))
+        found = {}
+        for key,word_idx,word_val,top_idx,top_val in rows:
+            found[key2text[key]] = (
+                np.frombuffer(word_idx, dtype=np.int32), np.frombuffer(word_val, dtype=float),
+                np.frombuffer(top_idx, dtype=np.int32), np.frombuffer(top_val, dtype=float))
+        self.hits["vectors"] += len(found)
+        self.misses["vectors"] += len(key2text) - len(found)
+        return found
+
+    def put_vectors(self, vectors:Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], dict_hash:str) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?, ?, ?)",
+            [(text_hash(text), dict_hash,
+              np.asarray(word_idx, dtype=np.int32).tobytes(), np.asarray(word_val, dtype=float).tobytes(),
+              np.asarray(top_idx, dtype=np.int32).tobytes(), np.asarray(top_val, dtype=float).tobytes())
+             for text,(word_idx,word_val,top_idx,top_val) in vectors.items()])
+        self.conn.commit()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"hits": dict(self.hits), "misses": dict(self.misses)}
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,56 @@
+"""Shared fixtures: the 2020 dictionary and a small synthetic headline corpus (model output + raw headlines)
+
+Run from the root of the repository: python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src", "collect"))  # the collect scripts import each other as top-level modules
+
+DOMAINS = [f"d{i}.com" for i in range(8)]
+
+
+@pytest.fixture(scope="session")
+def dictionary():
+    from src.utils.dict_loader import TopicDictionary
+    return TopicDictionary(
+        os.path.join(ROOT, "index/dictionary/gtm_round1_2020_merged_full.tsv"),
+        relevance_col="if_reasonable_yijing", min_relevance=2, stemming=True,
+        topic_idx_ext=[os.path.join(ROOT, "index/dictionary/index2topic_2020.json"), os.path.join(ROOT, "index/dictionary/topic2index_2020.json")])
+
+
+def make_corpus(dictionary, n_texts=300, n_raw=3000, seed=0):
+    """(output_df, raw_df): unique texts with a topic and a word vector, and raw headlines of these texts (plus some unmatched ones)
+    over 8 domains, 50 days and a few snapshots per domain
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-07-01", "2020-08-19")
+    output_df = pd.DataFrame({"textbody": [f"text {i}" for i in range(n_texts)]})
+    output_df["domain"] = rng.choice(DOMAINS, n_texts)
+    output_df["date"] = rng.choice(dates, n_texts)
+    output_df["path"] = "p"
+    topvecs = np.zeros((n_texts, dictionary.n_topics))
+    for _ in range(3):
+        np.add.at(topvecs, (np.arange(n_texts), rng.integers(0, dictionary.n_topics, n_texts)), rng.integers(0, 3, n_texts))
+    wordvecs = np.zeros((n_texts, dictionary.n_words))
+    np.add.at(wordvecs, (np.repeat(np.arange(n_texts), 4), rng.integers(0, dictionary.n_words, 4*n_texts)), 1)
+    output_df["topvec"] = list(topvecs)
+    output_df["wordvec"] = list(wordvecs)
+
+    raw_df = pd.DataFrame({"textbody": rng.choice(output_df["textbody"].tolist() + ["unmatched"], n_raw)})
+    raw_df["domain"] = rng.choice(DOMAINS, n_raw)
+    raw_df["date"] = rng.choice(dates, n_raw)
+    raw_df["path"] = [f"{domain}/{i}" for domain,i in zip(raw_df["domain"], rng.integers(0, 4, n_raw))]
+    return output_df, raw_df
+
+
+@pytest.fixture
+def corpus(dictionary):
+    return make_corpus(dictionary)
@@ -0,0 +1,79 @@
+"""Tests of the incremental snapshot census of describe.py"""
+
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import describe
+from describe import describe_snapshots
+
+DOMAINS = ["d0.com", "d1.com", "d2.com", "news.com/politics"]
+
+
+def add_snapshots(folder, domain, timestamps):
+    domain_path = os.path.join(folder, "www." + domain.replace("/", "[slash]"))
+    os.makedirs(domain_path, exist_ok=True)
+    for ts in timestamps:
+        open(os.path.join(domain_path, ts + ".snapshot"), "w").close()
+    # the folder mtime comes from a coarse clock: move it forward so that the change is seen even within the same tick
+    mtime = os.stat(domain_path).st_mtime_ns
+    os.utime(domain_path, ns=(mtime + 10**9, mtime + 10**9))
+    return os.path.abspath(domain_path)
+
+
+def census_dict(df):
+    return {(row.domain, row.date): row.n_snapshots for row in df.itertuples()}
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """The folders counted (recorded in the census) by every run"""
+    paths = []
+    record = describe.SnapshotCensus.record
+    def spy(self, domain, domain_path, mtime, counts):
+        paths.append(domain_path)
+        return record(self, domain, domain_path, mtime, counts)
+    monkeypatch.setattr(describe.SnapshotCensus, "record", spy)
+    return paths
+
+
+def test_census_rescans_only_changed_folders(tmp_path, recorded):
+    input_a, input_b = str(tmp_path / "a"), str(tmp_path / "b")
+    output_fpath = str(tmp_path / "census.csv")
+    add_snapshots(input_a, "d0.com", ["20200701120000", "20200701180000", "20200702000000"])
+    d1_path = add_snapshots(input_a, "d1.com", ["20200701120000", "notadate"])
+    d2_path = add_snapshots(input_a, "d2.com", ["20200703120000"])
+    add_snapshots(input_a, "news.com/politics", ["20200704120000"])
+    open(os.path.join(d2_path, ".hidden.snapshot"), "w").close()
+    os.utime(d2_path, ns=(os.stat(d2_path).st_mtime_ns + 10**9,)*2)
+
+    df = describe_snapshots(input_a, output_fpath, DOMAINS, n_workers=2)
+    assert len(recorded) == 4
+    expected = {("d0.com", "2020-07-01"): 2, ("d0.com", "2020-07-02"): 1, ("d1.com", "2020-07-01"): 1, ("d2.com", "2020-07-03"): 1,
+                ("news.com/politics", "2020-07-04"): 1}
+    assert census_dict(df) == expected
+    assert census_dict(pd.read_csv(output_fpath)) == expected
+
+    # a rerun without changes scans nothing; a snapshot added to a folder rescans that folder only
+    recorded.clear()
+    assert census_dict(describe_snapshots(input_a, output_fpath, DOMAINS, n_workers=2)) == expected
+    assert recorded == []
+    add_snapshots(input_a, "d1.com", ["20200702120000"])
+    assert census_dict(describe_snapshots(input_a, output_fpath, DOMAINS, n_workers=2)) == {**expected, ("d1.com", "2020-07-02"): 1}
+    assert recorded == [d1_path]
+
+    # a deleted folder is removed from the census
+    recorded.clear()
+    shutil.rmtree(d2_path)
+    expected = {key: n for key,n in {**expected, ("d1.com", "2020-07-02"): 1}.items() if key[0] != "d2.com"}
+    assert census_dict(describe_snapshots(input_a, output_fpath, DOMAINS, n_workers=2)) == expected
+    assert recorded == []
+
+    # the folders of another input folder are added to the counts of the same days
+    add_snapshots(input_b, "d1.com", ["20200702060000", "20200705000000"])
+    add_snapshots(input_b, "d2.com", ["20200703000000"])
+    df = describe_snapshots(input_b, output_fpath, DOMAINS, n_workers=2)
+    assert census_dict(df) == {**expected, ("d1.com", "2020-07-02"): 2, ("d1.com", "2020-07-05"): 1, ("d2.com", "2020-07-03"): 1}
+    assert len(recorded) == 2
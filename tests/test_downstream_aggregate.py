@@ -0,0 +1,74 @@
+"""Tests of the vectorized aggregate_headline_topvec against the previous DataFrame implementation"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.downstream_aggregate import aggregate_headline_topvec
+from src.utils.downstream_process import merge_topics_from_arr, collapse_general_controversies, get_majority, assign_popularity_weight
+
+POPULARITY = {f"d{i}.com": 0.37*(i + 1) for i in range(8)}
+
+
+# ---- previous implementation (per-row maps, merge on textbody, groupby with lambdas) ---- #
+
+def aggregate_headline_topvec_before(output_df, raw_df, aggr_unit, cand, dictionary, select_domains=[], force_time_window=[],
+                                     weight_by_popularity=False, popularity_dict={}, normalize_by_snapshot=True):
+    if len(select_domains) > 0:
+        process_df = output_df[output_df["domain"].isin(select_domains)].copy()
+        raw_df_select = raw_df[raw_df["domain"].isin(select_domains)].copy()
+    else:
+        process_df = output_df.copy()
+        raw_df_select = raw_df.copy()
+    process_df["topvec"] = process_df["topvec"].map(lambda x:merge_topics_from_arr(x, merge_to="government_ops", to_merge="election_campaign", dictionary=dictionary))
+    process_df["topvec"] = process_df["topvec"].map(lambda x: collapse_general_controversies(x, cand, dictionary))
+    process_df["majority_topvec"] = process_df["topvec"].map(lambda x: get_majority(x))
+    if weight_by_popularity:
+        process_df["pop_weight"] = process_df["domain"].map(lambda x: assign_popularity_weight(x, popularity_dict=popularity_dict))
+        process_df["majority_topvec"] = process_df.apply(lambda x: x["topvec"]*x["pop_weight"], axis=1)
+
+    aggr_func = {"majority_topvec": lambda x: np.sum(np.array(list(x)), axis=0), "path": lambda x: len(set(x))}
+    full_process_df = raw_df_select.merge(process_df[["textbody","majority_topvec"]], how="left", on="textbody").dropna(subset="majority_topvec")
+    full_aggr_df = full_process_df.groupby(["domain","date"]).agg(aggr_func).reset_index()
+    if normalize_by_snapshot:
+        full_aggr_df["majority_topvec"] = full_aggr_df["majority_topvec"]/full_aggr_df["path"]
+    full_aggr_df["date"] = pd.to_datetime(full_aggr_df["date"])
+
+    aggr_func_by_unit = {"majority_topvec": lambda x: np.sum(list(x), axis=0)}
+    full_aggr_df_by_unit = full_aggr_df.set_index("date").resample(aggr_unit).agg(aggr_func_by_unit).reset_index()
+    full_aggr_df_by_unit["majority_topvec"] = full_aggr_df_by_unit["majority_topvec"].map(lambda x: x if np.sum(x) > 0 else np.zeros(dictionary.n_topics))
+    if len(force_time_window) > 0:
+        full_aggr_df_by_unit_fix = pd.DataFrame()
+        full_aggr_df_by_unit_fix["date"] = force_time_window
+        full_aggr_df_by_unit_fix = full_aggr_df_by_unit_fix.merge(full_aggr_df_by_unit, how="left", on="date").fillna(0)
+        full_aggr_df_by_unit_fix["majority_topvec"] = full_aggr_df_by_unit_fix["majority_topvec"].map(lambda x: x if np.sum(x) > 0 else np.zeros(dictionary.n_topics))
+        return full_aggr_df_by_unit_fix
+    return full_aggr_df_by_unit
+
+
+# ---- tests ---- #
+
+@pytest.mark.parametrize("aggr_unit", ["D", "W"])
+@pytest.mark.parametrize("kwargs", [
+    dict(),
+    dict(select_domains=["d1.com", "d2.com", "d5.com"]),
+    dict(weight_by_popularity=True, popularity_dict=POPULARITY),
+    dict(normalize_by_snapshot=False),
+    dict(force_time_window="window"),
+])
+def test_aggregate_headline_topvec_matches_dataframe_path(corpus, dictionary, aggr_unit, kwargs):
+    output_df, raw_df = corpus
+    if kwargs.get("force_time_window") == "window":
+        kwargs = dict(force_time_window=list(pd.date_range("2020-06-28", "2020-09-06", freq=aggr_unit)))
+    expected_df = aggregate_headline_topvec_before(output_df, raw_df, aggr_unit, "trump", dictionary, **kwargs)
+    aggr_df = aggregate_headline_topvec(output_df, raw_df, aggr_unit, "trump", dictionary, **kwargs)
+    assert pd.to_datetime(aggr_df["date"]).tolist() == pd.to_datetime(expected_df["date"]).tolist()
+    np.testing.assert_array_equal(np.vstack(aggr_df["majority_topvec"].values), np.vstack(expected_df["majority_topvec"].values))
+
+
+def test_duplicated_model_texts_are_merged_as_before(corpus, dictionary):
+    output_df, raw_df = corpus
+    output_df = pd.concat([output_df, output_df.iloc[:20]], ignore_index=True)  # every raw headline of these texts counts twice
+    expected_df = aggregate_headline_topvec_before(output_df, raw_df, "W", "biden", dictionary)
+    aggr_df = aggregate_headline_topvec(output_df, raw_df, "W", "biden", dictionary)
+    np.testing.assert_array_equal(np.vstack(aggr_df["majority_topvec"].values), np.vstack(expected_df["majority_topvec"].values))
@@ -0,0 +1,109 @@
+"""Tests of the headline bootstrap engine: checkpoints and running summaries"""
+
+import os
+
+import numpy as np
+import pytest
+
+from src.utils.downstream_bootstrap import HeadlineBootstrap, BootstrapSummary, block_fpath
+from src.utils.downstream_matrix import stack_vectors
+
+
+def make_bootstrap(corpus, dictionary, **kwargs):
+    output_df, raw_df = corpus
+    args = dict(aggr_unit="W", vec_col="majority_topvec", cand="trump")
+    args.update(kwargs)
+    return HeadlineBootstrap(
+        output_df=output_df, output_mat=stack_vectors(output_df, "topvec", dictionary.n_topics), raw_df=raw_df,
+        dictionary=dictionary, **args)
+
+
+def test_checkpoints_resume_the_same_runs(corpus, dictionary, tmp_path):
+    bootstrap = make_bootstrap(corpus, dictionary)
+    expected = bootstrap.run(bootstrap_runs=12, seed=0, block_size=5)
+    checkpoint_dir = str(tmp_path / "ckpt")
+    bootstrap.run(bootstrap_runs=12, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+    os.remove(block_fpath(checkpoint_dir, 1))  # as if the job was killed during the second block
+    np.testing.assert_array_equal(bootstrap.run(bootstrap_runs=12, seed=0, block_size=5, checkpoint_dir=checkpoint_dir), expected)
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(aggr_unit="D"),
+    dict(select_domains=["d0.com", "d1.com"]),
+    dict(normalize_by_snapshot=False),
+    dict(cand="biden"),
+])
+def test_checkpoints_of_another_aggregation_are_refused(corpus, dictionary, tmp_path, kwargs):
+    checkpoint_dir = str(tmp_path / "ckpt")
+    make_bootstrap(corpus, dictionary).run(bootstrap_runs=6, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+    with pytest.raises(AssertionError, match="other settings"):
+        make_bootstrap(corpus, dictionary, **kwargs).run(bootstrap_runs=6, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+
+
+def test_checkpoints_of_other_data_are_refused(corpus, dictionary, tmp_path):
+    output_df, raw_df = corpus
+    checkpoint_dir = str(tmp_path / "ckpt")
+    make_bootstrap(corpus, dictionary).run(bootstrap_runs=6, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+    with pytest.raises(AssertionError, match="other settings"):
+        make_bootstrap((output_df, raw_df.iloc[1:]), dictionary).run(bootstrap_runs=6, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+
+
+def test_checkpoint_block_shape_is_checked(corpus, dictionary, tmp_path):
+    bootstrap = make_bootstrap(corpus, dictionary)
+    checkpoint_dir = str(tmp_path / "ckpt")
+    bootstrap.run(bootstrap_runs=6, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+    np.save(block_fpath(checkpoint_dir, 0), np.zeros((5, 3, 3)))
+    with pytest.raises(AssertionError, match="has shape"):
+        bootstrap.run(bootstrap_runs=6, seed=0, block_size=5, checkpoint_dir=checkpoint_dir)
+
+
+# ---- BootstrapSummary ---- #
+
+@pytest.fixture
+def stored_runs(corpus, dictionary):
+    return make_bootstrap(corpus, dictionary).run(bootstrap_runs=400, seed=0, block_size=50)
+
+
+def normalized(runs):
+    unit_sum = runs.sum(axis=-1, keepdims=True)
+    return np.divide(runs, unit_sum, out=runs.copy(), where=unit_sum!=0)
+
+
+@pytest.mark.parametrize("normalize_by_unit", [False, True])
+def test_summary_matches_numpy_on_stored_runs(stored_runs, normalize_by_unit):
+    summary = BootstrapSummary(normalize_by_unit=normalize_by_unit)
+    for block in np.split(stored_runs, [7, 8, 60, 200]):  # blocks of unequal sizes, one of a single run
+        summary.update(block)
+    runs = normalized(stored_runs) if normalize_by_unit else stored_runs
+    assert summary.n == len(runs)
+    np.testing.assert_allclose(summary.mean, np.mean(runs, axis=0), rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(summary.var(), np.var(runs, axis=0, ddof=1), rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(summary.var(ddof=0), np.var(runs, axis=0), rtol=1e-10, atol=1e-12)
+    # P-square quantiles are approximate: every estimate is within the empirical quantiles q-0.1 and q+0.1
+    # (up to 1% of the range of the cell, for the steps of discrete values)
+    tol = 0.01*(runs.max(axis=0) - runs.min(axis=0)) + 1e-12
+    for q in summary.quantiles:
+        estimate = summary.quantile(q)
+        assert estimate.shape == runs.shape[1:]
+        assert np.all(estimate >= np.quantile(runs, max(q-0.1, 0), axis=0) - tol)
+        assert np.all(estimate <= np.quantile(runs, min(q+0.1, 1), axis=0) + tol)
+
+
+@pytest.mark.parametrize("normalize_by_unit", [False, True])
+def test_summary_quantiles_of_few_runs_are_exact(stored_runs, normalize_by_unit):
+    summary = BootstrapSummary(normalize_by_unit=normalize_by_unit)
+    summary.update(stored_runs[:2])
+    summary.update(stored_runs[2:4])
+    runs = normalized(stored_runs[:4]) if normalize_by_unit else stored_runs[:4]
+    for q in summary.quantiles:
+        np.testing.assert_array_equal(summary.quantile(q), np.quantile(runs, q, axis=0))
+
+
+def test_summary_of_a_run_matches_its_runs(corpus, dictionary, stored_runs):
+    expected = BootstrapSummary()
+    expected.update(stored_runs)
+    summary = make_bootstrap(corpus, dictionary).run(bootstrap_runs=400, seed=0, block_size=50, summary=BootstrapSummary())
+    np.testing.assert_allclose(summary.mean, expected.mean, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(summary.var(), expected.var(), rtol=1e-10, atol=1e-12)
+    for q in summary.quantiles:
+        np.testing.assert_array_equal(summary.quantile(q), expected.quantile(q))
@@ -0,0 +1,42 @@
+"""Tests of the daily base cube against the aggregation of every time unit (aggregate_headline_groups_mat)"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.downstream_cube import DailyCube, build_headline_cube
+from src.utils.downstream_matrix import aggregate_headline_groups_mat, domain_group_table, stack_vectors
+
+DOMAIN_GROUPS = {"": [f"d{i}.com" for i in range(8)], "_low": ["d0.com", "d1.com", "d2.com"], "_high": ["d2.com", "d6.com"],
+                 "_missing": ["nowhere.com"]}
+
+
+def assert_same_series(aggr_df, expected_df, vec_col):
+    assert pd.to_datetime(aggr_df["date"]).tolist() == pd.to_datetime(expected_df["date"]).tolist()
+    if len(expected_df) > 0:
+        np.testing.assert_allclose(np.vstack(aggr_df[vec_col].values), np.vstack(expected_df[vec_col].values), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("vec_col,vec_type", [("majority_topvec", "topvec"), ("wordvec", "wordvec")])
+def test_cube_series_match_the_aggregation_by_unit(corpus, dictionary, tmp_path, vec_col, vec_type):
+    output_df, raw_df = corpus
+    output_mat = stack_vectors(output_df, vec_type, dictionary.n_topics if vec_type == "topvec" else dictionary.n_words)
+    group_table = domain_group_table(DOMAIN_GROUPS)
+    cube = build_headline_cube(output_df, output_mat, raw_df, vec_col, dictionary, group_table, cand="trump")
+    cube.save(str(tmp_path / "cube.npz"))
+    cube = DailyCube.load(str(tmp_path / "cube.npz"))
+    for aggr_unit in ["D", "W", "3D", "MS"]:
+        expected = aggregate_headline_groups_mat(output_df, output_mat, raw_df, aggr_unit, vec_col, dictionary, group_table, cand="trump")
+        for group in DOMAIN_GROUPS:
+            assert_same_series(cube.aggregate(group, aggr_unit), expected[group], vec_col)
+
+
+def test_cube_without_headlines_is_empty(corpus, dictionary):
+    output_df, raw_df = corpus
+    output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    group_table = domain_group_table({"_missing": ["nowhere.com"], "_other": ["elsewhere.com"]})
+    cube = build_headline_cube(output_df, output_mat, raw_df, "majority_topvec", dictionary, group_table, cand="trump")
+    assert cube.arr.shape == (2, 0, dictionary.n_topics)
+    for group in ["_missing", "_other"]:
+        assert len(cube.aggregate(group, "W")) == 0
+        assert len(cube.aggregate(group, window=7)) == 0
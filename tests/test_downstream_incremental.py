@@ -0,0 +1,45 @@
+"""Tests of the incremental daily aggregator against aggregate_headline_topvec on the full data"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.downstream_aggregate import aggregate_headline_topvec
+from src.utils.downstream_incremental import IncrementalAggregator
+from src.utils.downstream_matrix import stack_vectors
+
+
+def assert_same_series(aggr_df, expected_df):
+    assert aggr_df["date"].tolist() == expected_df["date"].tolist()
+    np.testing.assert_allclose(np.vstack(aggr_df["majority_topvec"].values), np.vstack(expected_df["majority_topvec"].values))
+
+
+@pytest.mark.parametrize("aggr_unit", ["D", "W"])
+def test_updates_by_snapshot_match_the_full_aggregation(corpus, dictionary, tmp_path, aggr_unit):
+    output_df, raw_df = corpus
+    output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    aggregator = IncrementalAggregator(str(tmp_path / "daily"), "majority_topvec", dictionary, cand="trump")
+    # the snapshots of every day arrive over several updates (late snapshots are merged into the stored days)
+    for k in ["0", "1", "2|3"]:
+        aggregator.update(output_df, output_mat, raw_df[raw_df["path"].str.contains(f"/(?:{k})$")])
+    expected_df = aggregate_headline_topvec(output_df, raw_df, aggr_unit, "trump", dictionary)
+    assert_same_series(aggregator.aggregate(aggr_unit), expected_df)
+
+    # headlines of stored snapshots are not added twice, and re-processing them with overwrite replaces them
+    assert aggregator.update(output_df, output_mat, raw_df) == []
+    aggregator.update(output_df, output_mat, raw_df[raw_df["path"].str.endswith("/1")], overwrite=True)
+    assert_same_series(aggregator.aggregate(aggr_unit), expected_df)
+
+
+def test_updates_by_day_with_selected_domains(corpus, dictionary, tmp_path):
+    output_df, raw_df = corpus
+    output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    select_domains = ["d0.com", "d3.com", "d5.com"]
+    aggregator = IncrementalAggregator(str(tmp_path / "daily"), "majority_topvec", dictionary, cand="biden", select_domains=select_domains)
+    dates = pd.to_datetime(raw_df["date"])
+    aggregator.update(output_df, output_mat, raw_df[dates < "2020-07-20"])
+    aggregator.update(output_df, output_mat, raw_df[dates >= "2020-07-15"])
+    expected_df = aggregate_headline_topvec(output_df, raw_df, "W", "biden", dictionary, select_domains=select_domains)
+    assert_same_series(aggregator.aggregate("W"), expected_df)
+    assert_same_series(aggregator.aggregate("W", normalize_by_snapshot=False),
+                       aggregate_headline_topvec(output_df, raw_df, "W", "biden", dictionary, select_domains=select_domains, normalize_by_snapshot=False))
@@ -0,0 +1,87 @@
+"""Tests of the one-pass aggregation of groups of domains against the aggregation of every group on its own"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.downstream_aggregate import aggregate_survey_topvec
+from src.utils.downstream_matrix import (
+    aggregate_headline_groups_mat, aggregate_headline_mat, domain_group_table, match_raw_rows,
+    prepare_headline_mat, select_rows, stack_vectors, sum_by_domain_date, sum_by_group_domain_date, sum_by_group_unit, sum_by_unit)
+
+DOMAIN_GROUPS = {"": [f"d{i}.com" for i in range(8)], "_low": ["d0.com", "d1.com", "d2.com"], "_high": ["d2.com", "d6.com"],
+                 "_one": ["d7.com"], "_missing": ["nowhere.com"]}
+UNITS = ["D", "W", "3D", "MS"]
+
+
+def prepared_output(output_df, output_mat, raw_df, domains, dictionary, **kwargs):
+    """The selection, preparation and matching of aggregate_headline_mat with select_domains=domains"""
+    process_df, process_mat = select_rows(output_df, output_mat, output_df["domain"].isin(domains).values)
+    process_mat, _ = prepare_headline_mat(process_df, process_mat, "majority_topvec", dictionary, "trump", **kwargs)
+    full_process_df = match_raw_rows(raw_df[raw_df["domain"].isin(domains)], process_df)
+    return process_df, process_mat, full_process_df
+
+
+@pytest.fixture
+def group_sums(corpus, dictionary):
+    """(the single-group corpus, the group table, the group-domain-day sums of all groups)"""
+    output_df, raw_df = corpus
+    output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    group_table = domain_group_table(DOMAIN_GROUPS)
+    groups = group_table["group"].unique().tolist()
+    process_df, process_mat, full_process_df = prepared_output(output_df, output_mat, raw_df, group_table["domain"].unique(), dictionary)
+    aggr_df, group_mat = sum_by_group_domain_date(
+        full_process_df, process_df["domain"].values[full_process_df["row"].values], process_mat, group_table, groups)
+    return (output_df, output_mat, raw_df), groups, aggr_df, group_mat
+
+
+def test_sum_by_group_domain_date_matches_single_group(group_sums, dictionary):
+    (output_df, output_mat, raw_df), groups, aggr_df, group_mat = group_sums
+    for i,group in enumerate(groups):
+        _, process_mat, full_process_df = prepared_output(output_df, output_mat, raw_df, DOMAIN_GROUPS[group], dictionary)
+        expected_df, expected_mat = sum_by_domain_date(full_process_df, process_mat)
+        rows = np.flatnonzero(aggr_df["group"].values == i)
+        pd.testing.assert_frame_equal(aggr_df.iloc[rows][["domain","date","path"]].reset_index(drop=True), expected_df, check_dtype=False)
+        np.testing.assert_array_equal(group_mat[rows].toarray(), expected_mat.toarray())
+
+
+@pytest.mark.parametrize("aggr_unit", UNITS)
+def test_sum_by_group_unit_matches_sum_by_unit(group_sums, dictionary, aggr_unit):
+    (output_df, output_mat, raw_df), groups, aggr_df, group_mat = group_sums
+    labels, group_arr, offsets = sum_by_group_unit(aggr_df, group_mat, len(groups), aggr_unit)
+    for i,group in enumerate(groups):
+        rows = np.flatnonzero(aggr_df["group"].values == i)
+        if len(rows) == 0:
+            assert len(labels[i]) == 0 and offsets[i+1] == offsets[i]
+            continue
+        expected_labels, expected_arr = sum_by_unit(aggr_df["date"].values[rows], group_mat[rows], aggr_unit)
+        assert labels[i].equals(expected_labels)
+        np.testing.assert_array_equal(group_arr[offsets[i]:offsets[i+1]], expected_arr)
+
+
+@pytest.mark.parametrize("aggr_unit", UNITS)
+def test_aggregate_headline_groups_mat_matches_select_domains(corpus, dictionary, aggr_unit):
+    output_df, raw_df = corpus
+    output_mat = stack_vectors(output_df, "topvec", dictionary.n_topics)
+    aggr_dfs = aggregate_headline_groups_mat(output_df, output_mat, raw_df, aggr_unit, "majority_topvec", dictionary,
+                                             domain_group_table(DOMAIN_GROUPS), cand="trump")
+    for group,domains in DOMAIN_GROUPS.items():
+        expected_df = aggregate_headline_mat(output_df, output_mat, raw_df, aggr_unit, "majority_topvec", dictionary, cand="trump",
+                                             select_domains=domains)
+        assert aggr_dfs[group]["date"].tolist() == expected_df["date"].tolist()
+        if len(expected_df) > 0:
+            np.testing.assert_array_equal(np.vstack(aggr_dfs[group]["majority_topvec"].values), np.vstack(expected_df["majority_topvec"].values))
+
+
+@pytest.mark.parametrize("aggr_unit", UNITS)
+def test_aggregate_rows_mat_matches_dataframe_path_per_group(corpus, dictionary, aggr_unit):
+    output_df, _ = corpus
+    rng = np.random.default_rng(1)
+    survey_df = output_df.assign(partyln=rng.choice(["Democrat", "Republican", "Independent"], len(output_df)),
+                                 weights=rng.uniform(0.5, 2, len(output_df)))
+    survey_mat = stack_vectors(survey_df, "topvec", dictionary.n_topics)
+    for leaning in ["", "Democrat", "Republican", "Independent"]:
+        expected_df = aggregate_survey_topvec(survey_df, aggr_unit, "biden", dictionary, select_leaning=leaning)
+        aggr_df = aggregate_survey_topvec(survey_df, aggr_unit, "biden", dictionary, select_leaning=leaning, output_mat=survey_mat)
+        assert pd.to_datetime(aggr_df["date"]).tolist() == pd.to_datetime(expected_df["date"]).tolist()
+        np.testing.assert_array_equal(np.vstack(aggr_df["majority_topvec"].values), np.vstack(expected_df["majority_topvec"].values))
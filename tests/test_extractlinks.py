@@ -0,0 +1,83 @@
+"""Tests of the streaming link extraction (scan_links) against the original BeautifulSoup extractor, and of the fused
+extraction + filtering against extractlinksnew.py followed by filterbylinks.py
+
+Run from the root of the repository: python -m pytest tests
+"""
+
+import io
+import os
+import time
+
+import pytest
+
+from extractlinksnew import extract_all_links, extract_links_from_body, format_link, scan_links, scan_links_fast
+from snapshot_manifest import scan_snapshot
+from filterbylinks import filter_domain
+
+SNAPSHOTS = [
+    '<html><body><a href="/1">Trump wins</a><a href="/2"><b>Biden</b></a><a>no href</a></body></html>',
+    '<html><body><a href="/1">  </a><a href="/2">\n   \n</a><a href="/3">\t</a><a href="/4"></a></body></html>',
+    '<html><body><pre><a href="/1">  </a><a href="/2"> \n </a></pre><textarea><a href="/3"> </a></textarea></body></html>',
+    '<html><body><a href="/1"><!-- a comment --></a><a href="/2"><!-- --></a><a href="/3"><!----></a></body></html>',
+    '<html><body><a href="/1">two <b>children</b></a><a href="/2"><span><i>nested</i></span></a><a href="/3"><img src="x"></a></body></html>',
+    '<html><body><a href="/1">Clinton &amp; Trump &#8212; debate</a><a href="/2">café</a><a href="/3"><b> </b></a></body></html>',
+    '<html><body><a href="/1">tab\there\r\nand newline</a><p><a href="/2">unclosed <p>para</a></body></html>',
+    '<html><head><meta charset="iso-8859-1"></head><body><a href="/1">été</a></body></html>',
+]
+
+
+@pytest.mark.parametrize("html", SNAPSHOTS)
+def test_scan_links_matches_beautifulsoup(html, tmp_path):
+    snapshot_path = str(tmp_path / "20200701000000")
+    encoding = "iso-8859-1" if "iso-8859-1" in html else "utf-8"
+    with open(snapshot_path, "wb") as f:
+        f.write(html.encode(encoding))
+    expected = io.StringIO()
+    extract_links_from_body(expected, "d0.com", "20200701000000", snapshot_path, "2020-07-01")
+    lines = "".join(format_link("2020-07-01", "d0.com", "20200701000000", text, href) for text,href in scan_links(snapshot_path))
+    assert lines == expected.getvalue()
+
+
+SNAPSHOT_LINKS = [
+    '<a href="/1">Trump wins</a><a href="/2">JOE Biden\tsays</a><a href="/3">weather</a><a href="/4">Hillary "Clinton" and Trump</a>',
+    '<a href="/1">  </a><a href="/2">NaN</a><a href="/3">it\'s Donald\'s day</a><a href="/4"><b>biden</b></a><a href="/5">joe-biden, trumpet</a>',
+    '<a href="/1">no candidate</a>',
+    '',
+    '<a href="/1">Trump\r\nand Clinton</a><a href="/2">  trump  </a><a href="/3">Über Biden</a><a href="/4">a\tb\tc\td trump</a>',
+]
+
+
+def test_fused_filter_matches_extract_then_filter(tmp_path):
+    input_folder = str(tmp_path / "snapshots") + "/"
+    for domain in ["d0.com", "d1.com"]:
+        os.makedirs(input_folder + "www." + domain)
+        for i,links in enumerate(SNAPSHOT_LINKS):
+            with open(input_folder + f"www.{domain}/2020070{i+1}120000.snapshot", "w") as f:
+                f.write(f"<html><body>{links}</body></html>")
+    extracted_folder, filtered_folder, fused_folder = [str(tmp_path / name) + "/" for name in ["extracted", "filtered", "fused"]]
+    for folder in [extracted_folder, filtered_folder, fused_folder]:
+        os.makedirs(folder)
+
+    extract_all_links(input_folder, extracted_folder, ["d0.com", "d1.com"], n_workers=1)
+    extract_all_links(input_folder, fused_folder, ["d0.com", "d1.com"], n_workers=1, fused=True)
+    for domain in ["d0.com", "d1.com"]:
+        filter_domain((domain, extracted_folder + f"www.{domain}_All-Extracted-Links.tsv", filtered_folder + f"www.{domain}_All-Filtered-Links.tsv"))
+        with open(filtered_folder + f"www.{domain}_All-Filtered-Links.tsv", "rb") as f:
+            expected = f.read()
+        with open(fused_folder + f"www.{domain}_All-Filtered-Links.tsv", "rb") as f:
+            assert f.read() == expected
+        assert expected.count(b"\n") > 5
+
+
+def test_scan_snapshot_falls_back_on_size_timeout_and_reports_errors(tmp_path):
+    snapshot_path = str(tmp_path / "20200701000000.snapshot")
+    with open(snapshot_path, "w") as f:
+        f.write('<html><body><a href="/1">Trump wins</a></body></html>')
+    expected = [("Trump wins", "/1")]
+    assert scan_snapshot(scan_links, scan_links_fast, snapshot_path, 0, 0)[:3] == (expected, "done", "lxml")
+    assert scan_snapshot(scan_links, scan_links_fast, snapshot_path, 0, 10)[:3] == (expected, "fallback", "regex")
+    slow_scan = lambda path: time.sleep(5)
+    assert scan_snapshot(slow_scan, scan_links_fast, snapshot_path, 0.2, 0, parser="html.parser")[:3] == (expected, "fallback", "regex")
+    assert scan_snapshot(slow_scan, slow_scan, snapshot_path, 0.2, 0)[:3] == ([], "timeout", "regex")
+    links, status, _, n_bytes, error = scan_snapshot(scan_links, scan_links_fast, str(tmp_path / "missing.snapshot"), 0, 0)
+    assert (links, status, n_bytes) == ([], "error", 0) and "FileNotFoundError" in error
@@ -0,0 +1,76 @@
+"""Tests of the chunked link filter against the previous reader (python engine, the whole file at once)"""
+
+import io
+import random
+import re
+
+import pandas as pd
+import pytest
+
+from filterbylinks import CAND_COLUMNS, cand_bits, read_and_filter
+
+CAND_PATTERNS = {"if_trump": r"\btrump\b|\bdonald\b", "if_biden": r"\bjoe\b|\bbiden\b", "if_clinton": r"\bhillary\b|\bclinton\b"}
+WORDS = ["Trump", "DONALD", "joe", "Biden's", "hillary", "Clinton", "trumpet", "news", "the", "'quoted", "it's", '"dq"', "NaN",
+         "null", "joe-biden", "über", "İstanbul"]
+LINES = [
+    "20200615000000\td0.com\tp/0\tTrump wins\thttp://x/0\t2",
+    "20200615000001\td0.com\tp/1\t'Biden' says 'no'\thttp://x/1\t3",  # quotes are kept as they are
+    "20200615000002\td0.com\tp/2\t\"Clinton\" \"quoted\"\thttp://x/2\t2",
+    "20200615000003\td0.com\tp/3\ttrump\thttp://x/3\t1\textra",  # more than 6 fields: skipped
+    "20200615000004\td0.com\tp/4\tjoe biden",  # fewer fields
+    "   20200615000005\td0.com\tp/5\t  Donald Trump  \thttp://x/5\t2   ",  # stripped
+    "20200615000006\td0.com\tp/6\tNaN\thttp://x/6\t1",
+    "20200615000007\td0.com\tp/7\t\thttp://x/7\t0",
+    "20200615000008\td0.com\tp/8\tNA\thttp://x/8\t1",
+    "",
+    "20200615000009\td0.com\tp/9\tno candidate here\thttp://x/9\t3",
+]
+
+
+# ---- previous implementation ---- #
+
+def read_and_filter_before(fpath):
+    df = pd.read_csv(fpath, sep="\\t", quotechar="'", engine="python",
+                     names=["timestamp", "domain", "path", "headline", "link", "value"], on_bad_lines="skip")
+    if len(df) > 0:
+        df["headline"] = df["headline"].map(lambda x: str(x).lower())
+        df["if_trump"] = df["headline"].str.contains(CAND_PATTERNS["if_trump"]).astype(int)
+        df["if_biden"] = df["headline"].str.contains(CAND_PATTERNS["if_biden"]).astype(int)
+        df["if_clinton"] = df["headline"].str.contains(CAND_PATTERNS["if_clinton"]).astype(int)
+        filtered_df = df[(df["if_trump"]==1)|(df["if_biden"]==1)|(df["if_clinton"]==1)]
+        return filtered_df[["timestamp", "path", "domain", "headline", "if_trump", "if_biden", "if_clinton"]]
+    return pd.DataFrame()
+
+
+# ---- tests ---- #
+
+def sample_lines(n_lines, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(n_lines):
+        headline = " ".join(rnd.choices(WORDS, k=rnd.randint(1, 8)))
+        lines.append(rnd.choice(LINES) if rnd.random() < 0.1 else f"20200615{i:06d}\td{i%3}.com\tp/{i}\t{headline}\thttp://x/{i}\t{len(headline.split())}")
+    return lines
+
+
+def as_tsv(df):
+    out = io.StringIO()
+    if len(df) > 0:
+        df.to_csv(out, sep="\t", index=False)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("lines", [LINES, [], ["", "   "], sample_lines(500)])
+@pytest.mark.parametrize("chunksize", [1, 7, 200000])
+def test_read_and_filter_matches_python_engine(tmp_path, lines, chunksize):
+    fpath = str(tmp_path / "links.tsv")
+    with open(fpath, "w") as f:
+        f.write("".join(line + "\n" for line in lines))
+    assert as_tsv(read_and_filter(fpath, chunksize=chunksize)) == as_tsv(read_and_filter_before(fpath))
+
+
+def test_cand_bits_match_the_pattern_of_every_candidate():
+    for line in sample_lines(2000, seed=1):
+        headline = (line.split("\t") + [""]*4)[3].lower()
+        bits = cand_bits(headline)
+        assert [(bits >> i) & 1 for i in range(len(CAND_COLUMNS))] == [int(re.search(CAND_PATTERNS[col], headline) is not None) for col in CAND_COLUMNS]
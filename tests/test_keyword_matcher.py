@@ -0,0 +1,160 @@
+"""Regression test of resolve_overlaps against the previous pairwise overlap resolution (adjust_pos)
+
+Run from the root of the repository: python -m pytest tests
+"""
+
+import random
+import re
+
+import numpy as np
+import pytest
+
+from src.utils.keyword_matcher import KeywordMatcher, resolve_overlaps, search_pattern_pos
+
+# dictionary words nested in each other ("barack" in "barack obama", "wall" in "border wall" and "build the wall", ...)
+WORDS = [
+    "barack", "obama", "barack obama", "president obama", "president barack obama", "obama care",
+    "trump", "donald trump", "president trump", "president", "president donald trump",
+    "wall", "border wall", "build the wall", "the wall", "border",
+    "tax", "tax cut", "tax cuts", "cut", "middle class tax cut", "middle class",
+    "health care", "care", "health", "dr. oz", "oz", "covid 19", "19",
+]
+
+HEADLINES = [
+    "barack obama says barack and obama are the same",
+    "president barack obama meets president obama",
+    "barack obama barack obama barack",
+    "obama barack obama obama",
+    "barack barack obama obama care",
+    "president trump and president donald trump on the wall",
+    "donald trump donald trump trump",
+    "trump says build the wall build the wall now",
+    "the border wall and the wall on the border",
+    "build the border wall the wall",
+    "middle class tax cut or tax cuts for the middle class",
+    "tax cut tax cuts tax tax cut",
+    "cut the tax cut",
+    "health care health care care for health",
+    "obama care and health care",
+    "dr. oz on covid 19 and oz",
+    "covid 19 cases reach 19 million",
+    "no keyword in this headline",
+    "",
+]
+
+
+def overlap_words_of(words):
+    """The words containing every word, with the previous rule of TopicDictionary.construct_overlap_matrix"""
+    overlap_mat = np.zeros((len(words), len(words)))
+    for idx_i,i in enumerate(words):
+        for idx_j,j in enumerate(words):
+            if (" " + i in j) or (i + " " in j) or (" " + i + " " in j):
+                overlap_mat[idx_i, idx_j] += 1
+    return overlap_mat, [np.nonzero(row)[0].tolist() for row in overlap_mat]
+
+
+# ---- previous implementation (DictBasedTopicModel.build_wordvec) ---- #
+
+def adjust_pos(pos1, pos2):
+    p1_remove = []
+    p2_remove = []
+    for p1 in pos1:
+        len1 = p1[1] - p1[0]
+        for p2 in pos2:
+            len2 = p2[1] - p2[0]
+            if bool_overlap(p1, p2):
+                if len1 < len2:
+                    p1_remove.append(p1)
+                else:
+                    p2_remove.append(p2)
+    for p1r in p1_remove:
+        pos1.remove(p1r)
+    for p2r in p2_remove:
+        pos2.remove(p2r)
+    return pos1, pos2
+
+def bool_overlap(intv1, intv2):
+    max_lower = max(intv1[0], intv2[0])
+    min_upper = min(intv1[1], intv2[1])
+    if max_lower < min_upper:
+        return True
+    else:
+        return False
+
+def search_all_pos(w, text):
+    p = re.compile(r"\b{}\b".format(w))
+    m = p.search(text)
+    pos = []
+    while m:
+        start,end = m.span()
+        pos.append((start, end))
+        m = p.search(text, start+1)
+    return pos
+
+def count_keywords_before(text, words, overlap_mat):
+    occur_pos = {}
+    occur_words_idx = []
+    for idx_w,w in enumerate(words):
+        pos1 = search_all_pos(w, text)
+        occur_pos[idx_w] = pos1
+        if len(pos1) > 0:
+            occur_words_idx.append(idx_w)
+    for idx1 in occur_words_idx:
+        overlap_words_idx = np.nonzero(overlap_mat[idx1])[0]
+        for idx2 in overlap_words_idx:
+            if len(occur_pos[idx2]) > 0:
+                adjust_pos(occur_pos[idx1], occur_pos[idx2])
+    return {idx: len(pos) for idx,pos in occur_pos.items() if len(pos) > 0}
+
+
+# ---- tests ---- #
+
+def sample_headlines(n_texts, seed=0):
+    """Headlines made of dictionary words (some repeated or adjacent) and filler words"""
+    rnd = random.Random(seed)
+    filler = ["the", "says", "on", "and", "new", "poll", "for", "a"]
+    texts = []
+    for _ in range(n_texts):
+        tokens = []
+        for _ in range(rnd.randint(1, 8)):
+            tokens.append(rnd.choice(WORDS) if rnd.random() < 0.6 else rnd.choice(filler))
+        texts.append(" ".join(tokens))
+    return texts
+
+
+def count_keywords_after(text, matcher, overlap_words):
+    return {idx: len(pos) for idx,pos in resolve_overlaps(matcher.find_all(text), overlap_words).items()}
+
+
+@pytest.mark.parametrize("text", HEADLINES)
+def test_resolve_overlaps_matches_adjust_pos(text):
+    overlap_mat, overlap_words = overlap_words_of(WORDS)
+    occur_pos = {idx: pos for idx,w in enumerate(WORDS) if len(pos := search_all_pos(w, text)) > 0}
+    counts = {idx: len(pos) for idx,pos in resolve_overlaps(occur_pos, overlap_words).items()}
+    assert counts == count_keywords_before(text, WORDS, overlap_mat)
+
+
+def test_keyword_counts_match_on_sampled_headlines():
+    overlap_mat, overlap_words = overlap_words_of(WORDS)
+    matcher = KeywordMatcher(WORDS)
+    for text in sample_headlines(2000):
+        assert count_keywords_after(text, matcher, overlap_words) == count_keywords_before(text, WORDS, overlap_mat), text
+
+
+def test_short_match_overlapping_two_longer_matches():
+    # the middle "tax" overlaps both matches of "tax cut tax": adjust_pos removed it twice (ValueError), it is now dropped once
+    words = ["tax", "tax cut tax"]
+    overlap_mat, overlap_words = overlap_words_of(words)
+    text = "tax cut tax cut tax"
+    with pytest.raises(ValueError):
+        count_keywords_before(text, words, overlap_mat)
+    occur_pos = KeywordMatcher(words).find_all(text)
+    assert occur_pos == {0: [(0, 3), (8, 11), (16, 19)], 1: [(0, 11), (8, 19)]}
+    assert resolve_overlaps(occur_pos, overlap_words) == {1: [(0, 11), (8, 19)]}
+
+
+def test_find_all_matches_per_word_regex():
+    matcher = KeywordMatcher(WORDS)
+    for text in HEADLINES + sample_headlines(500, seed=1):
+        expected = {idx: pos for idx,w in enumerate(WORDS) if len(pos := search_pattern_pos(re.compile(r"\b{}\b".format(w)), text)) > 0}
+        assert matcher.find_all(text) == expected, text
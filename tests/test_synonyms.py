@@ -0,0 +1,45 @@
+"""Regression test of synonyms.replace (compiled once per dictionary) against the previous per-call compilation
+
+Run from the root of the repository: python -m pytest tests
+"""
+
+import re
+
+from src.utils.text import synonyms
+
+SYNONYMS = {"barack": "obama", "barack obama": "obama", "donald trump": "trump", "donald j trump": "trump", "joe biden": "biden"}
+
+TEXTS = [
+    "the president, barack obama",
+    "barack and barack obama meet donald j trump",
+    "donald trump says joe biden is not donald",
+    "no synonym in this headline",
+    "",
+]
+
+
+def replace_before(text, synonym_dict):
+    synonym_dict = {
+        key: value
+        for key, value
+        in sorted(synonym_dict.items(), key=lambda item: len(item[0]), reverse=True)
+    }
+
+    def replace(match):
+        return synonym_dict[match.group(0)]
+
+    c_re = re.compile(r"\b(" + "|".join(synonym_dict.keys()) + r")\b")
+    return c_re.sub(replace, text)
+
+
+def test_replace_matches_per_call_compilation():
+    for text in TEXTS:
+        assert synonyms.replace(text, SYNONYMS) == replace_before(text, SYNONYMS), text
+
+
+def test_each_dictionary_gets_its_own_pattern():
+    # dictionaries built on the fly (and freed) must not reuse the pattern of another dictionary with the same id
+    for i in range(100):
+        synonym_dict = {"barack": f"obama{i}"}
+        assert synonyms.replace("barack obama", synonym_dict) == f"obama{i} obama"
+    assert len(synonyms._COMPILED) <= synonyms._MAX_COMPILED